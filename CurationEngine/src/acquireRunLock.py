@@ -0,0 +1,197 @@
+import logging
+import os
+import time
+import traceback
+
+from awsClients import get_client, get_resource
+from curationHistory import get_history_expiry
+from executionConfig import compact_state
+from outputPlanning import get_bucket, get_existing_path
+from pipelineLogging import get_logger, log_event
+from profiling import profiled
+from resultSharing import delete_shared_result, has_other_consumers, is_query_output
+from retryPolicy import classify_exception
+from runLock import (
+    OVERLAP_POLICIES, OVERLAP_QUEUE, OVERLAP_SKIP, OVERLAP_SUPERSEDE, acquire_run_lock,
+    take_over_run_lock)
+from taskGraph import TaskGraph
+from warmUp import warmable
+
+logger = get_logger(__name__)
+
+class AcquireRunLockException(Exception):
+    pass
+
+# Raised by name so the state machine waits for the other run to finish
+class RunInProgressException(Exception):
+    pass
+
+@warmable
+@profiled
+@compact_state
+def lambda_handler(event, context):
+    '''
+    lambda_handler Top level lambda handler ensuring all exceptions
+    are caught and logged.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The event object passed into the method
+    :rtype: Python type - Dict / list / int / string / float / None
+    :raises AcquireRunLockException: On any error or exception
+    '''
+    try:
+        return acquire_lock(event, context)
+    except (AcquireRunLockException, RunInProgressException):
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise classify_exception(e, AcquireRunLockException)
+
+def acquire_lock(event, context):
+    """
+    acquire_lock Takes the run lock of the curation type, so only one
+    execution of a curation runs at a time. If another execution holds it
+    the curation's overlapPolicy decides whether this run is skipped, waits
+    for the lock, or stops the other execution and takes over.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The event object passed into the method
+    :rtype: Python type - Dict / list / int / string / float / None
+    :raises RunInProgressException: While another run holds the lock, when queued
+    """
+    curationDetails = event['curationDetails']
+    curation_type = curationDetails['curationType']
+    execution_name = curationDetails['curationExecutionName']
+    execution_arn = curationDetails.get('curationExecutionArn')
+    table_name = event['settings']['curationStateTableName']
+    # The curation's own policy, otherwise the stack's
+    policy = event.get('overlapPolicy') or os.environ.get('OVERLAP_POLICY', OVERLAP_SKIP)
+    if policy not in OVERLAP_POLICIES:
+        raise AcquireRunLockException(
+            f'Unknown overlapPolicy {policy}, expected one of {", ".join(OVERLAP_POLICIES)}')
+
+    runLock = {'acquired': True, 'policy': policy}
+    lock = acquire_run_lock(table_name, curation_type, execution_name, execution_arn)
+    if lock != None:
+        runLock['heldBy'] = lock['executionName']
+
+        if policy == OVERLAP_QUEUE:
+            raise RunInProgressException(
+                f'Waiting for {lock["executionName"]} to finish before running {curation_type}')
+
+        if policy == OVERLAP_SUPERSEDE and lock.get('executionArn') != None:
+            stopped = stop_execution(lock['executionArn'], execution_name)
+            runLock['acquired'] = take_over_run_lock(
+                table_name, curation_type, execution_name, execution_arn, lock['executionName'])
+            runLock['superseded'] = lock['executionName']
+            if stopped and runLock['acquired']:
+                clean_up_superseded_run(event, lock)
+        else:
+            # Executions without an ARN (e.g. started before it was recorded)
+            # cannot be stopped, so are never superseded
+            runLock['acquired'] = False
+
+    if not runLock['acquired']:
+        log_event(
+            logger, logging.INFO, 'Skipped run, another run is in progress',
+            curationType=curation_type, curationExecutionName=execution_name,
+            heldBy=runLock['heldBy'], overlapPolicy=policy)
+
+    event.update({'runLock': runLock})
+    return event
+
+def stop_execution(execution_arn, execution_name):
+    client = get_client('stepfunctions')
+
+    try:
+        client.stop_execution(
+            executionArn=execution_arn,
+            error='RunSuperseded',
+            cause=f'Superseded by {execution_name}'
+        )
+        return True
+    except client.exceptions.ExecutionDoesNotExist:
+        return False # Already finished and expired
+
+def clean_up_superseded_run(event, lock):
+    '''
+    clean_up_superseded_run Does what the stopped execution can no longer
+    do itself, it records the run in the curation history, stops its athena
+    query and releases the shared athena result it joined.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param lock: The lock taken from the stopped execution
+    :type lock: Python Dict
+    '''
+    table_name = event['settings']['curationStateTableName']
+    run_query = lock.get('runQuery')
+
+    graph = TaskGraph()
+    graph.add('recordSupersededRun', record_superseded_run, event, lock)
+    if run_query != None:
+        graph.add('stopSupersededQuery', stop_superseded_query, table_name, run_query)
+        if 'shareKey' in run_query:
+            graph.add(
+                'releaseSharedResult', release_superseded_result, event, lock,
+                depends_on=['stopSupersededQuery'])
+
+    try:
+        graph.run()
+    except Exception:
+        # The lock is already taken over, failing the run would not retry this
+        traceback.print_exc()
+
+def record_superseded_run(event, lock):
+    superseded_by = event['curationDetails']['curationExecutionName']
+    timestamp = int(time.time() * 1000)
+
+    dynamodb_item = {
+        'curationType': event['curationDetails']['curationType'],
+        'timestamp': timestamp,
+        'curationExecutionName': lock['executionName'],
+        'error': 'RunSuperseded',
+        'errorCause': {'errorMessage': f'Superseded by {superseded_by}', 'errorType': 'RunSuperseded'}
+    }
+    if 'runQuery' in lock:
+        dynamodb_item['athenaQueryExecutionId'] = lock['runQuery']['queryExecutionId']
+        dynamodb_item['queryOutputLocation'] = lock['runQuery']['queryOutputLocation']
+    if 'acquiredAt' in lock:
+        dynamodb_item['durationMs'] = timestamp - int(lock['acquiredAt']) * 1000
+
+    expires_at = get_history_expiry(timestamp)
+    if expires_at != None:
+        dynamodb_item['expiresAt'] = expires_at
+
+    get_resource('dynamodb').Table(event['settings']['curationHistoryTableName']).put_item(Item=dynamodb_item)
+
+def release_superseded_result(event, lock):
+    # The result is kept where the stopped run would have kept it
+    athenaDetails = event['athenaDetails']
+    run_query = lock['runQuery']
+    query_output_location = run_query['queryOutputLocation']
+
+    delete_shared_result(
+        event['settings']['curationStateTableName'], run_query['queryExecutionId'], lock['executionName'],
+        athenaDetails['deleteAthenaQueryFile'] != True or is_query_output(event, query_output_location),
+        athenaDetails['deleteMetadataFileBool'] != True,
+        get_existing_path(query_output_location), get_bucket(query_output_location),
+        run_query.get('accountDetails'))
+
+def stop_superseded_query(table_name, run_query):
+    # A shared query still serves the curations that joined it
+    if 'shareKey' in run_query and has_other_consumers(table_name, run_query['queryExecutionId']):
+        return
+
+    client = get_client('athena', run_query.get('accountDetails'))
+
+    execution = client.get_query_execution(
+        QueryExecutionId=run_query['queryExecutionId']
+    )['QueryExecution']
+    if execution['Status']['State'] in ('QUEUED', 'RUNNING'):
+        client.stop_query_execution(
+            QueryExecutionId=run_query['queryExecutionId']
+        )
@@ -0,0 +1,143 @@
+import json
+import traceback
+import os
+import time
+
+from awsClients import get_client
+from profiling import profiled
+from retryPolicy import backoff_delay
+from streamProcessing import get_records
+
+# Firehose accepts at most 500 records per put_record_batch call
+FIREHOSE_BATCH_SIZE = 500
+# Columns of the archive glue table, everything else is kept in details
+ARCHIVE_COLUMNS = [
+    'timestamp',
+    'curationExecutionName',
+    'athenaQueryExecutionId',
+    'scriptFileCommitId',
+    'configVersion',
+    'queryOutputLocation',
+    'curationOutputLocation',
+    'error'
+]
+
+class ArchiveCurationHistoryException(Exception):
+    pass
+
+@profiled
+def lambda_handler(event, context):
+    '''
+    lambda_handler Top level lambda handler ensuring all exceptions
+    are caught and logged.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The event object passed into the method
+    :rtype: Python type - Dict / list / int / string / float / None
+    :raises ArchiveCurationHistoryException: On any error or exception
+    '''
+    try:
+        return archive_curation_history(event, context)
+    except ArchiveCurationHistoryException:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise ArchiveCurationHistoryException(e)
+
+def archive_curation_history(event, context):
+    """
+    archive_curation_history Sends curation history items removed by the
+    DynamoDB TTL to firehose, which compacts them into partitioned parquet.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The event object passed into the method
+    :rtype: Python type - Dict / list / int / string / float / None
+    """
+    delivery_stream_name = os.environ['ARCHIVE_DELIVERY_STREAM_NAME']
+
+    archive_records = []
+    for record in get_records(event, event_names=('REMOVE',)):
+        if not is_expired_record(record):
+            continue
+
+        archive_row = to_archive_row(record.old_image())
+        archive_records.append({'Data': json.dumps(archive_row, default=str) + '\n'})
+
+    for i in range(0, len(archive_records), FIREHOSE_BATCH_SIZE):
+        put_records(delivery_stream_name, archive_records[i:i + FIREHOSE_BATCH_SIZE])
+
+    print(f'Archived {len(archive_records)} expired curation history items')
+
+    return 'Success'
+
+def is_expired_record(record):
+    '''
+    is_expired_record Checks that the stream record is a removal
+    made by the DynamoDB TTL process rather than by a user.
+    :param record: The DynamoDB stream record
+    :type record: streamProcessing.StreamRecord
+    :return: True if the item was removed because it expired
+    :rtype: Python Boolean
+    '''
+    if not record.has_old_image:
+        return False
+
+    user_identity = record.user_identity
+    return user_identity.get('type') == 'Service' and \
+        user_identity.get('principalId') == 'dynamodb.amazonaws.com'
+
+def to_archive_row(doc_fields):
+    '''
+    to_archive_row Flattens the history item into the archive table
+    columns, the remaining attributes are kept as a JSON document.
+    :param doc_fields: The deserialized history item
+    :type doc_fields: Python Dict
+    :return: The row to send to firehose
+    :rtype: Python Dict
+    '''
+    details = dict(doc_fields)
+    archive_row = {'curationType': details.pop('curationType')}
+    for column in ARCHIVE_COLUMNS:
+        if column in details:
+            archive_row[column] = details.pop(column)
+    archive_row['timestamp'] = int(archive_row['timestamp'])
+
+    if 'errorCause' in details:
+        archive_row['errorCause'] = json.dumps(details.pop('errorCause'), default=str)
+    details.pop('expiresAt', None)
+    archive_row['details'] = json.dumps(details, default=str)
+
+    return archive_row
+
+def put_records(delivery_stream_name, records):
+    '''
+    put_records Sends a batch of records to firehose, retrying
+    any records firehose failed to accept.
+    :param delivery_stream_name: The firehose delivery stream name
+    :type delivery_stream_name: Python String
+    :param records: The firehose records to send
+    :type records: Python List
+    '''
+    client = get_client('firehose')
+
+    attempts = 0
+    while records:
+        attempts += 1
+        response = client.put_record_batch(
+            DeliveryStreamName=delivery_stream_name,
+            Records=records
+        )
+        if response['FailedPutCount'] == 0:
+            return
+        if attempts >= 3:
+            raise ArchiveCurationHistoryException(
+                f'{response["FailedPutCount"]} records could not be archived')
+
+        records = [record for record, result in zip(records, response['RequestResponses'])
+            if 'ErrorCode' in result]
+        # Failed records are usually throttled, back off before sending them again
+        time.sleep(backoff_delay(attempts))
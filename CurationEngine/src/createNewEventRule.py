@@ -2,25 +2,22 @@ import traceback
 import os
 import json
 import logging
+from functools import partial
 
-import boto3
 import botocore
-from boto3.dynamodb.types import TypeDeserializer
 
-logger = logging.getLogger()
+from awsClients import get_client
+from pipelineLogging import get_logger, log_event
+from profiling import profiled
+from schedulePlanning import spread_schedule
+from streamProcessing import process_records
+
+logger = get_logger(__name__)
 
 class CreateNewEventRuleException(Exception):
 	pass
 
-# Subclass of boto's TypeDeserializer for DynamoDB to adjust
-# for DynamoDB Stream format.
-class StreamTypeDeserializer(TypeDeserializer):
-	def _deserialize_n(self, value):
-		return float(value)
-
-	def _deserialize_b(self, value):
-		return value  # Already in Base64
-
+@profiled
 def lambda_handler(event, context):
 	'''
 	lambda_handler Top level lambda handler ensuring all exceptions
@@ -49,44 +46,58 @@ def create_new_event_rule(event, context):
 	:type event: Python type - Dict / list / int / string / float / None
 	:param context: AWS Lambda uses this to pass in runtime information.
 	:type context: LambdaContext
-	:return: The event object passed into the method
-	:rtype: Python type - Dict / list / int / string / float / None
+	:return: The partial batch response, reporting the first failed record
+	:rtype: Python Dict
 	"""
-	ddb_deserializer = StreamTypeDeserializer()
-	records = event['Records']
 	start_curation_process_function_arn = os.environ['START_CURATION_PROCESS_FUNCTION_ARN']
-	for record in records:
-		ddb = record['dynamodb']
-		# Get the event type and curation type for the record
-		event_name = record['eventName'].upper()  # INSERT, MODIFY, REMOVE
-		if (event_name == 'INSERT') or (event_name == 'MODIFY'):
-			if 'NewImage' not in ddb:
-				logger.warning(
-					'Cannot process stream if it does not contain NewImage')
-				continue
-			
-			doc_fields = ddb_deserializer.deserialize({'M': ddb['NewImage']})
-			curation_type = doc_fields['curationType']
-			
-			print(f'Creating or modifying event for curationType {curation_type}')
-			
-			put_rule(curation_type, doc_fields['cronExpression'])
-			put_target(curation_type, start_curation_process_function_arn)
-		
-		elif event_name == 'REMOVE':
-			doc_fields = ddb_deserializer.deserialize({'M': ddb['Keys']})
-			curation_type = doc_fields['curationType']
-			
-			print(f'Removing event for curationType {curation_type}')
-			
-			remove_targets(curation_type)
-			delete_rule(curation_type)
+	spread_minutes = int(os.environ.get('SCHEDULE_SPREAD_MINUTES', '0'))
 
-	return 'Success'
+	# Only the last change to each curation type in the batch matters
+	return process_records(
+		event, partial(
+			process_record, function_arn=start_curation_process_function_arn,
+			spread_minutes=spread_minutes))
+
+def process_record(record, function_arn, spread_minutes=0):
+	'''
+	process_record Creates, updates or removes the event rule and target
+	for the curation type of a single stream record.
+	:param record: The curation details stream record
+	:type record: streamProcessing.StreamRecord
+	:param function_arn: The start curation processing function ARN
+	:type function_arn: Python String
+	:param spread_minutes: The minutes scheduled runs are spread over, 0 for none
+	:type spread_minutes: Python Integer
+	'''
+	curation_type = record.keys['curationType']
+
+	if (record.event_name == 'INSERT') or (record.event_name == 'MODIFY'):
+		if not record.has_new_image:
+			log_event(
+				logger, logging.WARNING, 'Cannot process stream if it does not contain NewImage',
+				curationType=curation_type)
+			return
+		
+		log_event(logger, logging.INFO, 'Creating or modifying event rule', curationType=curation_type)
+		
+		# Curations scheduled for the same minute are spread across the window,
+		# each curation type always moving by the same offset
+		schedule_expression = record.get_new('cronExpression')
+		if record.get_new('spreadSchedule') != False:
+			schedule_expression = spread_schedule(schedule_expression, curation_type, spread_minutes)
+
+		put_rule(curation_type, schedule_expression)
+		put_target(curation_type, function_arn)
+	
+	elif record.event_name == 'REMOVE':
+		log_event(logger, logging.INFO, 'Removing event rule', curationType=curation_type)
+		
+		remove_targets(curation_type)
+		delete_rule(curation_type)
 
 def put_rule(curation_type, schedule_expression):
 	
-	client = boto3.client('events')
+	client = get_client('events')
 
 	response = client.put_rule(
 		Name=f'{curation_type}-scheduled-curation',
@@ -97,7 +108,7 @@ def put_rule(curation_type, schedule_expression):
 
 def delete_rule(curation_type):
 	
-	client = boto3.client('events')
+	client = get_client('events')
 
 	response = client.delete_rule(
 		Name=f'{curation_type}-scheduled-curation'
@@ -105,9 +116,12 @@ def delete_rule(curation_type):
 
 def put_target(curation_type, function_arn):
 	
-	client = boto3.client('events')
+	client = get_client('events')
 
 	input = {"curationType": curation_type}
+	# The time of the scheduled event is its schedule slot, the same for
+	# every delivery, which names the execution so duplicates are rejected
+	input_template = get_input_template(input, {'scheduledTime': '<scheduledTime>'})
 
 	response = client.put_targets(
 		Rule=f'{curation_type}-scheduled-curation',
@@ -115,14 +129,34 @@ def put_target(curation_type, function_arn):
 			{
 				'Id': f'{curation_type}-event-target',
 				'Arn': function_arn,
-				'Input': json.dumps(input)
+				'InputTransformer': {
+					'InputPathsMap': {'scheduledTime': '$.time'},
+					'InputTemplate': input_template
+				}
 			}
 		]
 	)
 
+def get_input_template(input, placeholders):
+	'''
+	get_input_template Builds an input transformer template of the JSON
+	input with the placeholders added as values, event bridge replaces
+	each <name> with the JSON value of its input path.
+	:param input: The static input
+	:type input: Python Dict
+	:param placeholders: The keys and <name> placeholders to add
+	:type placeholders: Python Dict
+	:return: The input template
+	:rtype: Python String
+	'''
+	pairs = [f'{json.dumps(key)}: {json.dumps(value)}' for key, value in input.items()]
+	pairs += [f'{json.dumps(key)}: {placeholder}' for key, placeholder in placeholders.items()]
+
+	return '{' + ', '.join(pairs) + '}'
+
 def remove_targets(curation_type):
 	
-	client = boto3.client('events')
+	client = get_client('events')
 
 	response = client.remove_targets(
 	    Rule=f'{curation_type}-scheduled-curation',
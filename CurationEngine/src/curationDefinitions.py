@@ -0,0 +1,332 @@
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+from awsClients import get_client
+from curationSchema import get_definition_errors
+from pipelineLogging import get_logger, log_event
+from retryPolicy import backoff_delay
+from validateDetails import (
+    does_database_exist, does_output_bucket_exist, does_table_exist,
+    does_workgroup_exist, get_code_commit_file)
+
+# Bulk import and export of curation definitions, run from this folder:
+# python curationDefinitions.py import --table <table> --repo <repo> --directory <dir>
+# python curationDefinitions.py export --table <table> --directory <dir>
+
+# Threads used for the AWS checks, writes and export scan segments
+DEFAULT_WORKERS = 16
+# The most items a batch_write_item request accepts
+BATCH_SIZE = 25
+# Attempts to write the unprocessed items of a batch before giving up
+MAX_WRITE_ATTEMPTS = 8
+
+logger = get_logger(__name__)
+
+# The result of each AWS check, an error or None, for the life of the process
+check_results = {}
+
+class CurationDefinitionsException(Exception):
+    pass
+
+def import_definitions(table_name, scripts_repo, directory, workers=DEFAULT_WORKERS, check_aws=True, dry_run=False):
+    '''
+    import_definitions Validates every curation definition in the directory
+    against the curation details schema and, unless skipped, checks the
+    scripts, glue databases and tables, buckets and workgroups they
+    reference exist. The valid definitions are then written in parallel
+    batches; the invalid ones are reported and not written.
+    :param table_name: The curation details table name
+    :type table_name: Python String
+    :param scripts_repo: The curation scripts CodeCommit repository
+    :type scripts_repo: Python String
+    :param directory: The directory of .json definitions, one or a list per file
+    :type directory: Python String
+    :param workers: The number of threads checking and writing definitions
+    :type workers: Python Integer
+    :param check_aws: Whether the referenced AWS resources are checked
+    :type check_aws: Python Boolean
+    :param dry_run: Validate the definitions without writing them
+    :type dry_run: Python Boolean
+    :return: The import report
+    :rtype: Python Dict
+    '''
+    definitions = load_definitions(directory)
+
+    errors = {}
+    warnings = {}
+    curation_types = {}
+    for source, item in definitions:
+        item_errors, item_warnings = get_definition_errors(item)
+        if isinstance(item, dict) and 'curationType' in item:
+            if item['curationType'] in curation_types:
+                item_errors.append(f'curationType {item["curationType"]} is also defined in {curation_types[item["curationType"]]}')
+            else:
+                curation_types[item['curationType']] = source
+        if item_errors:
+            errors[source] = item_errors
+        if item_warnings:
+            warnings[source] = item_warnings
+
+    if check_aws:
+        checked = [(source, item) for source, item in definitions if source not in errors]
+        for source, item_errors in check_resources(checked, scripts_repo, workers).items():
+            errors[source] = item_errors
+
+    valid = [item for source, item in definitions if source not in errors]
+    written = 0
+    if not dry_run and valid:
+        written = write_definitions(table_name, valid, workers)
+
+    log_event(
+        logger, logging.INFO, 'Imported curation definitions', definitions=len(definitions),
+        invalid=len(errors), written=written)
+    return {
+        'definitions': len(definitions),
+        'valid': len(valid),
+        'written': written,
+        'errors': errors,
+        'warnings': warnings
+    }
+
+def load_definitions(directory):
+    '''
+    load_definitions Reads every .json file under the directory, each a
+    curation definition or a list of them. Numbers are read as decimals,
+    as DynamoDB expects.
+    :param directory: The directory of definitions
+    :type directory: Python String
+    :return: The source (file and index) and definition of each item
+    :rtype: Python List - Tuple
+    '''
+    definitions = []
+    for root, _, files in os.walk(directory):
+        for filename in sorted(files):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(root, filename)
+            with open(path) as definition_file:
+                content = json.load(definition_file, parse_float=Decimal)
+            if isinstance(content, list):
+                definitions.extend((f'{path}[{i}]', item) for i, item in enumerate(content))
+            else:
+                definitions.append((path, content))
+
+    return definitions
+
+def check_resources(definitions, scripts_repo, workers):
+    '''
+    check_resources Checks the AWS resources referenced by the definitions
+    exist. Each distinct resource is checked once, concurrently, however
+    many definitions reference it.
+    :param definitions: The source and definition of each item
+    :type definitions: Python List - Tuple
+    :param scripts_repo: The curation scripts CodeCommit repository
+    :type scripts_repo: Python String
+    :param workers: The number of threads running the checks
+    :type workers: Python Integer
+    :return: The errors of each source with a missing resource
+    :rtype: Python Dict
+    '''
+    item_checks = {source: get_resource_checks(item, scripts_repo) for source, item in definitions}
+    unchecked = set(check for checks in item_checks.values() for check in checks) - set(check_results)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for check, error in zip(unchecked, executor.map(run_check, unchecked)):
+            check_results[check] = error
+
+    errors = {}
+    for source, checks in item_checks.items():
+        item_errors = [check_results[check] for check in checks if check_results[check] != None]
+        if item_errors:
+            errors[source] = item_errors
+
+    return errors
+
+def get_resource_checks(item, scripts_repo):
+    # Checks are hashable so they can be cached, the account is a tuple
+    account = (item.get('region'), item.get('roleArn'))
+    database = item['glueDetails']['database']
+
+    checks = [('script', scripts_repo, item['sqlFilePath'], None), ('database', database, account)]
+    for table in item['glueDetails'].get('tables') or []:
+        # Allow users to include the database in their table name
+        table_database, table_name = table.split('.') if '.' in table else (database, table)
+        checks.append(('table', table_database, table_name, account))
+
+    athenaDetails = item.get('athenaDetails', {})
+    if athenaDetails.get('athenaOutputBucket') != None:
+        checks.append(('bucket', athenaDetails['athenaOutputBucket'], account))
+    if athenaDetails.get('workgroup') != None:
+        checks.append(('workgroup', athenaDetails['workgroup'], account))
+    checks.append(('bucket', item['outputDetails']['outputBucket'], account))
+
+    return checks
+
+def run_check(check):
+    '''
+    run_check Runs a single resource check with the same calls as the
+    validate details step.
+    :param check: The check, its kind followed by its arguments and account
+    :type check: Python Tuple
+    :return: The error, or None if the resource exists
+    :rtype: Python String / None
+    '''
+    kind, arguments, account = check[0], check[1:-1], check[-1]
+    account_details = {'region': account[0], 'roleArn': account[1]} if account != None else None
+    try:
+        if kind == 'script':
+            get_code_commit_file(*arguments)
+        elif kind == 'database':
+            does_database_exist(*arguments, account_details)
+        elif kind == 'table':
+            does_table_exist(*arguments, account_details)
+        elif kind == 'bucket':
+            does_output_bucket_exist(*arguments, account_details)
+        elif kind == 'workgroup':
+            does_workgroup_exist(*arguments, account_details)
+    except Exception as e:
+        name = '.'.join(arguments) if kind == 'table' else arguments[-1]
+        return f'{kind} {name} could not be found: {e}'
+
+    return None
+
+def write_definitions(table_name, items, workers=DEFAULT_WORKERS):
+    '''
+    write_definitions Writes the curation definitions with concurrent
+    batch_write_item requests, retrying any unprocessed items.
+    :param table_name: The curation details table name
+    :type table_name: Python String
+    :param items: The curation definitions
+    :type items: Python List
+    :param workers: The number of batches written at the same time
+    :type workers: Python Integer
+    :return: The number of items written
+    :rtype: Python Integer
+    '''
+    serializer = TypeSerializer()
+    requests = [
+        {'PutRequest': {'Item': {name: serializer.serialize(value) for name, value in item.items()}}}
+        for item in items]
+    batches = [requests[i:i + BATCH_SIZE] for i in range(0, len(requests), BATCH_SIZE)]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(lambda batch: write_batch(table_name, batch), batches))
+
+def write_batch(table_name, requests):
+    client = get_client('dynamodb')
+
+    count = len(requests)
+    for attempt in range(MAX_WRITE_ATTEMPTS):
+        if attempt > 0:
+            time.sleep(backoff_delay(attempt))
+        unprocessed = client.batch_write_item(
+            RequestItems={table_name: requests}
+        ).get('UnprocessedItems', {})
+        requests = unprocessed.get(table_name)
+        if not requests:
+            return count
+
+    raise CurationDefinitionsException(
+        f'{len(requests)} curation definitions were still unprocessed after {MAX_WRITE_ATTEMPTS} attempts')
+
+def export_definitions(table_name, directory, workers=DEFAULT_WORKERS):
+    '''
+    export_definitions Scans the curation details table in parallel
+    segments and writes each definition to <curationType>.json, in the
+    format import_definitions reads.
+    :param table_name: The curation details table name
+    :type table_name: Python String
+    :param directory: The directory the definitions are written to
+    :type directory: Python String
+    :param workers: The number of parallel scan segments
+    :type workers: Python Integer
+    :return: The number of definitions exported
+    :rtype: Python Integer
+    '''
+    os.makedirs(directory, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        exported = sum(executor.map(
+            lambda segment: export_segment(table_name, directory, segment, workers), range(workers)))
+
+    log_event(logger, logging.INFO, 'Exported curation definitions', exported=exported)
+    return exported
+
+def export_segment(table_name, directory, segment, total_segments):
+    client = get_client('dynamodb')
+    deserializer = TypeDeserializer()
+
+    exported = 0
+    paginator = client.get_paginator('scan')
+    for page in paginator.paginate(TableName=table_name, Segment=segment, TotalSegments=total_segments):
+        for record in page['Items']:
+            item = {name: deserializer.deserialize(value) for name, value in record.items()}
+            filename = re.sub(r'[^\w.-]', '_', item['curationType'])
+            with open(os.path.join(directory, f'{filename}.json'), 'w') as definition_file:
+                json.dump(item, definition_file, indent=2, sort_keys=True, default=to_json_number)
+            exported += 1
+
+    return exported
+
+def to_json_number(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Bulk import and export curation definitions.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    import_parser = subparsers.add_parser(
+        'import', help='Validate and write a directory of curation definitions')
+    import_parser.add_argument(
+        '--table', required=True,
+        help='The curation details DynamoDB table name')
+    import_parser.add_argument(
+        '--repo', required=True,
+        help='The curation scripts CodeCommit repository name')
+    import_parser.add_argument(
+        '--directory', required=True,
+        help='The directory of .json curation definitions')
+    import_parser.add_argument(
+        '--workers', type=int, default=DEFAULT_WORKERS,
+        help='The number of threads checking and writing definitions')
+    import_parser.add_argument(
+        '--skip-aws-checks', action='store_true',
+        help='Only validate the definitions against the schema')
+    import_parser.add_argument(
+        '--dry-run', action='store_true',
+        help='Validate the definitions without writing them')
+
+    export_parser = subparsers.add_parser(
+        'export', help='Write every curation definition to a directory')
+    export_parser.add_argument(
+        '--table', required=True,
+        help='The curation details DynamoDB table name')
+    export_parser.add_argument(
+        '--directory', required=True,
+        help='The directory the definitions are written to')
+    export_parser.add_argument(
+        '--workers', type=int, default=DEFAULT_WORKERS,
+        help='The number of parallel scan segments')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        report = import_definitions(
+            args.table, args.repo, args.directory, args.workers,
+            not args.skip_aws_checks, args.dry_run)
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if report['errors'] else 0)
+    elif args.command == 'export':
+        print(json.dumps({'exported': export_definitions(args.table, args.directory, args.workers)}))
+    else:
+        parser.print_help()
@@ -0,0 +1,84 @@
+import json
+import traceback
+
+from executionConfig import compact_state
+from profiling import profiled
+from qualityChecks import clean_up_quality_checks
+from qualityRules import evaluate_quality_rules
+from resultTables import get_query_row
+from retryPolicy import classify_exception
+from warmUp import warmable
+
+class EvaluateQualityChecksException(Exception):
+    pass
+
+@warmable
+@profiled
+@compact_state
+def lambda_handler(event, context):
+    '''
+    lambda_handler Top level lambda handler ensuring all exceptions
+    are caught and logged.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The event object passed into the method
+    :rtype: Python type - Dict / list / int / string / float / None
+    :raises EvaluateQualityChecksException: On any error or exception
+    '''
+    try:
+        return evaluate_quality_checks(event, context)
+    except EvaluateQualityChecksException:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise classify_exception(e, EvaluateQualityChecksException)
+
+def evaluate_quality_checks(event, context):
+    """
+    evaluate_quality_checks Joins the results of the output finalization
+    and the quality checks, compares the quality query with each rule and
+    cleans up the quality check table and any deferred deletes. Failed
+    rules are attached as the error-info for the unsuccessful curation.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The event object passed into the method
+    :rtype: Python type - Dict / list / int / string / float / None
+    """
+    finalizationResults = event.pop('finalizationResults')
+    event.update({'curationDetails': finalizationResults['curationDetails']})
+    qualityDetails = finalizationResults['qualityDetails']
+
+    rules = event.get('qualityRules')
+    if not rules or qualityDetails['status'] == 'SKIPPED':
+        qualityDetails['passed'] = True
+        event.update({'qualityDetails': qualityDetails})
+        return event
+
+    account_details = event.get('accountDetails')
+    try:
+        if qualityDetails['status'] == 'SUCCEEDED':
+            values = get_query_row(qualityDetails['queryExecutionId'], account_details)
+            results = evaluate_quality_rules(rules, values)
+            qualityDetails['results'] = results
+            qualityDetails['passed'] = all(result['passed'] for result in results)
+            failed = [result for result in results if not result['passed']]
+            message = 'Quality rules failed: ' + ', '.join(
+                f'{result["rule"]}({",".join(result["columns"])})={result["actual"]}' for result in failed)
+        else:
+            qualityDetails['passed'] = False
+            message = f'Quality check query {qualityDetails["status"]}: {qualityDetails.get("statusReason")}'
+    finally:
+        clean_up_quality_checks(event, qualityDetails['database'], qualityDetails['queryExecutionId'])
+
+    if not qualityDetails['passed']:
+        event.update({'error-info': {
+            'Error': 'QualityCheckFailedException',
+            'Cause': json.dumps({'errorMessage': message, 'errorType': 'QualityCheckFailedException'})
+        }})
+    event.update({'qualityDetails': qualityDetails})
+
+    return event
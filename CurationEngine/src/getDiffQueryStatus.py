@@ -0,0 +1,95 @@
+import traceback
+
+from awsClients import get_client
+from executionConfig import compact_state
+from profiling import profiled
+from resultTables import delete_table
+from retryPolicy import classify_exception
+from taskGraph import TaskGraph
+from warmUp import warmable
+from workflowRouting import is_past_deadline
+
+class GetDiffQueryStatusException(Exception):
+    pass
+
+@warmable
+@profiled
+@compact_state
+def lambda_handler(event, context):
+    '''
+    lambda_handler Top level lambda handler ensuring all exceptions
+    are caught and logged.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The event object passed into the method
+    :rtype: Python type - Dict / list / int / string / float / None
+    :raises GetDiffQueryStatusException: On any error or exception
+    '''
+    try:
+        return get_diff_query_status(event, context)
+    except GetDiffQueryStatusException:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise classify_exception(e, GetDiffQueryStatusException)
+
+def get_diff_query_status(event, context):
+    """
+    get_diff_query_status Retrieves the status of the diff query; failed,
+    successful, or still running. Once it has finished its tables are
+    dropped, and a failed diff query fails the curation.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The event object passed into the method
+    :rtype: Python type - Dict / list / int / string / float / None
+    """
+    diffDetails = event['diffDetails']
+    account_details = event.get('accountDetails')
+
+    status, reason, output_location = get_status(diffDetails['queryExecutionId'], account_details)
+    diffDetails['status'] = status
+
+    # Fail an express execution while it can still record the curation
+    if status in ('QUEUED', 'RUNNING') and is_past_deadline(event):
+        stop_query(diffDetails['queryExecutionId'], account_details)
+        status = 'CANCELLED'
+        reason = 'The diff query did not finish before the express execution deadline'
+
+    if status in ('SUCCEEDED', 'FAILED', 'CANCELLED'):
+        drop_tables(diffDetails['database'], diffDetails['tables'], account_details)
+    if status in ('FAILED', 'CANCELLED'):
+        raise GetDiffQueryStatusException(f'Diff query {status}: {reason}')
+    if status == 'SUCCEEDED':
+        diffDetails['queryOutputLocation'] = output_location
+
+    event.update({'diffDetails': diffDetails})
+
+    return event
+
+def drop_tables(database, tables, account_details=None):
+    graph = TaskGraph()
+    for table_name in tables:
+        graph.add(table_name, delete_table, database, table_name, account_details)
+    graph.run()
+
+def get_status(query_execution_id, account_details=None):
+    client = get_client('athena', account_details)
+
+    response = client.get_query_execution(
+        QueryExecutionId=query_execution_id
+    )
+    execution = response['QueryExecution']
+
+    return execution['Status']['State'], execution['Status'].get('StateChangeReason'), \
+        execution.get('ResultConfiguration', {}).get('OutputLocation')
+
+def stop_query(query_execution_id, account_details=None):
+    client = get_client('athena', account_details)
+
+    client.stop_query_execution(
+        QueryExecutionId=query_execution_id
+    )
@@ -0,0 +1,78 @@
+import traceback
+
+from awsClients import get_client
+from executionConfig import compact_state
+from profiling import profiled
+from retryPolicy import classify_exception
+from warmUp import warmable
+from workflowRouting import is_past_deadline
+
+class GetQualityCheckStatusException(Exception):
+    pass
+
+@warmable
+@profiled
+@compact_state
+def lambda_handler(event, context):
+    '''
+    lambda_handler Top level lambda handler ensuring all exceptions
+    are caught and logged.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The event object passed into the method
+    :rtype: Python type - Dict / list / int / string / float / None
+    :raises GetQualityCheckStatusException: On any error or exception
+    '''
+    try:
+        return get_quality_check_status(event, context)
+    except GetQualityCheckStatusException:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise classify_exception(e, GetQualityCheckStatusException)
+
+def get_quality_check_status(event, context):
+    """
+    get_quality_check_status Retrieves the status of the quality check
+    query; failed, successful, or still running.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The event object passed into the method
+    :rtype: Python type - Dict / list / int / string / float / None
+    """
+    qualityDetails = event['qualityDetails']
+
+    status, reason = get_status(qualityDetails['queryExecutionId'], event.get('accountDetails'))
+    qualityDetails['status'] = status
+    if reason != None:
+        qualityDetails['statusReason'] = reason
+
+    # Fail an express execution while it can still record the curation
+    if status in ('QUEUED', 'RUNNING') and is_past_deadline(event):
+        stop_query(qualityDetails['queryExecutionId'], event.get('accountDetails'))
+        raise GetQualityCheckStatusException('Quality checks did not finish before the express execution deadline')
+
+    event.update({'qualityDetails': qualityDetails})
+
+    return event
+
+def get_status(query_execution_id, account_details=None):
+    client = get_client('athena', account_details)
+
+    response = client.get_query_execution(
+        QueryExecutionId=query_execution_id
+    )
+    status = response['QueryExecution']['Status']
+
+    return status['State'], status.get('StateChangeReason')
+
+def stop_query(query_execution_id, account_details=None):
+    client = get_client('athena', account_details)
+
+    client.stop_query_execution(
+        QueryExecutionId=query_execution_id
+    )
@@ -1,7 +1,14 @@
+import json
 import traceback
 import os
 
-import boto3
+from awsClients import get_client
+from executionConfig import compact_state
+from profiling import profiled
+from resultSharing import has_other_consumers
+from retryPolicy import classify_exception
+from warmUp import warmable
+from workflowRouting import is_past_deadline
 
 class GetQueryExecutionStatusException(Exception):
 	pass
@@ -10,6 +17,16 @@ class ExecutionTimeoutExceededException(Exception):
 	print('Execution ran longer than timeout defined')
 	pass
 
+class DataScannedLimitExceededException(GetQueryExecutionStatusException):
+	pass
+
+# Athena bills per TB scanned with a 10MB minimum per query
+BYTES_PER_TB = 1024 ** 4
+MINIMUM_BILLED_BYTES = 10 * 1024 ** 2
+
+@warmable
+@profiled
+@compact_state
 def lambda_handler(event, context):
 	'''
 	lambda_handler Top level lambda handler ensuring all exceptions
@@ -28,7 +45,7 @@ def lambda_handler(event, context):
 		raise
 	except Exception as e:
 		traceback.print_exc()
-		raise GetQueryExecutionStatusException(e)
+		raise classify_exception(e, GetQueryExecutionStatusException)
 
 def get_query_execution_status(event, context):
 	"""
@@ -43,18 +60,58 @@ def get_query_execution_status(event, context):
 	"""
 	queryDetails = {}
 	queryDetails['queryExecutionId'] = event['queryDetails']['queryExecutionId']
+	# Only the curation that started a shared query stops it or pays for it
+	shared_result = event['queryDetails'].get('sharedResult', False)
+	for shared_detail in ('shareKey', 'sharedResult'):
+		if shared_detail in event['queryDetails']:
+			queryDetails[shared_detail] = event['queryDetails'][shared_detail]
+
+	max_bytes_scanned = event['athenaDetails']['maxBytesScanned'] \
+		if 'maxBytesScanned' in event['athenaDetails'] \
+		else None
+
+	status, reason, output_location, data_scanned = get_status(
+		queryDetails['queryExecutionId'], max_bytes_scanned, event.get('accountDetails'), not shared_result)
 
-	status, output_location = get_status(queryDetails['queryExecutionId'])
+	# Fail an express execution while it can still record the curation, a
+	# shared query is left running for the curations that joined it
+	if status in ('QUEUED', 'RUNNING') and is_past_deadline(event):
+		if not shared_result and not ('shareKey' in queryDetails and has_other_consumers(
+				event['settings']['curationStateTableName'], queryDetails['queryExecutionId'])):
+			stop_query(queryDetails['queryExecutionId'], event.get('accountDetails'))
+		raise ExecutionTimeoutExceededException()
+
+	# Failed queries, and shared queries stopped by the curation that started
+	# them, are recorded as unsuccessful curations
+	if status in ('FAILED', 'CANCELLED'):
+		error = 'QueryFailedException' if status == 'FAILED' else 'QueryCancelledException'
+		event.update({'error-info': {
+			'Error': error,
+			'Cause': json.dumps({'errorMessage': f'Query {status}: {reason}', 'errorType': error})
+		}})
 	
 	queryDetails['queryStatus']= status
 	queryDetails['queryOutputLocation']= output_location
+	queryDetails['dataScannedInBytes'] = data_scanned
+	queryDetails['estimatedCost'] = estimate_cost(data_scanned) if not shared_result else 0.0
+	if max_bytes_scanned != None and data_scanned > int(max_bytes_scanned):
+		queryDetails['dataScanLimitExceeded'] = True
+
+	# Small results are read from athena and written with a single put
+	if status == 'SUCCEEDED':
+		result_size = get_result_size(queryDetails['queryExecutionId'], event.get('accountDetails'))
+		if result_size != None:
+			queryDetails['resultRows'], queryDetails['resultBytes'] = result_size
+			queryDetails['smallResult'] = \
+				queryDetails['resultRows'] <= int(os.environ.get('SMALL_RESULT_MAX_ROWS', '0')) and \
+				queryDetails['resultBytes'] <= int(os.environ.get('SMALL_RESULT_MAX_BYTES', '0'))
 	
 	event.update({'queryDetails': queryDetails})
 
 	return event
 
-def get_status(query_execution_id):
-	client = boto3.client('athena')
+def get_status(query_execution_id, max_bytes_scanned=None, account_details=None, can_stop=True):
+	client = get_client('athena', account_details)
 	
 	response = client.get_query_execution(
 		QueryExecutionId=query_execution_id
@@ -62,14 +119,67 @@ def get_status(query_execution_id):
 	timeout_in_minutes = int(os.environ['QUERY_TIMEOUT'])
 	timeout_in_milliseconds = timeout_in_minutes * 60000
 	elapsed_query_time = int(response['QueryExecution']['Statistics']['TotalExecutionTimeInMillis'])
+	data_scanned = int(response['QueryExecution']['Statistics'].get('DataScannedInBytes', 0))
 	
 	if elapsed_query_time > timeout_in_milliseconds:
-		stop_query(query_execution_id)
+		if can_stop:
+			stop_query(query_execution_id, account_details)
 		raise ExecutionTimeoutExceededException()
-	return response['QueryExecution']['Status']['State'], response['QueryExecution']['ResultConfiguration']['OutputLocation']
 
-def stop_query(query_execution_id):
-	client = boto3.client('athena')
+	# Cancel runaway queries as soon as a poll sees them over budget, a
+	# finished query has already been paid for so its result is kept
+	if max_bytes_scanned != None and data_scanned > int(max_bytes_scanned) and \
+			response['QueryExecution']['Status']['State'] in ('QUEUED', 'RUNNING'):
+		if can_stop:
+			stop_query(query_execution_id, account_details)
+		raise DataScannedLimitExceededException(
+			f'Query scanned {data_scanned} bytes, more than the {max_bytes_scanned} bytes allowed')
+
+	return response['QueryExecution']['Status']['State'], response['QueryExecution']['Status'].get('StateChangeReason'), \
+		response['QueryExecution']['ResultConfiguration']['OutputLocation'], data_scanned
+
+def get_result_size(query_execution_id, account_details=None):
+	'''
+	get_result_size Reads the rows and bytes of the query result from the
+	query's runtime statistics, when small results are enabled.
+	:param query_execution_id: The athena query execution id
+	:type query_execution_id: Python String
+	:param account_details: The curation's region and roleArn (optional)
+	:type account_details: Python Dict / None
+	:return: The rows and bytes of the result, or None if they are not known
+	:rtype: Python Tuple - (Integer, Integer) / None
+	'''
+	if int(os.environ.get('SMALL_RESULT_MAX_ROWS', '0')) <= 0:
+		return None
+
+	client = get_client('athena', account_details)
+	try:
+		response = client.get_query_runtime_statistics(
+			QueryExecutionId=query_execution_id
+		)
+		rows = response['QueryRuntimeStatistics']['Rows']
+		return int(rows['OutputRows']), int(rows['OutputBytes'])
+	except Exception:
+		# The statistics are an optimisation, the result is copied without them
+		traceback.print_exc()
+		return None
+
+def estimate_cost(data_scanned):
+	'''
+	estimate_cost Estimates the athena cost of the bytes scanned so far,
+	using the ATHENA_PRICE_PER_TB environment variable (default 5.0).
+	:param data_scanned: The bytes scanned by the query
+	:type data_scanned: Python Integer
+	:return: The estimated cost, rounded to 6 decimal places
+	:rtype: Python Float
+	'''
+	price_per_tb = float(os.environ.get('ATHENA_PRICE_PER_TB', '5.0'))
+	billed_bytes = max(data_scanned, MINIMUM_BILLED_BYTES) if data_scanned > 0 else 0
+
+	return round(billed_bytes / BYTES_PER_TB * price_per_tb, 6)
+
+def stop_query(query_execution_id, account_details=None):
+	client = get_client('athena', account_details)
 
 	response = client.stop_query_execution(
 		QueryExecutionId=query_execution_id
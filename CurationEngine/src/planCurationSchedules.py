@@ -0,0 +1,127 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import traceback
+
+from awsClients import get_resource
+from pipelineLogging import get_logger, log_event
+from profiling import profiled
+from schedulePlanning import get_planned_expression, get_start_minutes, project_concurrency, summarize_concurrency
+
+logger = get_logger(__name__)
+
+class PlanCurationSchedulesException(Exception):
+    pass
+
+# Lambda handler, expects an event such as:
+# {"windowMinutes": 15, "durationMinutes": 5, "day": "2020-06-01"}
+# every value is optional, the window defaults to the stack's SCHEDULE_SPREAD_MINUTES
+@profiled
+def lambda_handler(event, context):
+    '''
+    lambda_handler Top level lambda handler ensuring all exceptions
+    are caught and logged.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The schedule plan and projected concurrency report
+    :rtype: Python Dict
+    :raises PlanCurationSchedulesException: On any error or exception
+    '''
+    try:
+        return plan_curation_schedules(
+            event.get('tableName', os.environ.get('CURATION_DETAILS_TABLE_NAME')),
+            int(event.get('windowMinutes', os.environ.get('SCHEDULE_SPREAD_MINUTES', '0'))),
+            int(event.get('durationMinutes', 1)),
+            parse_day(event['day']) if 'day' in event else datetime.datetime.utcnow().date())
+    except Exception as e:
+        traceback.print_exc()
+        raise PlanCurationSchedulesException(e)
+
+def plan_curation_schedules(table_name, window_minutes, duration_minutes, day):
+    '''
+    plan_curation_schedules Reads the schedule of every curation, spreads
+    each across the window as the event rules are created, and projects
+    the curations running in each minute of the day before and after.
+    :param table_name: The curation details table name
+    :type table_name: Python String
+    :param window_minutes: The number of minutes runs may be spread over
+    :type window_minutes: Python Integer
+    :param duration_minutes: How long each curation is assumed to run for
+    :type duration_minutes: Python Integer
+    :param day: The day to project
+    :type day: datetime.date
+    :return: The schedule plan and projected concurrency report
+    :rtype: Python Dict
+    '''
+    schedules = []
+    unsupported = []
+    for item in scan_schedules(table_name):
+        schedule_expression = item['cronExpression']
+        planned_expression = get_planned_expression(item, window_minutes)
+        try:
+            get_start_minutes(planned_expression, day)
+        except ValueError:
+            unsupported.append(item['curationType'])
+            continue
+
+        schedules.append({
+            'curationType': item['curationType'],
+            'cronExpression': schedule_expression,
+            'plannedExpression': planned_expression
+        })
+
+    report = {
+        'day': day.isoformat(),
+        'windowMinutes': window_minutes,
+        'durationMinutes': duration_minutes,
+        'current': summarize_concurrency(project_concurrency(
+            [schedule['cronExpression'] for schedule in schedules], day, duration_minutes)),
+        'planned': summarize_concurrency(project_concurrency(
+            [schedule['plannedExpression'] for schedule in schedules], day, duration_minutes)),
+        'schedules': schedules,
+        'unsupported': unsupported
+    }
+
+    log_event(
+        logger, logging.INFO, 'Planned curation schedules', curations=len(schedules),
+        currentPeak=report['current']['peak'], plannedPeak=report['planned']['peak'])
+    return report
+
+def scan_schedules(table_name):
+    table = get_resource('dynamodb').Table(table_name)
+
+    scan_args = {'ProjectionExpression': 'curationType, cronExpression, spreadSchedule'}
+    while True:
+        response = table.scan(**scan_args)
+        for item in response['Items']:
+            if 'cronExpression' in item:
+                yield item
+        if 'LastEvaluatedKey' not in response:
+            return
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def parse_day(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Report the projected curation concurrency with and without spread schedules.')
+    parser.add_argument(
+        '--table', required=True,
+        help='The curation details DynamoDB table name')
+    parser.add_argument(
+        '--window', type=int, default=15,
+        help='The number of minutes runs may be spread over')
+    parser.add_argument(
+        '--duration', type=int, default=1,
+        help='How long each curation is assumed to run for, in minutes')
+    parser.add_argument(
+        '--day', type=parse_day, default=datetime.datetime.utcnow().date(),
+        help='The day to project, YYYY-MM-DD (UTC)')
+    args = parser.parse_args()
+
+    print(json.dumps(plan_curation_schedules(args.table, args.window, args.duration, args.day), indent=2))
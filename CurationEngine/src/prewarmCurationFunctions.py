@@ -0,0 +1,142 @@
+import logging
+import os
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from awsClients import get_resource
+from pipelineLogging import get_logger, log_event
+from profiling import profiled
+from schedulePlanning import get_planned_expression, get_start_minutes
+from taskGraph import TaskGraph
+from warmUp import warm_up_function
+
+logger = get_logger(__name__)
+
+# How long the curation schedules are cached by a container, in seconds
+SCHEDULE_CACHE_SECONDS = 600
+
+# The curation schedules and when they were read, and the start minutes of
+# each curation's planned schedule by day, for the life of the container
+schedule_cache = {'readAt': 0, 'schedules': []}
+start_minutes_cache = {}
+
+class PrewarmCurationFunctionsException(Exception):
+    pass
+
+# Lambda handler, invoked every minute by a schedule rule
+@profiled
+def lambda_handler(event, context):
+    '''
+    lambda_handler Top level lambda handler ensuring all exceptions
+    are caught and logged.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The number of containers warmed for each function
+    :rtype: Python Dict
+    :raises PrewarmCurationFunctionsException: On any error or exception
+    '''
+    try:
+        return prewarm_curation_functions(datetime.utcnow())
+    except Exception as e:
+        traceback.print_exc()
+        raise PrewarmCurationFunctionsException(e)
+
+def prewarm_curation_functions(now):
+    '''
+    prewarm_curation_functions Projects how many curations start in the
+    minute PREWARM_LEAD_MINUTES ahead, and if at least PREWARM_MIN_CURATIONS
+    do, warms that many containers of each function their executions
+    invoke, so the burst does not start on cold containers.
+    :param now: The current time (UTC)
+    :type now: datetime.datetime
+    :return: The number of containers warmed for each function
+    :rtype: Python Dict
+    '''
+    lead_minutes = int(os.environ.get('PREWARM_LEAD_MINUTES', '1'))
+    min_curations = int(os.environ.get('PREWARM_MIN_CURATIONS', '0'))
+    max_concurrency = int(os.environ.get('PREWARM_MAX_CONCURRENCY', '50'))
+
+    target = (now + timedelta(minutes=lead_minutes)).replace(second=0, microsecond=0)
+    expected = get_expected_concurrency(get_starting_curations(target))
+
+    graph = TaskGraph()
+    for function_name, concurrency in expected.items():
+        if min_curations > 0 and concurrency >= min_curations:
+            graph.add(function_name, warm_up_function, function_name, min(concurrency, max_concurrency))
+    warmed = graph.run()
+
+    if warmed:
+        log_event(
+            logger, logging.INFO, 'Warmed curation functions',
+            minute=target.strftime('%H:%M'), expected=expected, warmed=warmed)
+    return warmed
+
+def get_expected_concurrency(starting):
+    '''
+    get_expected_concurrency Counts the executions expected to invoke each
+    function for the curations starting together. Every execution invokes
+    the CURATION_FUNCTIONS, only those with quality rules the
+    QUALITY_FUNCTIONS.
+    :param starting: The schedules of the curations starting
+    :type starting: Python List
+    :return: The expected concurrency of each function
+    :rtype: Python Dict
+    '''
+    expected = {}
+    quality_curations = len([schedule for schedule in starting if schedule['qualityRules']])
+    for function_name in get_function_names('CURATION_FUNCTIONS'):
+        expected[function_name] = len(starting)
+    for function_name in get_function_names('QUALITY_FUNCTIONS'):
+        expected[function_name] = quality_curations
+
+    return expected
+
+def get_function_names(variable):
+    return [name.strip() for name in os.environ.get(variable, '').split(',') if name.strip()]
+
+def get_starting_curations(target):
+    window_minutes = int(os.environ.get('SCHEDULE_SPREAD_MINUTES', '0'))
+    minute = target.hour * 60 + target.minute
+
+    starting = []
+    for schedule in get_schedules(os.environ['CURATION_DETAILS_TABLE_NAME']):
+        cache_key = (schedule['curationType'], schedule['cronExpression'], target.date())
+        if cache_key not in start_minutes_cache:
+            try:
+                start_minutes_cache[cache_key] = set(get_start_minutes(
+                    get_planned_expression(schedule, window_minutes), target.date()))
+            except ValueError:
+                start_minutes_cache[cache_key] = set() # Not projected, see planCurationSchedules
+        if minute in start_minutes_cache[cache_key]:
+            starting.append(schedule)
+
+    return starting
+
+def get_schedules(table_name):
+    if time.time() - schedule_cache['readAt'] < SCHEDULE_CACHE_SECONDS:
+        return schedule_cache['schedules']
+
+    table = get_resource('dynamodb').Table(table_name)
+    schedules = []
+    scan_args = {'ProjectionExpression': 'curationType, cronExpression, spreadSchedule, qualityRules'}
+    while True:
+        response = table.scan(**scan_args)
+        for item in response['Items']:
+            if 'cronExpression' in item:
+                schedules.append({
+                    'curationType': item['curationType'],
+                    'cronExpression': item['cronExpression'],
+                    'spreadSchedule': item.get('spreadSchedule'),
+                    'qualityRules': bool(item.get('qualityRules'))
+                })
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    schedule_cache.update({'readAt': time.time(), 'schedules': schedules})
+    # Day old start minutes are never read again
+    start_minutes_cache.clear()
+    return schedules
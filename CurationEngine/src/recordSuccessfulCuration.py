@@ -1,12 +1,26 @@
+import json
 import time
+from decimal import Decimal
 import traceback
 import os
 
-import boto3
+from awsClients import get_client, get_resource
+from completionEvents import STATUS_SUCCEEDED, get_completion_detail, publish_completion
+from curationHistory import get_history_expiry, record_curation_config, release_lock
+from executionConfig import compact_state
+from outputPlanning import STRATEGY_INLINE, get_bucket, get_existing_path
+from profiling import profiled
+from resultCache import cache_rows
+from retryPolicy import classify_exception
+from taskGraph import TaskGraph
+from warmUp import warmable
 
 class RecordSuccessfulCurationException(Exception):
     pass
 
+@warmable
+@profiled
+@compact_state
 def lambda_handler(event, context):
     '''
     lambda_handler Top level lambda handler ensuring all exceptions
@@ -25,7 +39,7 @@ def lambda_handler(event, context):
         raise
     except Exception as e:
         traceback.print_exc()
-        raise RecordSuccessfulCurationException(e)
+        raise classify_exception(e, RecordSuccessfulCurationException)
 
 def record_successfull_curation(event, context):
     """
@@ -38,8 +52,18 @@ def record_successfull_curation(event, context):
     :return: The event object passed into the method
     :rtype: Python type - Dict / list / int / string / float / None
     """
-    record_successful_curation_in_curation_history(event, context)
-    send_successful_curation_sns(event, context)
+    # The history item and notification are independent round trips, the
+    # history records whether the rows were cached
+    graph = TaskGraph()
+    history_depends_on = []
+    if is_row_cache_enabled(event):
+        history_depends_on.append(graph.add('cacheRows', cache_output_rows, event))
+    graph.add(
+        'recordHistory', record_successful_curation_in_curation_history, event, context,
+        depends_on=history_depends_on)
+    graph.add('sendSns', send_successful_curation_sns, event, context)
+    graph.add('releaseRunLock', release_lock, event)
+    graph.run()
     
     return event
 
@@ -53,52 +77,162 @@ def record_successful_curation_in_curation_history(event, context):
     :type context: LambdaContext
     '''
 
-    dynamodb = boto3.resource('dynamodb')
+    dynamodb = get_resource('dynamodb')
 
     try:
         curationType = event['curationDetails']['curationType']
         curation_execution_name = event['curationDetails']['curationExecutionName']
         queryOutputLocation = event['queryDetails']['queryOutputLocation']
         queryExecutionId = event['queryDetails']['queryExecutionId']
-        glueDetails = event['glueDetails']
-        outputDetails = event['outputDetails']
         curationLocation = event['curationDetails']['curationLocation']
         scriptFileCommitId = event['scriptFileCommitId']
         curation_history_table = event["settings"]["curationHistoryTableName"]
-        if event['outputDetails']['tags'] != None:
-            tags = event['outputDetails']['tags']
-        else:
-            tags = None
-        if event['outputDetails']['metadata'] != None:
-            metadata = event['outputDetails']['metadata']
-        else:
-            metadata = None
-        metadata = event['outputDetails']['metadata']
+        timestamp = int(time.time() * 1000)
 
         dynamodb_item = {
             'curationType': curationType,
-            'timestamp': int(time.time() * 1000),
+            'timestamp': timestamp,
             'curationExecutionName': curation_execution_name,
             'queryOutputLocation': queryOutputLocation,
-            'glueDetails': glueDetails,
-            'outputDetails': outputDetails,
             'curationOutputLocation': curationLocation,
             'athenaQueryExecutionId': queryExecutionId,
-            'scriptFileCommitId': scriptFileCommitId,
-            'tags': tags,
-            'metadata': metadata
+            'scriptFileCommitId': scriptFileCommitId
         }
+
+        # Scan statistics from the last status poll, floats are not
+        # accepted by DynamoDB so the cost is stored as a decimal
+        if 'dataScannedInBytes' in event['queryDetails']:
+            dynamodb_item['dataScannedInBytes'] = event['queryDetails']['dataScannedInBytes']
+            dynamodb_item['estimatedCost'] = Decimal(str(event['queryDetails']['estimatedCost']))
+        # The query finished over its maxBytesScanned before a poll could stop it
+        if event['queryDetails'].get('dataScanLimitExceeded') == True:
+            dynamodb_item['dataScanLimitExceeded'] = True
+        # The query and its cost belong to the curation that started it
+        if event['queryDetails'].get('sharedResult') == True:
+            dynamodb_item['resultShared'] = True
+        if event['athenaDetails'].get('workgroup') != None:
+            dynamodb_item['athenaWorkgroup'] = event['athenaDetails']['workgroup']
+        if 'qualityDetails' in event and 'results' in event['qualityDetails']:
+            # Floats are stored as decimals
+            dynamodb_item['qualityResults'] = json.loads(
+                json.dumps(event['qualityDetails']['results']), parse_float=Decimal)
+        # History stays central, the region and role record where the curation ran
+        if event.get('accountDetails', {}).get('region') != None:
+            dynamodb_item['region'] = event['accountDetails']['region']
+        if event.get('accountDetails', {}).get('roleArn') != None:
+            dynamodb_item['roleArn'] = event['accountDetails']['roleArn']
+        if 'finalizationStrategy' in event['curationDetails']:
+            dynamodb_item['finalizationStrategy'] = event['curationDetails']['finalizationStrategy']
+        if event.get('preflightDetails', {}).get('findings'):
+            dynamodb_item['preflightFindings'] = event['preflightDetails']['findings']
+        # Both state machines record the same history, the duration routes the next run
+        if 'curationStartTime' in event['curationDetails']:
+            dynamodb_item['durationMs'] = timestamp - event['curationDetails']['curationStartTime']
+        if 'workflowType' in event['curationDetails']:
+            dynamodb_item['workflowType'] = event['curationDetails']['workflowType']
+        if 'curationChunkCount' in event['curationDetails']:
+            dynamodb_item['curationChunkCount'] = event['curationDetails']['curationChunkCount']
+        if 'curationRowCount' in event['curationDetails']:
+            dynamodb_item['curationRowCount'] = event['curationDetails']['curationRowCount']
+        if 'curationTable' in event['curationDetails']:
+            dynamodb_item['curationTable'] = event['curationDetails']['curationTable']
+        if 'curationRowsCached' in event['curationDetails']:
+            dynamodb_item['curationRowsCached'] = event['curationDetails']['curationRowsCached']
+        if 'curationDeltaLocation' in event['curationDetails']:
+            dynamodb_item['curationDeltaLocation'] = event['curationDetails']['curationDeltaLocation']
+
+        # The glue and output details (including tags and metadata) rarely
+        # change, so they are stored once in the config table and referenced
+        if 'curationConfigTableName' in event['settings']:
+            dynamodb_item['configVersion'] = record_curation_config(event)
+        else:
+            dynamodb_item['glueDetails'] = event['glueDetails']
+            dynamodb_item['outputDetails'] = event['outputDetails']
+            dynamodb_item['tags'] = event['outputDetails']['tags']
+            dynamodb_item['metadata'] = event['outputDetails']['metadata']
+
+        expires_at = get_history_expiry(timestamp)
+        if expires_at != None:
+            dynamodb_item['expiresAt'] = expires_at
+
         dynamodb_table = dynamodb.Table(curation_history_table)
         dynamodb_table.put_item(Item=dynamodb_item)
 
     except Exception as e:
         traceback.print_exc()
-        raise RecordSuccessfulCurationException(e)
+        raise classify_exception(e, RecordSuccessfulCurationException)
+
+def is_row_cache_enabled(event):
+    # Only small outputs written inline are cached
+    return event['outputDetails'].get('cacheRows') == True and \
+        event['curationDetails'].get('finalizationStrategy') == STRATEGY_INLINE
+
+def cache_output_rows(event):
+    '''
+    cache_output_rows Caches the rows of a small output for low latency
+    readers, once its quality checks have passed. The rows are read back
+    from the output, as the athena result may already be released.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    '''
+    curationDetails = event['curationDetails']
+    curationLocation = curationDetails['curationLocation']
+
+    client = get_client('s3', event.get('accountDetails'))
+    body = client.get_object(
+        Bucket=get_bucket(curationLocation),
+        Key=get_existing_path(curationLocation)
+    )['Body'].read().decode('utf-8')
+    records = parse_output_csv(body)
+
+    curationDetails['curationRowsCached'] = cache_rows(
+        event['settings']['curationStateTableName'], curationDetails['curationType'],
+        records[0] if records else [], records[1:], curationDetails)
+
+def parse_output_csv(body):
+    '''
+    parse_output_csv Parses a csv written as athena writes it, every value
+    quoted and nulls as empty fields, which the csv module cannot tell
+    apart from empty strings.
+    :param body: The csv
+    :type body: Python String
+    :return: The records, each a list of values (None for nulls)
+    :rtype: Python List
+    '''
+    records = []
+    record = []
+    value = []
+    quoted = False
+    in_quotes = False
+    i = 0
+    while i < len(body):
+        char = body[i]
+        if in_quotes:
+            if char != '"':
+                value.append(char)
+            elif body.startswith('""', i):
+                value.append('"')
+                i += 1
+            else:
+                in_quotes = False
+        elif char == '"':
+            in_quotes = True
+            quoted = True
+        elif char in (',', '\n'):
+            record.append(''.join(value) if quoted else None)
+            value = []
+            quoted = False
+            if char == '\n':
+                records.append(record)
+                record = []
+        i += 1
+
+    return records
 
 def send_successful_curation_sns(event, context):
     '''
-    send_successful_curation_sns Sends an SNS notifying subscribers
-    that curation was successful.
+    send_successful_curation_sns Sends an SNS and completion event
+    notifying subscribers that curation was successful.
     :param event: AWS Lambda uses this to pass in event data.
     :type event: Python type - Dict / list / int / string / float / None
     :param context: AWS Lambda uses this to pass in runtime information.
@@ -111,21 +245,6 @@ def send_successful_curation_sns(event, context):
     message = f'The output of your curation can be found: {curationLocation}'
     
 
-    if 'SNS_SUCCESS_ARN' in os.environ:
-        successSNSTopicARN = os.environ['SNS_SUCCESS_ARN']
-        send_sns(successSNSTopicARN, subject, message)
-
-def send_sns(topic_arn, subject, message):
-    '''
-    send_sns Sends an SNS with the given subject and message to the
-    specified ARN.
-    :param topic_arn: The SNS ARN to send the notification to
-    :type topic_arn: Python String
-    :param subject: The subject of the SNS notification
-    :type subject: Python String
-    :param message: The SNS notification message
-    :type message: Python String
-    '''
-    client = boto3.client('sns')
-
-    client.publish(TopicArn=topic_arn, Subject=subject, Message=message)
\ No newline at end of file
+    successSNSTopicARN = os.environ.get('SNS_SUCCESS_ARN')
+    publish_completion(
+        successSNSTopicARN, subject, message, get_completion_detail(event, STATUS_SUCCEEDED))
\ No newline at end of file
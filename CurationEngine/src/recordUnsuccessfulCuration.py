@@ -1,12 +1,27 @@
 import time
+from decimal import Decimal
 import traceback
 import json
-import boto3
 import os
 
+from awsClients import get_resource
+from completionEvents import STATUS_FAILED, get_completion_detail, publish_completion
+from curationHistory import get_history_expiry, record_curation_config, release_lock
+from executionConfig import compact_state
+from preflightChecks import get_blocked_findings
+from profiling import profiled
+from qualityChecks import clean_up_quality_checks, get_quality_query
+from resultSharing import release_query_result
+from retryPolicy import classify_exception
+from taskGraph import TaskGraph
+from warmUp import warmable
+
 class RecordUnsuccessfulCurationException(Exception):
     pass
 
+@warmable
+@profiled
+@compact_state
 def lambda_handler(event, context):
     '''
     lambda_handler Top level lambda handler ensuring all exceptions
@@ -25,7 +40,7 @@ def lambda_handler(event, context):
         raise
     except Exception as e:
         traceback.print_exc()
-        raise RecordUnsuccessfulCurationException(e)
+        raise classify_exception(e, RecordUnsuccessfulCurationException)
 
 def record_unsuccessfull_curation(event, context):
     """
@@ -38,8 +53,13 @@ def record_unsuccessfull_curation(event, context):
     :return: The event object passed into the method
     :rtype: Python type - Dict / list / int / string / float / None
     """
-    record_unsuccessful_curation_in_curation_history(event, context)
-    send_unsuccessful_curation_sns(event, context)
+    # The history item, clean up and notification are independent round trips
+    graph = TaskGraph()
+    graph.add('recordHistory', record_unsuccessful_curation_in_curation_history, event, context)
+    graph.add('cleanUpQueryResult', clean_up_query_result, event)
+    graph.add('sendSns', send_unsuccessful_curation_sns, event, context)
+    graph.add('releaseRunLock', release_lock, event)
+    graph.run()
     
     return event
 
@@ -53,7 +73,7 @@ def record_unsuccessful_curation_in_curation_history(event, context):
     :type context: LambdaContext
     '''
     
-    dynamodb = boto3.resource('dynamodb')
+    dynamodb = get_resource('dynamodb')
 
     try:      
         curationType = event['curationDetails']['curationType']
@@ -65,37 +85,102 @@ def record_unsuccessful_curation_in_curation_history(event, context):
         if 'stackTrace' in error_cause:
              del error_cause['stackTrace']
         
+        timestamp = int(time.time() * 1000)
+
         dynamodb_item = {
             'curationType': curationType,
-            'timestamp': int(time.time() * 1000),
+            'timestamp': timestamp,
             'curationExecutionName': curation_execution_name,
             'error': error,
             'errorCause': error_cause
         }
         if 'scriptFileCommitId' in event:
             dynamodb_item['scriptFileCommitId'] = event['scriptFileCommitId']
-        if 'queryOutputLocation' in event['queryDetails']:
-            dynamodb_item['curationKey'] = event['queryDetails']['queryOutputLocation']
-        if 'queryExecutionId' in event['queryDetails']:
-            dynamodb_item['athenaQueryExecutionId'] = event['queryDetails']['queryExecutionId']
+        # Runs failing before their query started have no query details
+        queryDetails = event.get('queryDetails', {})
+        if 'queryOutputLocation' in queryDetails:
+            dynamodb_item['curationKey'] = queryDetails['queryOutputLocation']
+        if 'queryExecutionId' in queryDetails:
+            dynamodb_item['athenaQueryExecutionId'] = queryDetails['queryExecutionId']
+        if 'dataScannedInBytes' in queryDetails:
+            dynamodb_item['dataScannedInBytes'] = queryDetails['dataScannedInBytes']
+            dynamodb_item['estimatedCost'] = Decimal(str(queryDetails['estimatedCost']))
+        if queryDetails.get('sharedResult') == True:
+            dynamodb_item['resultShared'] = True
+        if 'athenaDetails' in event and event['athenaDetails'].get('workgroup') != None:
+            dynamodb_item['athenaWorkgroup'] = event['athenaDetails']['workgroup']
+        if 'qualityDetails' in event and 'results' in event['qualityDetails']:
+            # Floats are stored as decimals
+            dynamodb_item['qualityResults'] = json.loads(
+                json.dumps(event['qualityDetails']['results']), parse_float=Decimal)
+        # History stays central, the region and role record where the curation ran
+        if event.get('accountDetails', {}).get('region') != None:
+            dynamodb_item['region'] = event['accountDetails']['region']
+        if event.get('accountDetails', {}).get('roleArn') != None:
+            dynamodb_item['roleArn'] = event['accountDetails']['roleArn']
+        # A blocked curation fails before its findings are added to the event
+        preflight_findings = event.get('preflightDetails', {}).get('findings') or get_blocked_findings(error_cause)
+        if preflight_findings:
+            dynamodb_item['preflightFindings'] = preflight_findings
+        # Both state machines record the same history, the duration routes the next run
+        if 'curationStartTime' in event['curationDetails']:
+            dynamodb_item['durationMs'] = timestamp - event['curationDetails']['curationStartTime']
+        if 'workflowType' in event['curationDetails']:
+            dynamodb_item['workflowType'] = event['curationDetails']['workflowType']
         if 'curationLocation' in event['curationDetails']:
             dynamodb_item['curationOutputLocation'] = event['curationDetails']['curationLocation']
-        if 'outputDetails' in event:
-            dynamodb_item['outputDetails'] = event['outputDetails']
-        if 'glueDetails' in event:
-            dynamodb_item['glueDetails'] = event['glueDetails']
+        # Reference the stored config where the run got far enough to have one
+        if 'curationConfigTableName' in event['settings'] and 'scriptFileCommitId' in event \
+                and 'outputDetails' in event and 'glueDetails' in event:
+            dynamodb_item['configVersion'] = record_curation_config(event)
+        else:
+            if 'outputDetails' in event:
+                dynamodb_item['outputDetails'] = event['outputDetails']
+            if 'glueDetails' in event:
+                dynamodb_item['glueDetails'] = event['glueDetails']
+
+        expires_at = get_history_expiry(timestamp)
+        if expires_at != None:
+            dynamodb_item['expiresAt'] = expires_at
 
         dynamodb_table = dynamodb.Table(curation_history_table)
         dynamodb_table.put_item(Item=dynamodb_item)
 
     except Exception as e:
         traceback.print_exc()
-        raise RecordUnsuccessfulCurationException(e)
+        raise classify_exception(e, RecordUnsuccessfulCurationException)
+
+def clean_up_query_result(event):
+    '''
+    clean_up_query_result Cleans up after a curation that failed while its
+    output was finalized alongside the quality checks, whose details are
+    lost with the failure, and releases a shared athena result the failed
+    curation had not yet released, so the curations still using it can
+    delete it once they have finished.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    '''
+    queryDetails = event.get('queryDetails', {})
+    quality_checks_started = bool(event.get('qualityRules')) and 'qualityDetails' not in event and \
+        queryDetails.get('queryStatus') == 'SUCCEEDED'
+    if not quality_checks_started and 'shareKey' not in queryDetails:
+        return
+
+    try:
+        if quality_checks_started:
+            clean_up_quality_checks(
+                event, os.environ['QUALITY_DATABASE_NAME'],
+                get_quality_query(event['settings']['curationStateTableName'], queryDetails['queryExecutionId']))
+        else:
+            release_query_result(event)
+    except Exception:
+        # The failure is already recorded, a leftover result only costs storage
+        traceback.print_exc()
 
 def send_unsuccessful_curation_sns(event, context):
     '''
-    send_unsuccessful_curation_sns Sends an SNS notifying subscribers
-    that curation has failed.
+    send_unsuccessful_curation_sns Sends an SNS and completion event
+    notifying subscribers that curation has failed.
     :param event: AWS Lambda uses this to pass in event data.
     :type event: Python type - Dict / list / int / string / float / None
     :param context: AWS Lambda uses this to pass in runtime information.
@@ -108,21 +193,6 @@ def send_unsuccessful_curation_sns(event, context):
     subject = f'Data Pipeline - curation for {curationType} has failed'
     message = f'The curation for {curationType} has failed due to {error} with detail:\n{error_cause}'
 
-    if 'SNS_FAILURE_ARN' in os.environ:
-        failureSNSTopicARN = os.environ['SNS_FAILURE_ARN']
-        send_sns(failureSNSTopicARN, subject, message)
-
-def send_sns(topic_arn, subject, message):
-    '''
-    send_sns Sends an SNS with the given subject and message to the
-    specified ARN.
-    :param topic_arn: The SNS ARN to send the notification to
-    :type topic_arn: Python String
-    :param subject: The subject of the SNS notification
-    :type subject: Python String
-    :param message: The SNS notification message
-    :type message: Python String
-    '''
-    client = boto3.client('sns')
-
-    client.publish(TopicArn=topic_arn, Subject=subject, Message=message)
\ No newline at end of file
+    failureSNSTopicARN = os.environ.get('SNS_FAILURE_ARN')
+    publish_completion(
+        failureSNSTopicARN, subject, message, get_completion_detail(event, STATUS_FAILED))
\ No newline at end of file
@@ -1,13 +1,17 @@
 import traceback
 
-import boto3
+from awsClients import get_client, get_resource
+from executionConfig import compact_state
+from profiling import profiled
+from retryPolicy import classify_exception
+from warmUp import warmable
 
 class RetrieveCurationDetailsException(Exception):
     pass
 
 def get_code_commit_file(repo, filePath):
  
-    client = boto3.client('codecommit')
+    client = get_client('codecommit')
 
     response = client.get_file(
         repositoryName=repo,
@@ -15,6 +19,9 @@ def get_code_commit_file(repo, filePath):
     )
     return response
 
+@warmable
+@profiled
+@compact_state
 def lambda_handler(event, context):
     '''
     lambda_handler Top level lambda handler ensuring all exceptions
@@ -33,7 +40,7 @@ def lambda_handler(event, context):
         raise
     except Exception as e:
         traceback.print_exc()
-        raise RetrieveCurationDetailsException(e)
+        raise classify_exception(e, RetrieveCurationDetailsException)
 
 def get_curation_details(event, context):
     """
@@ -59,7 +66,7 @@ def attach_file_settings_to_event(event, context):
     :type context: LambdaContext
     '''
     
-    dynamodb = boto3.resource('dynamodb')
+    dynamodb = get_resource('dynamodb')
 
     table = event["settings"]["curationDetailsTableName"]
     ddb_table = dynamodb.Table(table)
@@ -89,12 +96,29 @@ def attach_file_settings_to_event(event, context):
             athenaDetails['deleteMetadataFileBool'] = False    
         else:
             athenaDetails['deleteMetadataFileBool'] = True   
+
+        athenaDetails['workgroup'] = item['athenaDetails']['workgroup'] \
+            if 'workgroup' in item['athenaDetails'] \
+            else None
+        athenaDetails['maxBytesScanned'] = int(item['athenaDetails']['maxBytesScanned']) \
+            if 'maxBytesScanned' in item['athenaDetails'] \
+            else None
+        athenaDetails['shareResults'] = item['athenaDetails']['shareResults'] != False \
+            if 'shareResults' in item['athenaDetails'] \
+            else True
+        athenaDetails['preflightCheck'] = item['athenaDetails']['preflightCheck'] \
+            if 'preflightCheck' in item['athenaDetails'] \
+            else None
     else:
         athenaDetails = {
             "athenaOutputBucket": None,
             "athenaOutputFolderPath": None,
             "deleteAthenaQueryFile": True,
-            "deleteMetadataFileBool": True
+            "deleteMetadataFileBool": True,
+            "workgroup": None,
+            "maxBytesScanned": None,
+            "shareResults": True,
+            "preflightCheck": None
         }
     # Retrieve all the details around the output of the file
     outputDetails = {}
@@ -120,11 +144,47 @@ def attach_file_settings_to_event(event, context):
         else None
         
     outputDetails['outputBucket'] = item['outputDetails']['outputBucket']
+
+    outputDetails['chunkSizeMB'] = int(item['outputDetails']['chunkSizeMB']) \
+        if 'chunkSizeMB' in item['outputDetails'] \
+        else None
+
+    outputDetails['partitionColumn'] = item['outputDetails']['partitionColumn'] \
+        if 'partitionColumn' in item['outputDetails'] \
+        else None
+
+    outputDetails['catalogDatabase'] = item['outputDetails']['catalogDatabase'] \
+        if 'catalogDatabase' in item['outputDetails'] \
+        else None
+
+    outputDetails['catalogTable'] = item['outputDetails']['catalogTable'] \
+        if 'catalogTable' in item['outputDetails'] \
+        else None
+
+    outputDetails['partitionProjection'] = item['outputDetails'].get('partitionProjection') == True
+
+    outputDetails['outputMode'] = item['outputDetails']['outputMode'] \
+        if 'outputMode' in item['outputDetails'] \
+        else 'snapshot'
+
+    outputDetails['diffKeyColumns'] = item['outputDetails']['diffKeyColumns'] \
+        if 'diffKeyColumns' in item['outputDetails'] \
+        else None
+
+    outputDetails['cacheRows'] = item['outputDetails'].get('cacheRows') == True
     
     event.update({'scriptFilePath': item['sqlFilePath']})
     event.update({'glueDetails': item['glueDetails']})
     event.update({'athenaDetails': athenaDetails})
     event.update({'outputDetails': outputDetails})
+    event.update({'queryParameters': item['queryParameters'] if 'queryParameters' in item else None})
+    event.update({'qualityRules': item['qualityRules'] if 'qualityRules' in item else None})
+    event.update({'overlapPolicy': item['overlapPolicy'] if 'overlapPolicy' in item else None})
+    # The query and output steps run in the data's home region and account
+    event.update({'accountDetails': {
+        'region': item['region'] if 'region' in item else None,
+        'roleArn': item['roleArn'] if 'roleArn' in item else None
+    }})
     
     code_commit_res = get_code_commit_file(event['settings']['scriptsRepo'], event['scriptFilePath'])
     event.update({'scriptFileCommitId':code_commit_res['commitId']})
\ No newline at end of file
@@ -0,0 +1,115 @@
+import traceback
+import os
+
+from awsClients import get_client
+from executionConfig import compact_state
+from outputDiffs import compile_diff_query, get_previous_output, is_diff_enabled
+from outputPlanning import get_query_output_location
+from profiling import profiled
+from resultTables import create_csv_table, ensure_database, get_result_columns
+from retryPolicy import classify_exception
+from warmUp import warmable
+
+class RunDiffQueryException(Exception):
+    pass
+
+@warmable
+@profiled
+@compact_state
+def lambda_handler(event, context):
+    '''
+    lambda_handler Top level lambda handler ensuring all exceptions
+    are caught and logged.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The event object passed into the method
+    :rtype: Python type - Dict / list / int / string / float / None
+    :raises RunDiffQueryException: On any error or exception
+    '''
+    try:
+        return run_diff_query(event, context)
+    except RunDiffQueryException:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise classify_exception(e, RunDiffQueryException)
+
+def run_diff_query(event, context):
+    """
+    run_diff_query Starts the athena query comparing the curation's query
+    result with the output of its previous successful run, for curations
+    with the diff outputMode. Runs before the output is finalized, as an
+    output without a timestamp is replaced by the finalization.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The event object passed into the method
+    :rtype: Python type - Dict / list / int / string / float / None
+    """
+    if not is_diff_enabled(event):
+        event.update({'diffDetails': {'status': 'SKIPPED'}})
+        return event
+
+    account_details = event.get('accountDetails')
+    query_execution_id = event['queryDetails']['queryExecutionId']
+    source_path = event['queryDetails']['queryOutputLocation']
+    database = os.environ['QUALITY_DATABASE_NAME']
+    table_suffix = query_execution_id.replace('-', '_')
+
+    columns = get_result_columns(query_execution_id, account_details)
+    column_names = [column['name'] for column in columns]
+    previous = get_previous_output(
+        event['settings']['curationHistoryTableName'], event['curationDetails']['curationType'], account_details)
+
+    diffDetails = {'previousExecutionName': previous['curationExecutionName'] if previous != None else None}
+    # A previous output with other columns cannot be compared, every row is an insert
+    if previous != None and previous['columns'] != column_names:
+        diffDetails['schemaChanged'] = True
+        previous = None
+
+    ensure_database(database, account_details)
+    tables = [f'diff_new_{table_suffix}']
+    create_csv_table(
+        database, tables[0], source_path[:source_path.rindex('/') + 1], columns, account_details)
+    if previous != None:
+        tables.append(f'diff_old_{table_suffix}')
+        create_csv_table(database, tables[1], previous['folder'], columns, account_details)
+
+    sql_query = compile_diff_query(
+        tables[0], source_path, column_names, event['outputDetails'].get('diffKeyColumns'),
+        tables[1] if previous != None else None, previous)
+    diff_query_execution_id = start_athena_query(
+        sql_query, database, f'{get_query_output_location(event)}diff/',
+        event['athenaDetails'].get('workgroup'), account_details)
+
+    diffDetails.update({
+        'status': 'QUEUED',
+        'queryExecutionId': diff_query_execution_id,
+        'database': database,
+        'tables': tables
+    })
+    event.update({'diffDetails': diffDetails})
+
+    return event
+
+def start_athena_query(query_string, database, output_location, workgroup=None, account_details=None):
+    athena = get_client('athena', account_details)
+
+    query_args = {
+        'QueryString': query_string,
+        'QueryExecutionContext': {
+            'Database': database
+        },
+        'ResultConfiguration': {
+            'OutputLocation': output_location
+        }
+    }
+    if workgroup != None:
+        query_args['WorkGroup'] = workgroup
+
+    response = athena.start_query_execution(**query_args)
+
+    return response['QueryExecutionId']
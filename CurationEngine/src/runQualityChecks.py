@@ -0,0 +1,104 @@
+import traceback
+import os
+
+from awsClients import get_client
+from executionConfig import compact_state
+from outputPlanning import get_query_output_location
+from profiling import profiled
+from qualityChecks import get_quality_table_name, record_quality_query
+from qualityRules import compile_quality_query
+from resultTables import create_csv_table, ensure_database, get_result_columns
+from retryPolicy import classify_exception
+from warmUp import warmable
+
+class RunQualityChecksException(Exception):
+    pass
+
+@warmable
+@profiled
+@compact_state
+def lambda_handler(event, context):
+    '''
+    lambda_handler Top level lambda handler ensuring all exceptions
+    are caught and logged.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The event object passed into the method
+    :rtype: Python type - Dict / list / int / string / float / None
+    :raises RunQualityChecksException: On any error or exception
+    '''
+    try:
+        return run_quality_checks(event, context)
+    except RunQualityChecksException:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise classify_exception(e, RunQualityChecksException)
+
+def run_quality_checks(event, context):
+    """
+    run_quality_checks Starts a single aggregate athena query over the
+    curation's query result that measures every quality rule. Runs
+    alongside the output finalization.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :param context: AWS Lambda uses this to pass in runtime information.
+    :type context: LambdaContext
+    :return: The event object passed into the method
+    :rtype: Python type - Dict / list / int / string / float / None
+    """
+    rules = event.get('qualityRules')
+    if not rules:
+        event.update({'qualityDetails': {'status': 'SKIPPED'}})
+        return event
+
+    account_details = event.get('accountDetails')
+    query_execution_id = event['queryDetails']['queryExecutionId']
+    source_path = event['queryDetails']['queryOutputLocation']
+    database = os.environ['QUALITY_DATABASE_NAME']
+    table_name = get_quality_table_name(query_execution_id)
+
+    # A table over the result folder, the query only reads the result's own file
+    columns = get_result_columns(query_execution_id, account_details)
+    ensure_database(database, account_details)
+    create_csv_table(
+        database, table_name, source_path[:source_path.rindex('/') + 1], columns, account_details)
+
+    sql_query = compile_quality_query(
+        rules, table_name, source_path, [column['name'] for column in columns])
+    quality_query_execution_id = start_athena_query(
+        sql_query, database, f'{get_query_output_location(event)}quality/',
+        event['athenaDetails'].get('workgroup'), account_details)
+    # A failed finalization loses the quality details, the failed run finds the query here
+    record_quality_query(
+        event['settings']['curationStateTableName'], query_execution_id, quality_query_execution_id)
+
+    event.update({'qualityDetails': {
+        'status': 'QUEUED',
+        'queryExecutionId': quality_query_execution_id,
+        'database': database,
+        'tableName': table_name
+    }})
+
+    return event
+
+def start_athena_query(query_string, database, output_location, workgroup=None, account_details=None):
+    athena = get_client('athena', account_details)
+
+    query_args = {
+        'QueryString': query_string,
+        'QueryExecutionContext': {
+            'Database': database
+        },
+        'ResultConfiguration': {
+            'OutputLocation': output_location
+        }
+    }
+    if workgroup != None:
+        query_args['WorkGroup'] = workgroup
+
+    response = athena.start_query_execution(**query_args)
+
+    return response['QueryExecutionId']
@@ -1,4 +1,5 @@
 import json
+import logging
 import os
 import random
 import re
@@ -8,11 +9,21 @@ import traceback
 import urllib
 from datetime import datetime
 
-import boto3
+from awsClients import get_client, get_resource
+from curationHistory import get_history_expiry
+from pipelineLogging import get_logger, log_event, log_payload
+from profiling import profiled
+from runLock import OVERLAP_SKIP, claim_trigger, release_trigger
+from warmUp import warmable
+from workflowRouting import WORKFLOW_EXPRESS, WORKFLOW_STANDARD, choose_workflow, get_deadline
+
+logger = get_logger(__name__)
 
 class StartCurationProcessingException(Exception):
     pass
 
+@warmable
+@profiled
 def lambda_handler(event, context):
     '''
     lambda_handler Top level lambda handler ensuring all exceptions
@@ -45,57 +56,140 @@ def start_curation_processing(event, context):
     :rtype: Python type - Dict / list / int / string / float / None
     '''
 
-    start_step_function_for_event(event['curationType'])
+    # A "profile": true trigger profiles every step of the execution, the
+    # scheduledTime of a scheduled trigger names the execution after its slot
+    start_step_function_for_event(
+        event['curationType'], event.get('profile') == True, event.get('scheduledTime'))
     
     return event
 
-def start_step_function_for_event(curationType):
+def start_step_function_for_event(curationType, profile=False, scheduledTime=None):
     '''
     start_step_function_for_file Starts the accelerated 
-    data pipelines curation engine step function for this curationType.
+    data pipelines curation engine step function for this curationType,
+    the express one if its recent runs were short enough.
     :param curationType:  The unique Id of the curation defined in the curaiton details dynamodb table
     :type curationType: Python String
+    :param profile: Whether every step of the execution is profiled
+    :type profile: Python Boolean
+    :param scheduledTime: The schedule slot of a scheduled trigger, e.g. 2020-06-01T10:00:00Z (optional)
+    :type scheduledTime: Python String / None
     '''
     try:
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
         keystring = re.sub('\W+', '_', curationType)  # Remove special chars
-        step_function_name = timestamp + id_generator() + '_' + keystring
-
-        sfn = boto3.client('stepfunctions')
-        
-        state_machine_arn = os.environ['STEP_FUNCTION']
+        if scheduledTime != None:
+            # Every delivery of the same schedule slot has the same name, so
+            # step functions rejects the duplicates
+            timestamp = datetime.strptime(scheduledTime, '%Y-%m-%dT%H:%M:%SZ').strftime('%Y%m%d%H%M%S')
+            step_function_name = timestamp + '_' + keystring
+        else:
+            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+            step_function_name = timestamp + id_generator() + '_' + keystring
+
+        sfn = get_client('stepfunctions')
+
+        workflow_type, p95_duration = get_workflow(curationType)
+        state_machine_arn = os.environ['EXPRESS_STEP_FUNCTION'] \
+            if workflow_type == WORKFLOW_EXPRESS \
+            else os.environ['STEP_FUNCTION']
 
         step_function_name = step_function_name[:80]
+        start_time = int(time.time() * 1000)
+
+        curationDetails = {
+            'curationType': curationType,
+            'curationExecutionName': step_function_name,
+            'curationTimestamp': timestamp,
+            'curationStartTime': start_time,
+            'workflowType': workflow_type
+        }
+        # Express execution ARNs are only known once started, and express
+        # executions cannot be stopped, so they are never superseded
+        if workflow_type == WORKFLOW_STANDARD:
+            curationDetails['curationExecutionArn'] = get_execution_arn(state_machine_arn, step_function_name)
+        else:
+            curationDetails['curationDeadline'] = get_deadline(start_time, workflow_type)
 
         sfn_Input = {
-            'curationDetails': {
-                'curationType': curationType,
-                'curationExecutionName': step_function_name,
-                'curationTimestamp': timestamp
-            },
+            'curationDetails': curationDetails,
             'settings': {
                 'curationDetailsTableName':
                     os.environ['CURATION_DETAILS_TABLE_NAME'],
                 'curationHistoryTableName':
                     os.environ['CURATION_HISTORY_TABLE_NAME'],
+                'curationConfigTableName':
+                    os.environ['CURATION_CONFIG_TABLE_NAME'],
+                'curationStateTableName':
+                    os.environ['CURATION_STATE_TABLE_NAME'],
                 'scriptsRepo':
-                    os.environ['SCRIPTS_REPO_NAME']
+                    os.environ['SCRIPTS_REPO_NAME'],
+                'profile': profile,
+                # The config is passed between steps as a reference
+                'compactState': os.environ.get('COMPACT_STATE', 'false') == 'true'
             }
             
         }
 
         step_function_input = json.dumps(sfn_Input)
-        sfn.start_execution(
-            stateMachineArn=state_machine_arn,
-            name=step_function_name, input=step_function_input)
+        # Express executions are not unique by name, and a repeated delivery
+        # may be routed differently, so every scheduled trigger is claimed
+        state_table = os.environ['CURATION_STATE_TABLE_NAME']
+        if scheduledTime != None and not claim_trigger(state_table, step_function_name):
+            log_event(
+                logger, logging.INFO, 'Ignored duplicate trigger',
+                curationType=curationType, curationExecutionName=step_function_name)
+            return
+        try:
+            sfn.start_execution(
+                stateMachineArn=state_machine_arn,
+                name=step_function_name, input=step_function_input)
+        except sfn.exceptions.ExecutionAlreadyExists:
+            log_event(
+                logger, logging.INFO, 'Ignored duplicate trigger',
+                curationType=curationType, curationExecutionName=step_function_name)
+            return
+        except Exception:
+            if scheduledTime != None:
+                release_trigger(state_table, step_function_name)
+            raise
 
-        print(f'Started step function with input:{step_function_input}')
+        log_event(
+            logger, logging.INFO, 'Started step function',
+            curationType=curationType, curationExecutionName=step_function_name,
+            workflowType=workflow_type, p95DurationMs=p95_duration)
+        log_payload(logger, 'Step function input', step_function_input)
 
     except Exception as e:
             record_failure_to_start_step_function(
                 curationType, e)
             raise
 
+def get_workflow(curationType):
+    '''
+    get_workflow Chooses the state machine the curation runs on from its
+    history. Routing is an optimisation, so any error runs it on the
+    standard state machine.
+    :param curationType: The unique Id of the curation defined in the curation details dynamodb table
+    :type curationType: Python String
+    :return: The workflow type and the 95th percentile duration in milliseconds, if known
+    :rtype: Python Tuple - (String, Integer / None)
+    '''
+    try:
+        details_table = get_resource('dynamodb').Table(os.environ['CURATION_DETAILS_TABLE_NAME'])
+        item = details_table.get_item(
+            Key={'curationType': curationType}, ProjectionExpression='overlapPolicy').get('Item', {})
+        overlap_policy = item.get('overlapPolicy') or os.environ.get('OVERLAP_POLICY', OVERLAP_SKIP)
+
+        return choose_workflow(os.environ['CURATION_HISTORY_TABLE_NAME'], curationType, overlap_policy)
+    except Exception:
+        traceback.print_exc()
+        return WORKFLOW_STANDARD, None
+
+def get_execution_arn(state_machine_arn, execution_name):
+    # arn:aws:states:<region>:<account>:stateMachine:<name> becomes
+    # arn:aws:states:<region>:<account>:execution:<name>:<execution name>
+    return f'{state_machine_arn.replace(":stateMachine:", ":execution:")}:{execution_name}'
+
 def id_generator(size=6, chars=string.ascii_uppercase + string.digits):
     '''
     id_generator Creates a random id to add to the step function
@@ -121,13 +215,15 @@ def record_failure_to_start_step_function(curationType, exception):
     :type exception: Python Exception
     '''
     try:
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = get_resource('dynamodb')
         
         curation_history_table = os.environ['CURATION_HISTORY_TABLE_NAME']
 
+        timestamp = int(time.time() * 1000)
+
         dynamodb_item = {
             'curationType': curationType,
-            'timestamp': int(time.time() * 1000),
+            'timestamp': timestamp,
             'error': "Failed to start processing",
             'errorCause': {
                 'errorType': type(exception).__name__,
@@ -135,6 +231,10 @@ def record_failure_to_start_step_function(curationType, exception):
             }
         }
 
+        expires_at = get_history_expiry(timestamp)
+        if expires_at != None:
+            dynamodb_item['expiresAt'] = expires_at
+
         dynamodb_table = dynamodb.Table(curation_history_table)
         dynamodb_table.put_item(Item=dynamodb_item)
     except Exception:
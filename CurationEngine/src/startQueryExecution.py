@@ -1,10 +1,25 @@
 import traceback
 
-import boto3
+from awsClients import get_client
+from circuitBreaker import CircuitOpenException, check_circuit, record_failure
+from executionConfig import compact_state
+from outputPlanning import get_query_output_location, plan_output
+from profiling import profiled
+from queryTemplates import PARAMETER_PATTERN, get_parameter_values, to_sql_literal
+from resultSharing import get_share_key, is_sharing_enabled, join_shared_query, share_query
+from retryPolicy import classify_exception, is_throttling_error, is_transient_error
+from runLock import record_lock_query
+from warmUp import warmable
+
+# Compiled templates keyed by (commit id, file path), a commit never changes
+compiled_templates = {}
 
 class StartQueryExecutionException(Exception):
     pass
 
+@warmable
+@profiled
+@compact_state
 def lambda_handler(event, context):
     '''
     lambda_handler Top level lambda handler ensuring all exceptions
@@ -19,11 +34,11 @@ def lambda_handler(event, context):
     '''
     try:
         return start_query_execution(event, context)
-    except StartQueryExecutionException:
+    except (StartQueryExecutionException, CircuitOpenException):
         raise
     except Exception as e:
         traceback.print_exc()
-        raise StartQueryExecutionException(e)
+        raise classify_exception(e, StartQueryExecutionException)
 
 def start_query_execution(event, context):
     """
@@ -36,51 +51,185 @@ def start_query_execution(event, context):
     :return: The event object passed into the method
     :rtype: Python type - Dict / list / int / string / float / None
     """
-    sql_query = get_code_commit_file(event['settings']['scriptsRepo'], event['scriptFilePath'])
-    
-    curation_bucket = event['outputDetails']['outputBucket']
-    output_location = f's3://{curation_bucket}/'
-    if 'outputFolderPath' in event['outputDetails'] and event['outputDetails']['outputFolderPath'] != None:
-        curation_path = event['outputDetails']['outputFolderPath']
-        output_location = f's3://{curation_bucket}/{curation_path}'     
-        
-    # Overwrite default bucket and path if athena details are set
-    if event['athenaDetails']['athenaOutputBucket'] != None:
-        curation_bucket = event['athenaDetails']['athenaOutputBucket']
-        output_location = f's3://{curation_bucket}/'
-    if event['athenaDetails']['athenaOutputFolderPath'] != None:
-        curation_path = event['athenaDetails']['athenaOutputFolderPath']    
-        output_location = f's3://{curation_bucket}/{curation_path}'     
-        
-    query_execution_id = start_athena_query(sql_query, event['glueDetails']['database'], output_location)
+    sql_query, parameter_names = get_compiled_template(
+        event['settings']['scriptsRepo'], event['scriptFilePath'], event['scriptFileCommitId'])
+    execution_parameters = bind_parameters(parameter_names, event)
     
+    output_location = get_query_output_location(event)
+
+    workgroup = event['athenaDetails']['workgroup'] \
+        if 'workgroup' in event['athenaDetails'] \
+        else None
+
+    account_details = event.get('accountDetails')
+    state_table_name = event['settings'].get('curationStateTableName')
+
+    # Identical queries started by other curations within the sharing window
+    # are joined, so one athena query serves all of their outputs
     queryDetails = {}
+    shared = None
+    if is_sharing_enabled(event):
+        queryDetails['shareKey'] = get_share_key(
+            sql_query, execution_parameters, event['glueDetails']['database'], workgroup, account_details,
+            output_location, event['athenaDetails'].get('maxBytesScanned'))
+        shared = join_shared_query(state_table_name, queryDetails['shareKey'])
+
+    if shared == None:
+        query_execution_id = start_curation_query(
+            sql_query, event['glueDetails']['database'], output_location, execution_parameters, workgroup,
+            account_details, state_table_name)
+        query_output_location = f'{output_location}{query_execution_id}.csv'
+
+        if 'shareKey' in queryDetails:
+            shared = share_query(state_table_name, queryDetails['shareKey'], query_execution_id, query_output_location)
+            if shared != None:
+                # An identical query was shared first, use its result instead
+                stop_query(query_execution_id, account_details)
+
+    if shared != None:
+        query_execution_id = shared['queryExecutionId']
+        query_output_location = shared['outputLocation']
+        queryDetails['sharedResult'] = True
+
     queryDetails['queryExecutionId'] = query_execution_id
     event.update({'queryDetails': queryDetails})
+
+    # Athena names the result after the query id, so the final key and the
+    # cheapest way to finalize it are known as soon as the query starts
+    event.update({'outputPlan': plan_output(event, query_output_location)})
+
+    # A run superseding this one stops the query and releases its result
+    if event.get('runLock', {}).get('acquired') == True:
+        record_lock_query(
+            state_table_name, event['curationDetails']['curationType'],
+            event['curationDetails']['curationExecutionName'],
+            get_run_query(queryDetails, query_output_location, account_details))
     
     return event
+
+def get_run_query(queryDetails, query_output_location, account_details):
+    run_query = {
+        'queryExecutionId': queryDetails['queryExecutionId'],
+        'queryOutputLocation': query_output_location
+    }
+    if 'shareKey' in queryDetails:
+        run_query['shareKey'] = queryDetails['shareKey']
+    if account_details != None:
+        run_query['accountDetails'] = account_details
+
+    return run_query
+
+def start_curation_query(query_string, database, output_location, execution_parameters, workgroup, account_details, state_table_name):
+    '''
+    start_curation_query Starts the curation's athena query, unless athena
+    throttling or errors across executions have opened its circuit.
+    :param state_table_name: The curation state table name, or None
+    :type state_table_name: Python String / None
+    :return: The query execution id
+    :rtype: Python String
+    :raises CircuitOpenException: While the athena circuit is open
+    '''
+    # Athena throttling and outages are tracked across executions, new
+    # queries wait while the circuit is open instead of adding to them
+    circuit = get_athena_circuit(account_details)
+    if state_table_name:
+        check_circuit(state_table_name, circuit)
+
+    try:
+        return start_athena_query(
+            query_string, database, output_location, execution_parameters, workgroup, account_details)
+    except Exception as e:
+        if state_table_name and (is_throttling_error(e) or is_transient_error(e)):
+            record_failure(state_table_name, circuit)
+        raise
     
-def start_athena_query(query_string, database, output_location):
-    athena = boto3.client('athena')
+def get_athena_circuit(account_details):
+    # Each region has its own athena limits and outages
+    if account_details != None and account_details.get('region') != None:
+        return f'athena#{account_details["region"]}'
+    return 'athena'
 
-    response = athena.start_query_execution(
-        QueryString=query_string,
-        QueryExecutionContext={
+def start_athena_query(query_string, database, output_location, execution_parameters=None, workgroup=None, account_details=None):
+    athena = get_client('athena', account_details)
+
+    query_args = {
+        'QueryString': query_string,
+        'QueryExecutionContext': {
             'Database': database
         },
-        ResultConfiguration={
+        'ResultConfiguration': {
             'OutputLocation': output_location
         }
-    )
+    }
+    # Athena rejects an empty parameter list, only send it for templates
+    if execution_parameters:
+        query_args['ExecutionParameters'] = execution_parameters
+    if workgroup != None:
+        query_args['WorkGroup'] = workgroup
+
+    response = athena.start_query_execution(**query_args)
 
     return response['QueryExecutionId']
-    
-def get_code_commit_file(repo, filePath):
+
+def stop_query(query_execution_id, account_details=None):
+    athena = get_client('athena', account_details)
+
+    athena.stop_query_execution(
+        QueryExecutionId=query_execution_id
+    )
+
+def get_compiled_template(repo, filePath, commitId):
+    '''
+    get_compiled_template Retrieves the sql script at the given commit and
+    replaces each {{ name }} placeholder with an execution parameter.
+    Compiled templates are cached for the life of the container.
+    :param repo: The curation scripts CodeCommit repository
+    :type repo: Python String
+    :param filePath: The file path of the script within the repository
+    :type filePath: Python String
+    :param commitId: The commit the script was retrieved at
+    :type commitId: Python String
+    :return: The compiled sql and the parameter names in placeholder order
+    :rtype: Python Tuple - (String, List)
+    '''
+    cache_key = (commitId, filePath)
+    if cache_key not in compiled_templates:
+        sql_template = get_code_commit_file(repo, filePath, commitId)
+        parameter_names = PARAMETER_PATTERN.findall(sql_template)
+        compiled_sql = PARAMETER_PATTERN.sub('?', sql_template)
+        compiled_templates[cache_key] = (compiled_sql, parameter_names)
+
+    return compiled_templates[cache_key]
+
+def bind_parameters(parameter_names, event):
+    '''
+    bind_parameters Looks up the value of each template parameter, from the
+    curation's queryParameters or the runtime curation details, and
+    formats it as a sql literal.
+    :param parameter_names: The parameter names in placeholder order
+    :type parameter_names: Python List
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :return: The execution parameters for athena
+    :rtype: Python List
+    :raises StartQueryExecutionException: If a parameter has no value
+    '''
+    values = get_parameter_values(event)
+
+    missing = sorted(set(name for name in parameter_names if name not in values))
+    if missing:
+        raise StartQueryExecutionException(
+            f'No value defined for query parameters: {", ".join(missing)}')
+
+    return [to_sql_literal(values[name]) for name in parameter_names]
+
+def get_code_commit_file(repo, filePath, commitId):
  
-    client = boto3.client('codecommit')
+    client = get_client('codecommit')
 
     response = client.get_file(
         repositoryName=repo,
+        commitSpecifier=commitId,
         filePath=filePath
     )
     
@@ -1,10 +1,47 @@
+import csv
+import json
+import os
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 
-import boto3
+from awsClients import get_client
+from executionConfig import compact_state
+from outputCatalog import escape_partition_value, get_partition_value, is_catalog_enabled, register_output_table
+from outputDiffs import get_delta_key
+from outputPlanning import (
+	STRATEGY_CHUNKED, STRATEGY_COPY, STRATEGY_INLINE, STRATEGY_SELF_COPY, get_bucket, get_existing_path,
+	plan_output)
+from profiling import profiled
+from resultSharing import release_query_result
+from resultTables import get_result_columns
+from retryPolicy import classify_exception
+from taskGraph import TaskGraph
+from warmUp import warmable
+
+# Multipart uploads need parts of at least 5MB, except the last part
+MIN_PART_SIZE = 5 * 1024 * 1024
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+# Parts uploading at the same time, bounds the memory of the parts in flight
+MAX_CONCURRENT_UPLOADS = 8
+# Fraction of the function's memory the chunk writers may buffer, the parts
+# in flight and the result being read use the rest
+BUFFER_MEMORY_FRACTION = 0.25
+# Buffer memory each partition value is given at least, caps the partition
+# values below MAX_PARTITION_VALUES for smaller functions
+MIN_WRITER_BUFFER_SIZE = 256 * 1024
+# Size of each read from the athena result
+READ_SIZE = 1024 * 1024
+# Guards against partitioning by a column with too many distinct values
+MAX_PARTITION_VALUES = 1000
 
 class UpdateOutputDetailsException(Exception):
 	pass
 
+@warmable
+@profiled
+@compact_state
 def lambda_handler(event, context):
 	'''
 	lambda_handler Top level lambda handler ensuring all exceptions
@@ -23,7 +60,7 @@ def lambda_handler(event, context):
 		raise
 	except Exception as e:
 		traceback.print_exc()
-		raise UpdateOutputDetailsException(e)
+		raise classify_exception(e, UpdateOutputDetailsException)
 
 def update_output_details(event, context):
 	"""
@@ -36,110 +73,484 @@ def update_output_details(event, context):
 	:return: The event object passed into the method
 	:rtype: Python type - Dict / list / int / string / float / None
 	"""
-	queryOutputKey = get_existing_path(event['queryDetails']['queryOutputLocation'])
-	queryOutputBucket = get_bucket(event['queryDetails']['queryOutputLocation'])
-
-	# Delete the metadata file that is created	
-	if event['athenaDetails']['deleteMetadataFileBool'] == True:
-		delete_object(f'{queryOutputKey}.metadata', queryOutputBucket)
-
-	new_key = queryOutputKey # Defaults to the key
-	new_bucket = event['outputDetails']['outputBucket']
-	filename = new_key.split('/')[-1].split('.')[0]
-	# If there is a filename specified, use this
-	if event['outputDetails']['outputFilename'] != None:
-		filename = event['outputDetails']['outputFilename']
-		
-		# If the filename should include a timestamp update the filename to include
-		if event['outputDetails']['includeTimestampInFilenameBool'] == True:
-			timestamp = event['curationDetails']['curationTimestamp']
-			filename = f'{filename}{timestamp}'
-			
-	#If there is a defined path, use this, and update the key
-	if event['outputDetails']['outputFolderPath'] != None:
-		path = ('/').join(event['outputDetails']['outputFolderPath'].split('/'))
-		new_key = f'{path}{filename}.csv'
-	elif (len(queryOutputKey.split('/')) > 1):
-		path = ('/').join(queryOutputKey.split('/')[:-1]) # if theres a path in the query location, use this, it wont finish with a /
-		new_key = f'{path}/{filename}.csv'
-	else:
-		new_key = f'{filename}.csv'
-	
+	plan = get_output_plan(event)
+	queryOutputBucket = plan['sourceBucket']
+	queryOutputKey = plan['sourceKey']
+	new_bucket = plan['outputBucket']
+	new_key = plan['outputKey']
+	account_details = event.get('accountDetails')
+
+	# A small result is cheaper to read from athena than to copy
+	if plan['strategy'] in (STRATEGY_COPY, STRATEGY_SELF_COPY) and \
+			event['queryDetails'].get('smallResult') == True:
+		plan = dict(plan, strategy=STRATEGY_INLINE)
+
 	curationDetails = event['curationDetails']
-	curationDetails['curationLocation'] = f's3://{new_bucket}/{new_key}'
-	
-	event.update({'curationDetails': curationDetails})
-	
-	metadata = event['outputDetails']['metadata']
-	if metadata != None:
-		# Copy the file into the new location and apply metadata
-		copy_and_update_metadata_on_object(queryOutputBucket, queryOutputKey, new_bucket, new_key, metadata)
-	elif (queryOutputKey != new_key):
-		# Don't copy with metadata, just update with new filename
-		copy_object(queryOutputBucket, queryOutputKey, new_bucket, new_key)
+	curationDetails['finalizationStrategy'] = plan['strategy']
+
+	# Once the final key is known the S3 calls are independent, apart from
+	# the athena result which is only released after it has been read
+	graph = TaskGraph()
+	reads = []
+
+	# Rewrite the result as chunk files listed in a manifest instead of one object
+	if plan['strategy'] == STRATEGY_CHUNKED:
+		output_prefix = f'{new_key[:-len(".csv")]}/'
+		reads.append(graph.add(
+			'writeChunkedOutput', write_chunked_output,
+			event, queryOutputBucket, queryOutputKey, new_bucket, output_prefix))
 	else:
-		pass
-	# Only delete the file as long as its not the same file
-	if (event['athenaDetails']['deleteAthenaQueryFile'] == True and queryOutputKey != new_key):
-		delete_object(queryOutputKey, queryOutputBucket)
-	
-	# Generate the tag list.
-	tagList = []
-	if event['outputDetails']['tags'] != None:
-		for tagKey in event['outputDetails']['tags']:
-			tag = {'Key': tagKey, 'Value': event['outputDetails']['tags'][tagKey]}
-			tagList.append(tag)
-	
-		# Apply the tag list.
-		put_tags_on_object(new_bucket, new_key, tagList)
+		curationDetails['curationLocation'] = f's3://{new_bucket}/{new_key}'
+
+		metadata = event['outputDetails']['metadata']
+		tags = event['outputDetails']['tags']
+		if plan['strategy'] == STRATEGY_INLINE:
+			# The rows are read once and written with the metadata and tags in a single put
+			reads.append(graph.add(
+				'writeInlineOutput', write_inline_output,
+				event['queryDetails']['queryExecutionId'], new_bucket, new_key, metadata, tags, account_details))
+		elif plan['strategy'] in (STRATEGY_COPY, STRATEGY_SELF_COPY):
+			# A single copy applies the new key, metadata and tags together
+			reads.append(graph.add(
+				'copyOutput', copy_object_with_details,
+				queryOutputBucket, queryOutputKey, new_bucket, new_key, metadata, tags, account_details))
+		elif tags != None:
+			# Athena wrote the final object, tags can be applied without a rewrite
+			graph.add('tagOutput', put_tags_on_object, new_bucket, new_key, get_tag_list(tags), account_details)
+
+	# The delta of a diff curation is published next to the output
+	diffDetails = event.get('diffDetails', {})
+	if diffDetails.get('status') == 'SUCCEEDED':
+		delta_location = diffDetails['queryOutputLocation']
+		delta_key = get_delta_key(new_key)
+		graph.add(
+			'copyDelta', copy_object_with_details,
+			get_bucket(delta_location), get_existing_path(delta_location), new_bucket, delta_key,
+			event['outputDetails']['metadata'], event['outputDetails']['tags'], account_details)
+		graph.add(
+			'deleteDeltaResult', delete_query_result, delta_location, account_details,
+			depends_on=['copyDelta'])
+		curationDetails['curationDeltaLocation'] = f's3://{new_bucket}/{delta_key}'
+
+	# The columns of the catalog table are read from the result set metadata,
+	# which athena serves from the result, so it is read before the release
+	if is_catalog_enabled(event):
+		reads.append(graph.add(
+			'readResultColumns', get_result_columns,
+			event['queryDetails']['queryExecutionId'], account_details))
+
+	# Delete the athena result and metadata file, unless they are the output
+	# or other curations sharing the result still need them
+	if not quality_checks_pending(event):
+		release_query_result(event, graph, reads)
+
+	results = graph.run()
+
+	partition_values = []
+	if plan['strategy'] == STRATEGY_CHUNKED:
+		manifest_key, chunk_count, row_count, partition_values = results['writeChunkedOutput']
+		curationDetails['curationLocation'] = f's3://{new_bucket}/{manifest_key}'
+		curationDetails['curationChunkCount'] = chunk_count
+		curationDetails['curationRowCount'] = row_count
+
+	# The rows are cached once the run has succeeded, by record successful curation
+	if plan['strategy'] == STRATEGY_INLINE:
+		columns, rows = results['writeInlineOutput']
+		curationDetails['curationRowCount'] = len(rows)
+
+	# Register the output, and the partitions this run wrote, in the catalog
+	if is_catalog_enabled(event):
+		curationDetails['curationTable'] = register_output_table(
+			event, plan, results['readResultColumns'], partition_values)
+
+	event.update({'curationDetails': curationDetails})
 
 	return event
 
-def copy_and_update_metadata_on_object(bucket, key, new_bucket, new_key, metadata):
-	client = boto3.client('s3')
-	
-	copy_source = {'Bucket': bucket, 'Key': key}
+def get_output_plan(event):
+	'''
+	get_output_plan Returns the output plan made when the query started,
+	planning again if there is none or athena wrote the result elsewhere
+	(e.g. a workgroup enforcing its own output location).
+	:param event: AWS Lambda uses this to pass in event data.
+	:type event: Python type - Dict / list / int / string / float / None
+	:return: The source, output and strategy of the finalization
+	:rtype: Python Dict
+	'''
+	query_output_location = event['queryDetails']['queryOutputLocation']
+	plan = event.get('outputPlan')
+	if plan == None or \
+			f's3://{plan["sourceBucket"]}/{plan["sourceKey"]}' != query_output_location:
+		plan = plan_output(event, query_output_location)
 
-	client.copy(
-		copy_source,
-		new_bucket,
-		new_key,
-		ExtraArgs={"Metadata": metadata, "MetadataDirective": "REPLACE"})
+	return plan
+
+def quality_checks_pending(event):
+	# The quality checks read the athena result while the output is finalized,
+	# evaluate quality checks releases it once both have finished
+	return bool(event.get('qualityRules'))
+
+def get_tag_list(tags):
+	return [{'Key': tagKey, 'Value': tags[tagKey]} for tagKey in tags]
+
+def write_chunked_output(event, bucket, key, new_bucket, output_prefix):
+	'''
+	write_chunked_output Streams the athena result and rewrites it as chunk
+	files of the target size, optionally split by the value of a column,
+	then writes a manifest listing every chunk.
+	:param event: AWS Lambda uses this to pass in event data.
+	:type event: Python type - Dict / list / int / string / float / None
+	:param bucket: The bucket of the athena result
+	:type bucket: Python String
+	:param key: The key of the athena result
+	:type key: Python String
+	:param new_bucket: The output bucket
+	:type new_bucket: Python String
+	:param output_prefix: The prefix the chunks and manifest are written under
+	:type output_prefix: Python String
+	:return: The manifest key, the number of chunks and rows and the partition values
+	:rtype: Python Tuple - (String, Integer, Integer, List)
+	'''
+	outputDetails = event['outputDetails']
+	chunk_size = int(outputDetails['chunkSizeMB']) * 1024 * 1024 \
+		if outputDetails.get('chunkSizeMB') != None \
+		else None
+	partition_column = outputDetails.get('partitionColumn')
+
+	client = get_client('s3', event.get('accountDetails'))
+	body = client.get_object(Bucket=bucket, Key=key)['Body']
+	records = iter_csv_records(body)
+	header = next(records, b'')
+	columns = next(csv.reader([header.decode('utf-8')]), [])
+
+	partition_index = None
+	if partition_column != None:
+		if partition_column not in columns:
+			raise UpdateOutputDetailsException(
+				f'Partition column {partition_column} is not in the query result')
+		partition_index = columns.index(partition_column)
+
+	upload_args = {}
+	if outputDetails['metadata'] != None:
+		upload_args['Metadata'] = outputDetails['metadata']
+	if outputDetails['tags'] != None:
+		upload_args['Tagging'] = urlencode(outputDetails['tags'])
+
+	writers = {}
+	limits = get_writer_limits()
+	upload_slots = threading.BoundedSemaphore(MAX_CONCURRENT_UPLOADS)
+	try:
+		with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_UPLOADS) as executor:
+			try:
+				for record in records:
+					value = None
+					if partition_index != None:
+						value = get_partition_value(next(csv.reader([record.decode('utf-8')]))[partition_index])
+
+					writer = writers.get(value)
+					if writer == None:
+						if len(writers) >= limits.max_writers:
+							raise UpdateOutputDetailsException(
+								f'Partition column {partition_column} has more than {limits.max_writers} values')
+						prefix = output_prefix if value == None \
+							else f'{output_prefix}{partition_column}={escape_partition_value(value)}/'
+						writer = ChunkedObjectWriter(
+							client, executor, upload_slots, limits, new_bucket, prefix,
+							header, chunk_size, upload_args)
+						writers[value] = writer
+					writer.write(record)
+
+				# An empty result still produces one (header only) chunk
+				if not writers:
+					writers[None] = ChunkedObjectWriter(
+						client, executor, upload_slots, limits, new_bucket, output_prefix,
+						header, chunk_size, upload_args)
+
+				chunks = []
+				for value, writer in writers.items():
+					for chunk in writer.close():
+						if value != None:
+							chunk['partitionValue'] = value
+						chunks.append(chunk)
+			except Exception:
+				for writer in writers.values():
+					writer.abort()
+				raise
+
+		manifest = {
+			'curationType': event['curationDetails']['curationType'],
+			'curationExecutionName': event['curationDetails']['curationExecutionName'],
+			'columns': columns,
+			'partitionColumn': partition_column,
+			'totalRows': sum(chunk['rows'] for chunk in chunks),
+			'totalBytes': sum(chunk['bytes'] for chunk in chunks),
+			'chunks': chunks
+		}
+		manifest_key = f'{output_prefix}manifest.json'
+		client.put_object(
+			Bucket=new_bucket,
+			Key=manifest_key,
+			Body=json.dumps(manifest).encode('utf-8'),
+			ContentType='application/json',
+			**upload_args)
+	except Exception:
+		# Chunks completed before the failure would be left without a manifest
+		delete_chunks(client, new_bucket, [chunk['key'] for writer in writers.values() for chunk in writer.chunks])
+		raise
 
-def copy_object(bucket, key, new_bucket, new_key):
-	client = boto3.client('s3')
+	return manifest_key, len(chunks), manifest['totalRows'], [value for value in writers if value != None]
+
+def delete_chunks(client, bucket, keys):
+	try:
+		# A delete takes at most 1000 keys
+		for i in range(0, len(keys), 1000):
+			client.delete_objects(
+				Bucket=bucket,
+				Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]], 'Quiet': True}
+			)
+	except Exception:
+		# The failure that is being raised matters more
+		traceback.print_exc()
+
+def iter_csv_records(body):
+	'''
+	iter_csv_records Yields each csv record of the streamed body as bytes,
+	including the newline. Athena quotes every field, so a line only ends
+	a record once an even number of quotes has been seen.
+	:param body: The streaming body of the athena result
+	:type body: botocore.response.StreamingBody
+	'''
+	pending = b''
+	record_lines = []
+	quotes = 0
+	while True:
+		data = body.read(READ_SIZE)
+		if not data:
+			break
+		lines = (pending + data).split(b'\n')
+		pending = lines.pop()
+		for line in lines:
+			record_lines.append(line)
+			quotes += line.count(b'"')
+			if quotes % 2 == 0:
+				yield b'\n'.join(record_lines) + b'\n'
+				record_lines = []
+				quotes = 0
+
+	if pending:
+		record_lines.append(pending)
+	if record_lines:
+		yield b'\n'.join(record_lines) + b'\n'
+
+def get_writer_limits():
+	# Lambda sets the function's memory size
+	memory_bytes = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '512')) * 1024 * 1024
+	max_buffered_bytes = max(int(memory_bytes * BUFFER_MEMORY_FRACTION), MULTIPART_PART_SIZE)
+
+	max_writers = min(MAX_PARTITION_VALUES, max(1, max_buffered_bytes // MIN_WRITER_BUFFER_SIZE))
+
+	return WriterLimits(max_buffered_bytes, max_writers)
+
+class WriterLimits:
+	'''
+	WriterLimits Bounds the memory of the chunk writers of a result. When
+	the writers buffer too much the largest buffer is uploaded as a part,
+	or its chunk is completed early if it is smaller than a part can be, so
+	a result spread over many partition values writes smaller chunks.
+	'''
+	def __init__(self, max_buffered_bytes, max_writers):
+		self.max_buffered_bytes = max_buffered_bytes
+		self.max_writers = max_writers
+		self.buffered_bytes = 0
+		# Writers with an open chunk
+		self.open_writers = set()
+
+	def open(self, writer):
+		self.open_writers.add(writer)
+
+	def close(self, writer):
+		self.open_writers.discard(writer)
+
+	def written(self):
+		while self.buffered_bytes > self.max_buffered_bytes and self.open_writers:
+			largest = max(self.open_writers, key=lambda open_writer: len(open_writer.buffer))
+			if len(largest.buffer) >= MIN_PART_SIZE:
+				largest.upload_buffer()
+			else:
+				largest.complete_chunk()
+
+class ChunkedObjectWriter:
+	'''
+	ChunkedObjectWriter Writes records into numbered chunk objects under a
+	prefix, rolling to a new chunk at the target size. Each chunk is a
+	multipart upload whose parts are uploaded concurrently.
+	'''
+	def __init__(self, client, executor, upload_slots, limits, bucket, prefix, header, chunk_size, upload_args):
+		self.client = client
+		self.executor = executor
+		self.upload_slots = upload_slots
+		self.limits = limits
+		self.bucket = bucket
+		self.prefix = prefix
+		self.header = header
+		self.chunk_size = chunk_size
+		self.upload_args = upload_args
+		self.chunks = []
+		self.upload_id = None
+
+	def write(self, record):
+		if self.upload_id == None:
+			self.start_chunk()
+		elif self.chunk_size != None and self.chunk_bytes >= self.chunk_size:
+			self.complete_chunk()
+			self.start_chunk()
+
+		self.buffer += record
+		self.limits.buffered_bytes += len(record)
+		self.chunk_bytes += len(record)
+		self.chunk_rows += 1
+		if len(self.buffer) >= MULTIPART_PART_SIZE:
+			self.upload_buffer()
+		self.limits.written()
+
+	def start_chunk(self):
+		self.limits.open(self)
+		self.key = f'{self.prefix}part-{len(self.chunks):05d}.csv'
+		response = self.client.create_multipart_upload(
+			Bucket=self.bucket, Key=self.key, ContentType='text/csv', **self.upload_args)
+		self.upload_id = response['UploadId']
+		self.part_futures = []
+		self.buffer = bytearray(self.header)
+		self.limits.buffered_bytes += len(self.header)
+		self.chunk_bytes = len(self.header)
+		self.chunk_rows = 0
+
+	def upload_buffer(self):
+		part_number = len(self.part_futures) + 1
+		body = bytes(self.buffer)
+		self.limits.buffered_bytes -= len(self.buffer)
+		self.buffer = bytearray()
+
+		# Block the reader while too many parts are in flight
+		self.upload_slots.acquire()
+		future = self.executor.submit(
+			self.client.upload_part, Bucket=self.bucket, Key=self.key,
+			UploadId=self.upload_id, PartNumber=part_number, Body=body)
+		future.add_done_callback(lambda f: self.upload_slots.release())
+		self.part_futures.append((part_number, future))
+
+	def complete_chunk(self):
+		if self.buffer or not self.part_futures:
+			self.upload_buffer()
+		parts = [{'PartNumber': part_number, 'ETag': future.result()['ETag']}
+			for part_number, future in self.part_futures]
+		self.client.complete_multipart_upload(
+			Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+			MultipartUpload={'Parts': parts})
+
+		self.chunks.append({
+			'key': self.key,
+			'rows': self.chunk_rows,
+			'bytes': self.chunk_bytes
+		})
+		self.upload_id = None
+		self.limits.close(self)
+
+	def close(self):
+		if self.upload_id == None:
+			self.start_chunk()
+		self.complete_chunk()
+		return self.chunks
+
+	def abort(self):
+		if self.upload_id != None:
+			self.client.abort_multipart_upload(
+				Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+			self.upload_id = None
+			self.limits.buffered_bytes -= len(self.buffer)
+			self.limits.close(self)
+
+def write_inline_output(query_execution_id, new_bucket, new_key, metadata, tags, account_details=None):
+	'''
+	write_inline_output Reads a small query result through the paginated
+	athena results and writes it to the final key as the same csv athena
+	writes, with the metadata and tags, in a single put.
+	:param query_execution_id: The athena query execution id
+	:type query_execution_id: Python String
+	:param new_bucket: The output bucket
+	:type new_bucket: Python String
+	:param new_key: The output key
+	:type new_key: Python String
+	:param metadata: The output object metadata (optional)
+	:type metadata: Python Dict / None
+	:param tags: The output object tags (optional)
+	:type tags: Python Dict / None
+	:return: The column names and the rows, None for nulls
+	:rtype: Python Tuple - (List, List)
+	'''
+	athena = get_client('athena', account_details)
+
+	records = []
+	paginator = athena.get_paginator('get_query_results')
+	for page in paginator.paginate(QueryExecutionId=query_execution_id, PaginationConfig={'PageSize': 1000}):
+		for row in page['ResultSet']['Rows']:
+			records.append([value.get('VarCharValue') for value in row['Data']])
+	# The first row of a select is the header
+	columns = records[0] if records else []
+	rows = records[1:]
+
+	# Athena quotes every value and writes nulls as empty fields
+	body = ''.join(
+		','.join('' if value == None else '"' + value.replace('"', '""') + '"' for value in record) + '\n'
+		for record in records)
+
+	put_args = {}
+	if metadata != None:
+		put_args['Metadata'] = metadata
+	if tags != None:
+		put_args['Tagging'] = urlencode(tags)
+
+	client = get_client('s3', account_details)
+	client.put_object(
+		Bucket=new_bucket,
+		Key=new_key,
+		Body=body.encode('utf-8'),
+		ContentType='text/csv',
+		**put_args)
+
+	return columns, rows
+
+def copy_object_with_details(bucket, key, new_bucket, new_key, metadata, tags, account_details=None):
+	client = get_client('s3', account_details)
 	
 	copy_source = {'Bucket': bucket, 'Key': key}
 
+	extra_args = {}
+	if metadata != None:
+		extra_args['Metadata'] = metadata
+		extra_args['MetadataDirective'] = 'REPLACE'
+	if tags != None:
+		extra_args['Tagging'] = urlencode(tags)
+		extra_args['TaggingDirective'] = 'REPLACE'
+
 	client.copy(
 		copy_source,
 		new_bucket,
-		new_key
-	)
+		new_key,
+		ExtraArgs=extra_args)
 		
-def put_tags_on_object(bucket, key, tagList):
-	client = boto3.client('s3')
+def delete_query_result(query_output_location, account_details=None):
+	client = get_client('s3', account_details)
+
+	bucket = get_bucket(query_output_location)
+	key = get_existing_path(query_output_location)
+	client.delete_object(Bucket=bucket, Key=key)
+	client.delete_object(Bucket=bucket, Key=f'{key}.metadata')
+
+def put_tags_on_object(bucket, key, tagList, account_details=None):
+	client = get_client('s3', account_details)
 
 	client.put_object_tagging(
 		Bucket=bucket,
 		Key=key,
 		Tagging={'TagSet': tagList})
-
-def delete_object(key, bucket):
-	client = boto3.client('s3')
-
-	response = client.delete_object(
-		Bucket=bucket,
-		Key=key
-	)
-
-def get_bucket(s3_path):
-	bucket = s3_path.split('/')[2]
-	
-	return bucket
-
-def get_existing_path(s3_path):
-	folders = s3_path.split('/')[3:]
-	folders ="/".join(folders)
-	
-	return folders	
\ No newline at end of file
@@ -1,10 +1,19 @@
 import traceback
 
-import boto3
+from awsClients import get_client
+from executionConfig import compact_state
+from preflightChecks import PreflightCheckException, run_preflight_check
+from profiling import profiled
+from qualityRules import validate_quality_rules
+from retryPolicy import classify_exception
+from warmUp import warmable
 
 class ValidateDetailsException(Exception):
     pass
 
+@warmable
+@profiled
+@compact_state
 def lambda_handler(event, context):
     '''
     lambda_handler Top level lambda handler ensuring all exceptions
@@ -16,19 +25,21 @@ def lambda_handler(event, context):
     :return: The event object passed into the method
     :rtype: Python type - Dict / list / int / string / float / None
     :raises ValidateDetailsException: On any error or exception
+    :raises PreflightCheckException: If the pre-flight check blocks the curation
     '''
     try:
         return validate_details(event, context)
-    except ValidateDetailsException:
+    except (ValidateDetailsException, PreflightCheckException):
         raise
     except Exception as e:
         traceback.print_exc()
-        raise ValidateDetailsException(e)
+        raise classify_exception(e, ValidateDetailsException)
 
 def validate_details(event, context):
     """
     validate_details Validates that the code commit file exists, 
-    and the database and table exists.
+    and the database and table exists. Curations with a preflightCheck
+    also have their query plan checked before it is run.
     :param event: AWS Lambda uses this to pass in event data.
     :type event: Python type - Dict / list / int / string / float / None
     :param context: AWS Lambda uses this to pass in runtime information.
@@ -37,9 +48,11 @@ def validate_details(event, context):
     :rtype: Python type - Dict / list / int / string / float / None
     """
 
-    get_code_commit_file(event['settings']['scriptsRepo'], event['scriptFilePath'])
+    sql_template = get_code_commit_file(
+        event['settings']['scriptsRepo'], event['scriptFilePath'], event.get('scriptFileCommitId'))
 
-    does_database_exist(event['glueDetails']['database'])
+    account_details = event.get('accountDetails')
+    does_database_exist(event['glueDetails']['database'], account_details)
     if 'tables' in event['glueDetails']:
         if event['glueDetails']['tables'] != None and len(event['glueDetails']['tables']) != 0:
             for table in event['glueDetails']['tables']:
@@ -47,44 +60,66 @@ def validate_details(event, context):
                 database = event['glueDetails']['database']
                 if '.' in table:
                     database, table = table.split('.')
-                does_table_exist(database, table)
+                does_table_exist(database, table, account_details)
                 
                 
     if 'athenaOutputBucket' in event['athenaDetails'] and event['athenaDetails']['athenaOutputBucket'] != None:
-        does_output_bucket_exist(event['athenaDetails']['athenaOutputBucket'])
+        does_output_bucket_exist(event['athenaDetails']['athenaOutputBucket'], account_details)
         
-    does_output_bucket_exist(event['outputDetails']['outputBucket'])
+    does_output_bucket_exist(event['outputDetails']['outputBucket'], account_details)
+
+    if 'workgroup' in event['athenaDetails'] and event['athenaDetails']['workgroup'] != None:
+        does_workgroup_exist(event['athenaDetails']['workgroup'], account_details)
+
+    if 'qualityRules' in event and event['qualityRules'] != None:
+        validate_quality_rules(event['qualityRules'])
+
+    if event['athenaDetails'].get('preflightCheck') != None:
+        event.update({'preflightDetails': run_preflight_check(event, sql_template)})
     
     return event
 
-def get_code_commit_file(repo, filePath):
+def get_code_commit_file(repo, filePath, commitId=None):
  
-    client = boto3.client('codecommit')
+    client = get_client('codecommit')
 
-    response = client.get_file(
-        repositoryName=repo,
-        filePath=filePath
-    )
+    file_args = {'repositoryName': repo, 'filePath': filePath}
+    # The script is checked at the commit the curation runs
+    if commitId != None:
+        file_args['commitSpecifier'] = commitId
+    response = client.get_file(**file_args)
+
+    return response['fileContent'].decode('utf-8')
 
-def does_database_exist(database):
+def does_database_exist(database, account_details=None):
     
-    client = boto3.client('glue')
+    client = get_client('glue', account_details)
     
     response = client.get_database(
         Name=database
     )
 
-def does_table_exist(database, table):
+def does_table_exist(database, table, account_details=None):
     
-    client = boto3.client('glue')
+    client = get_client('glue', account_details)
     
     response = client.get_table(
         DatabaseName=database,
         Name=table
     )
 
-def does_output_bucket_exist(bucket):
+def does_workgroup_exist(workgroup, account_details=None):
+
+    client = get_client('athena', account_details)
+
+    response = client.get_work_group(
+        WorkGroup=workgroup
+    )
+
+def does_output_bucket_exist(bucket, account_details=None):
     
-    s3 = boto3.resource('s3')
+    client = get_client('s3', account_details)
 
-    s3.Bucket(bucket) in s3.buckets.all()
+    response = client.head_bucket(
+        Bucket=bucket
+    )
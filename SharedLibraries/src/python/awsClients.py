@@ -0,0 +1,101 @@
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+
+# Assumed role credentials are refreshed this many seconds before they expire
+CREDENTIAL_REFRESH_SECONDS = 300
+ASSUME_ROLE_DURATION_SECONDS = 3600
+ROLE_SESSION_NAME = 'accelerated-data-pipelines'
+# Throttling aware retries with jittered exponential backoff within each call,
+# the state machine retries what is left with a longer backoff
+CLIENT_CONFIG = Config(retries={'mode': 'standard', 'max_attempts': 5})
+
+# Sessions and clients are cached for the life of the container, keyed by
+# (region, role arn), None meaning the lambda's own region or role
+sessions = {}
+clients = {}
+lock = threading.RLock()
+
+def get_client(service, account_details=None):
+    '''
+    get_client Returns a cached client for the service in the curation's
+    home region, using the curation's role if it has one.
+    :param service: The AWS service name, e.g. 'athena'
+    :type service: Python String
+    :param account_details: The curation's region and roleArn (optional)
+    :type account_details: Python Dict / None
+    :return: The boto3 client
+    :rtype: botocore.client.BaseClient
+    '''
+    region, role_arn = get_account(account_details)
+    with lock:
+        session = get_session(region, role_arn)
+        client_key = (region, role_arn, service)
+        if client_key not in clients:
+            clients[client_key] = session.client(service, config=CLIENT_CONFIG)
+        return clients[client_key]
+
+def get_resource(service, account_details=None):
+    '''
+    get_resource Returns a new resource for the service using the cached
+    session, resources are not thread safe so are not shared.
+    :param service: The AWS service name, e.g. 's3'
+    :type service: Python String
+    :param account_details: The curation's region and roleArn (optional)
+    :type account_details: Python Dict / None
+    :return: The boto3 resource
+    :rtype: boto3.resources.base.ServiceResource
+    '''
+    region, role_arn = get_account(account_details)
+    with lock:
+        return get_session(region, role_arn).resource(service)
+
+def get_account(account_details):
+    if account_details == None:
+        return None, None
+
+    return account_details.get('region'), account_details.get('roleArn')
+
+def get_session(region, role_arn):
+    '''
+    get_session Returns the cached session for the region and role,
+    assuming the role again shortly before its credentials expire.
+    Must be called holding the lock.
+    :param region: The region, or None for the lambda's region
+    :type region: Python String / None
+    :param role_arn: The role to assume, or None for the lambda's role
+    :type role_arn: Python String / None
+    :return: The boto3 session
+    :rtype: boto3.session.Session
+    '''
+    session_key = (region, role_arn)
+    if session_key in sessions:
+        session, expiry = sessions[session_key]
+        if expiry == None or expiry - time.time() > CREDENTIAL_REFRESH_SECONDS:
+            return session
+
+    if role_arn == None:
+        session = boto3.session.Session(region_name=region)
+        expiry = None
+    else:
+        sts = get_client('sts', {'region': region})
+        credentials = sts.assume_role(
+            RoleArn=role_arn,
+            RoleSessionName=ROLE_SESSION_NAME,
+            DurationSeconds=ASSUME_ROLE_DURATION_SECONDS
+        )['Credentials']
+        session = boto3.session.Session(
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['SessionToken'],
+            region_name=region)
+        expiry = credentials['Expiration'].timestamp()
+
+    # Clients created from the previous credentials are dropped
+    for client_key in [client_key for client_key in clients if client_key[:2] == session_key]:
+        del clients[client_key]
+    sessions[session_key] = (session, expiry)
+
+    return session
@@ -0,0 +1,87 @@
+import logging
+import os
+import time
+
+from awsClients import get_resource
+from pipelineLogging import get_logger, log_event
+
+# Failures of a service within the window that open its circuit
+FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_BREAKER_THRESHOLD', '5'))
+FAILURE_WINDOW_SECONDS = 60
+# How long new work is paused once the circuit opens
+OPEN_SECONDS = int(os.environ.get('CIRCUIT_BREAKER_OPEN_SECONDS', '120'))
+
+logger = get_logger(__name__)
+
+# Raised by name so the state machine waits for the circuit to close
+class CircuitOpenException(Exception):
+    pass
+
+def get_circuit_key(service):
+    return f'circuit#{service}'
+
+def check_circuit(table_name, service):
+    '''
+    check_circuit Raises if recent failures across all executions have
+    opened the circuit of the service, rather than adding to an outage.
+    :param table_name: The curation state table name
+    :type table_name: Python String
+    :param service: The service name, e.g. 'athena'
+    :type service: Python String
+    :raises CircuitOpenException: While the circuit is open
+    '''
+    table = get_resource('dynamodb').Table(table_name)
+    item = table.get_item(Key={'stateKey': get_circuit_key(service)}).get('Item', {})
+
+    open_until = int(item.get('openUntil', 0))
+    if open_until > time.time():
+        raise CircuitOpenException(
+            f'The {service} circuit is open until {open_until} after {int(item.get("failures", 0))} failures')
+
+def record_failure(table_name, service):
+    '''
+    record_failure Counts a throttling or transient failure of the service,
+    opening its circuit once the failures within the window reach the
+    threshold. The counter is shared by every execution.
+    :param table_name: The curation state table name
+    :type table_name: Python String
+    :param service: The service name, e.g. 'athena'
+    :type service: Python String
+    '''
+    table = get_resource('dynamodb').Table(table_name)
+    client = table.meta.client
+    key = {'stateKey': get_circuit_key(service)}
+    now = int(time.time())
+
+    try:
+        failures = table.update_item(
+            Key=key,
+            UpdateExpression='ADD failures :one',
+            ConditionExpression='windowStart > :windowFloor',
+            ExpressionAttributeValues={':one': 1, ':windowFloor': now - FAILURE_WINDOW_SECONDS},
+            ReturnValues='UPDATED_NEW'
+        )['Attributes']['failures']
+    except client.exceptions.ConditionalCheckFailedException:
+        # The window has passed, start a new one
+        table.update_item(
+            Key=key,
+            UpdateExpression='SET failures = :one, windowStart = :now, expiresAt = :expiresAt',
+            ExpressionAttributeValues={':one': 1, ':now': now, ':expiresAt': now + 86400}
+        )
+        failures = 1
+
+    if failures < FAILURE_THRESHOLD:
+        return
+
+    try:
+        table.update_item(
+            Key=key,
+            UpdateExpression='SET openUntil = :openUntil',
+            ConditionExpression='attribute_not_exists(openUntil) OR openUntil < :now',
+            ExpressionAttributeValues={':openUntil': now + OPEN_SECONDS, ':now': now}
+        )
+        log_event(
+            logger, logging.WARNING, 'Circuit opened', service=service,
+            failures=int(failures), openSeconds=OPEN_SECONDS)
+    except client.exceptions.ConditionalCheckFailedException:
+        pass  # Already open
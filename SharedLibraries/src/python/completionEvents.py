@@ -0,0 +1,150 @@
+import json
+import os
+import time
+
+from awsClients import get_client
+from pipelineLogging import truncate
+
+# The source and detail types of the events put on the completion event bus
+EVENT_SOURCE = 'accelerated-data-pipelines.curation-engine'
+DETAIL_TYPE_SUCCEEDED = 'Curation Succeeded'
+DETAIL_TYPE_FAILED = 'Curation Failed'
+STATUS_SUCCEEDED = 'SUCCEEDED'
+STATUS_FAILED = 'FAILED'
+# Failure causes can be long stack traces, events carry the start of them
+MAX_ERROR_MESSAGE_LENGTH = 1024
+
+def get_completion_detail(event, status):
+    '''
+    get_completion_detail Builds the structured description of a finished
+    curation that downstream consumers are notified with. Fields that are
+    not known for the run (e.g. the row count of a single file output
+    without a rowCount quality rule) are left out.
+    :param event: The curation engine event
+    :type event: Python Dict
+    :param status: SUCCEEDED or FAILED
+    :type status: Python String
+    :return: The completion detail
+    :rtype: Python Dict
+    '''
+    curationDetails = event['curationDetails']
+    detail = {
+        'curationType': curationDetails['curationType'],
+        'curationExecutionName': curationDetails['curationExecutionName'],
+        'status': status
+    }
+
+    if 'curationTimestamp' in curationDetails:
+        detail['curationTimestamp'] = curationDetails['curationTimestamp']
+    if 'curationLocation' in curationDetails:
+        detail['outputLocation'] = curationDetails['curationLocation']
+    if 'curationDeltaLocation' in curationDetails:
+        detail['deltaLocation'] = curationDetails['curationDeltaLocation']
+    if 'curationChunkCount' in curationDetails:
+        detail['chunkCount'] = curationDetails['curationChunkCount']
+    if 'curationTable' in curationDetails:
+        detail['outputTable'] = curationDetails['curationTable']
+    if 'scriptFileCommitId' in event:
+        detail['scriptFileCommitId'] = event['scriptFileCommitId']
+    if 'workflowType' in curationDetails:
+        detail['workflowType'] = curationDetails['workflowType']
+    if 'curationStartTime' in curationDetails:
+        detail['durationMs'] = int(time.time() * 1000) - curationDetails['curationStartTime']
+
+    row_count = get_row_count(event)
+    if row_count != None:
+        detail['rowCount'] = row_count
+    if 'dataScannedInBytes' in event.get('queryDetails', {}):
+        detail['dataScannedInBytes'] = event['queryDetails']['dataScannedInBytes']
+
+    if 'error-info' in event:
+        detail['error'] = event['error-info'].get('Error')
+        detail['errorMessage'] = truncate(get_error_message(event['error-info']), MAX_ERROR_MESSAGE_LENGTH)
+
+    return detail
+
+def get_row_count(event):
+    # Chunked and small outputs count their rows, otherwise a rowCount quality
+    # rule or the query statistics have them
+    if 'curationRowCount' in event['curationDetails']:
+        return event['curationDetails']['curationRowCount']
+    for result in event.get('qualityDetails', {}).get('results', []):
+        if result['rule'] == 'rowCount':
+            return result['actual']
+    if 'resultRows' in event.get('queryDetails', {}):
+        return event['queryDetails']['resultRows']
+
+    return None
+
+def get_error_message(error_info):
+    cause = error_info.get('Cause') or ''
+    try:
+        return str(json.loads(cause).get('errorMessage', cause))
+    except (ValueError, AttributeError):
+        return cause
+
+def get_message_attributes(detail):
+    '''
+    get_message_attributes Copies the fields subscribers filter on into SNS
+    message attributes, e.g. a filter policy of
+    {"curationType": ["wildrydes"], "rowCount": [{"numeric": [">", 0]}]}
+    :param detail: The completion detail
+    :type detail: Python Dict
+    :return: The message attributes
+    :rtype: Python Dict
+    '''
+    attributes = {}
+    for name in ('curationType', 'status', 'workflowType', 'outputLocation', 'outputTable', 'error'):
+        if detail.get(name) != None:
+            attributes[name] = {'DataType': 'String', 'StringValue': str(detail[name])}
+    for name in ('rowCount', 'durationMs', 'chunkCount'):
+        if detail.get(name) != None:
+            attributes[name] = {'DataType': 'Number', 'StringValue': str(detail[name])}
+
+    return attributes
+
+def publish_completion(topic_arn, subject, message, detail):
+    '''
+    publish_completion Notifies consumers that a curation finished; the
+    SNS topic with the message for email subscribers, the detail as JSON for
+    every other protocol and the filterable fields as message attributes,
+    and the completion event bus (COMPLETION_EVENT_BUS) if one is set.
+    :param topic_arn: The SNS topic ARN, or None
+    :type topic_arn: Python String / None
+    :param subject: The subject of the SNS notification
+    :type subject: Python String
+    :param message: The SNS notification message for email subscribers
+    :type message: Python String
+    :param detail: The completion detail
+    :type detail: Python Dict
+    '''
+    if topic_arn != None:
+        detail_json = json.dumps(detail, default=str)
+        get_client('sns').publish(
+            TopicArn=topic_arn,
+            Subject=subject,
+            MessageStructure='json',
+            Message=json.dumps({
+                'default': detail_json,
+                'email': message,
+                'sms': message,
+                'email-json': detail_json
+            }),
+            MessageAttributes=get_message_attributes(detail)
+        )
+
+    event_bus = os.environ.get('COMPLETION_EVENT_BUS', '')
+    if event_bus != '':
+        put_completion_event(event_bus, detail)
+
+def put_completion_event(event_bus, detail):
+    client = get_client('events')
+
+    response = client.put_events(Entries=[{
+        'Source': EVENT_SOURCE,
+        'DetailType': DETAIL_TYPE_SUCCEEDED if detail['status'] == STATUS_SUCCEEDED else DETAIL_TYPE_FAILED,
+        'Detail': json.dumps(detail, default=str),
+        'EventBusName': event_bus
+    }])
+    if response.get('FailedEntryCount', 0) > 0:
+        raise Exception(f'Completion event could not be put: {response["Entries"][0].get("ErrorMessage")}')
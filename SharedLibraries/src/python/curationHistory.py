@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import time
+
+from awsClients import get_resource
+from runLock import release_run_lock
+
+# Config versions already stored by this container, avoids a write per run
+recorded_config_versions = set()
+
+def record_curation_config(event):
+    '''
+    record_curation_config Stores the static curation config in the
+    curation config table, once per script commit and config version.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :return: The config version the history item should reference
+    :rtype: Python String
+    '''
+    config = {
+        'curationType': event['curationDetails']['curationType'],
+        'scriptFilePath': event['scriptFilePath'],
+        'glueDetails': event['glueDetails'],
+        'outputDetails': event['outputDetails'],
+        'queryParameters': event.get('queryParameters')
+    }
+    config_json = json.dumps(config, sort_keys=True, default=str)
+    config_version = hashlib.sha256(config_json.encode('utf-8')).hexdigest()[:16]
+    scriptFileCommitId = event['scriptFileCommitId']
+
+    # Skip the write entirely if this warm container already stored it
+    if (scriptFileCommitId, config_version) in recorded_config_versions:
+        return config_version
+
+    dynamodb = get_resource('dynamodb')
+    dynamodb_table = dynamodb.Table(event['settings']['curationConfigTableName'])
+
+    config_item = dict(config)
+    config_item['scriptFileCommitId'] = scriptFileCommitId
+    config_item['configVersion'] = config_version
+    config_item['firstSeenTimestamp'] = int(time.time() * 1000)
+    try:
+        dynamodb_table.put_item(
+            Item=config_item,
+            ConditionExpression='attribute_not_exists(configVersion)')
+    except dynamodb_table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass # Already stored by a previous run
+
+    recorded_config_versions.add((scriptFileCommitId, config_version))
+    return config_version
+
+def get_history_expiry(timestamp):
+    '''
+    get_history_expiry Calculates when the history item should expire,
+    DynamoDB TTL expects epoch seconds.
+    :param timestamp: The history item timestamp in epoch milliseconds
+    :type timestamp: Python Integer
+    :return: The expiry in epoch seconds, or None if retention is disabled
+    :rtype: Python Integer / None
+    '''
+    retention_days = int(os.environ.get('HISTORY_RETENTION_DAYS', '0'))
+    if retention_days <= 0:
+        return None
+
+    return int(timestamp / 1000) + (retention_days * 86400)
+
+def release_lock(event):
+    '''
+    release_lock Releases the run lock, so the next run of the curation
+    can start.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    '''
+    if event.get('runLock', {}).get('acquired') == True:
+        release_run_lock(
+            event['settings']['curationStateTableName'], event['curationDetails']['curationType'],
+            event['curationDetails']['curationExecutionName'])
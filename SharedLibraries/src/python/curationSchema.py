@@ -0,0 +1,139 @@
+import numbers
+import re
+
+from preflightChecks import PREFLIGHT_MODES
+from outputDiffs import OUTPUT_MODES
+from qualityRules import QualityRuleException, validate_quality_rules
+from runLock import OVERLAP_POLICIES
+from schedulePlanning import validate_schedule_expression
+
+# The fields of a curation details item and their types, as described in
+# DataSources/curationDetailExplanation.json
+ITEM_FIELDS = {
+    'curationType': str,
+    'sqlFilePath': str,
+    'cronExpression': str,
+    'spreadSchedule': bool,
+    'overlapPolicy': str,
+    'region': str,
+    'roleArn': str,
+    'queryParameters': dict,
+    'qualityRules': dict,
+    'glueDetails': dict,
+    'athenaDetails': dict,
+    'outputDetails': dict
+}
+GLUE_DETAIL_FIELDS = {
+    'database': str,
+    'tables': list
+}
+ATHENA_DETAIL_FIELDS = {
+    'athenaOutputBucket': str,
+    'athenaOutputFolderPath': str,
+    'deleteAthenaQueryFile': bool,
+    'deleteMetadataFile': bool,
+    'workgroup': str,
+    'maxBytesScanned': numbers.Number,
+    'shareResults': bool,
+    'preflightCheck': str
+}
+OUTPUT_DETAIL_FIELDS = {
+    'outputBucket': str,
+    'outputFolderPath': str,
+    'filename': str,
+    'includeTimestampInFilename': bool,
+    'metadata': dict,
+    'tags': dict,
+    'chunkSizeMB': numbers.Number,
+    'partitionColumn': str,
+    'catalogDatabase': str,
+    'catalogTable': str,
+    'partitionProjection': bool,
+    'outputMode': str,
+    'diffKeyColumns': list,
+    'cacheRows': bool
+}
+REQUIRED_FIELDS = ['curationType', 'sqlFilePath', 'cronExpression', 'glueDetails', 'outputDetails']
+
+ROLE_ARN_PATTERN = re.compile(r'^arn:aws[a-z-]*:iam::\d{12}:role/.+$')
+REGION_PATTERN = re.compile(r'^[a-z]{2}(-[a-z]+)+-\d$')
+
+def get_definition_errors(item):
+    '''
+    get_definition_errors Checks a curation details item against the
+    schema of the curation details table, without calling AWS.
+    :param item: The curation details item
+    :type item: Python Dict
+    :return: The errors, and the warnings for fields that are not known
+    :rtype: Python Tuple - (List, List)
+    '''
+    if not isinstance(item, dict):
+        return ['The curation definition must be a map'], []
+
+    errors = [f'{field} is required' for field in REQUIRED_FIELDS if field not in item]
+    warnings = []
+    check_fields(item, ITEM_FIELDS, '', errors, warnings)
+    for details, fields in (
+            ('glueDetails', GLUE_DETAIL_FIELDS),
+            ('athenaDetails', ATHENA_DETAIL_FIELDS),
+            ('outputDetails', OUTPUT_DETAIL_FIELDS)):
+        if isinstance(item.get(details), dict):
+            check_fields(item[details], fields, f'{details}.', errors, warnings)
+
+    if isinstance(item.get('cronExpression'), str):
+        try:
+            validate_schedule_expression(item['cronExpression'])
+        except ValueError as e:
+            errors.append(str(e))
+    if isinstance(item.get('qualityRules'), dict):
+        try:
+            validate_quality_rules(item['qualityRules'])
+        except QualityRuleException as e:
+            errors.append(str(e))
+    if isinstance(item.get('overlapPolicy'), str) and item['overlapPolicy'] not in OVERLAP_POLICIES:
+        errors.append(f'overlapPolicy must be one of {", ".join(OVERLAP_POLICIES)}')
+    athenaDetails = item.get('athenaDetails', {})
+    if isinstance(athenaDetails, dict) and isinstance(athenaDetails.get('preflightCheck'), str) and \
+            athenaDetails['preflightCheck'] not in PREFLIGHT_MODES:
+        errors.append(f'athenaDetails.preflightCheck must be one of {", ".join(PREFLIGHT_MODES)}')
+    if isinstance(item.get('roleArn'), str) and not ROLE_ARN_PATTERN.match(item['roleArn']):
+        errors.append(f'roleArn {item["roleArn"]} is not an IAM role ARN')
+    if isinstance(item.get('region'), str) and not REGION_PATTERN.match(item['region']):
+        errors.append(f'region {item["region"]} is not a region name')
+
+    glueDetails = item.get('glueDetails', {})
+    if isinstance(glueDetails, dict) and 'database' not in glueDetails:
+        errors.append('glueDetails.database is required')
+    if isinstance(glueDetails, dict) and isinstance(glueDetails.get('tables'), list):
+        for table in glueDetails['tables']:
+            if not isinstance(table, str) or table.count('.') > 1:
+                errors.append(f'glueDetails.tables {table} must be a table or database.table name')
+
+    outputDetails = item.get('outputDetails', {})
+    if isinstance(outputDetails, dict):
+        if 'outputBucket' not in outputDetails:
+            errors.append('outputDetails.outputBucket is required')
+        if outputDetails.get('includeTimestampInFilename') == True and 'filename' not in outputDetails:
+            errors.append('outputDetails.includeTimestampInFilename requires a filename')
+        if isinstance(outputDetails.get('chunkSizeMB'), numbers.Number) and outputDetails['chunkSizeMB'] <= 0:
+            errors.append('outputDetails.chunkSizeMB must be greater than 0')
+        if isinstance(outputDetails.get('outputMode'), str) and outputDetails['outputMode'] not in OUTPUT_MODES:
+            errors.append(f'outputDetails.outputMode must be one of {", ".join(OUTPUT_MODES)}')
+        if isinstance(outputDetails.get('diffKeyColumns'), list) and \
+                not all(isinstance(column, str) for column in outputDetails['diffKeyColumns']):
+            errors.append('outputDetails.diffKeyColumns must be column names')
+        for name in ('metadata', 'tags'):
+            if isinstance(outputDetails.get(name), dict) and \
+                    not all(isinstance(value, str) for value in outputDetails[name].values()):
+                errors.append(f'outputDetails.{name} values must be strings')
+
+    return errors, warnings
+
+def check_fields(details, fields, prefix, errors, warnings):
+    for name, value in details.items():
+        if name not in fields:
+            warnings.append(f'{prefix}{name} is not a known field')
+        # Booleans are numbers in python, but not in the curation details
+        elif not isinstance(value, fields[name]) or \
+                (isinstance(value, bool) and fields[name] != bool):
+            errors.append(f'{prefix}{name} must be a {fields[name].__name__}')
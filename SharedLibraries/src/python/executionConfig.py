@@ -0,0 +1,136 @@
+import copy
+import functools
+import json
+import time
+from decimal import Decimal
+
+from awsClients import get_resource
+
+# The curation details retrieved at the start of an execution, which no
+# later step changes, are stored once instead of passed between steps
+CONFIG_KEYS = [
+    'scriptFilePath',
+    'glueDetails',
+    'athenaDetails',
+    'outputDetails',
+    'queryParameters',
+    'qualityRules',
+    'overlapPolicy',
+    'accountDetails'
+]
+# Stored configs are kept this long, well past the longest execution
+CONFIG_RETENTION_SECONDS = 7 * 86400
+# The most configs a container keeps in memory
+MAX_CACHED_CONFIGS = 100
+
+# Loaded configs by reference, for the life of the container
+configs = {}
+
+def is_compact(event):
+    return isinstance(event, dict) and \
+        isinstance(event.get('settings'), dict) and \
+        event['settings'].get('compactState') == True
+
+def compact_state(handler):
+    '''
+    compact_state Decorates a lambda handler of the curation engine so that
+    in compact state mode (settings.compactState) the execution's config is
+    passed between steps as a reference. The handler receives and returns
+    the full event as before.
+    :param handler: The lambda handler
+    :type handler: Python Function
+    :return: The decorated handler
+    :rtype: Python Function
+    '''
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if not is_compact(event):
+            return handler(event, context)
+
+        result = handler(expand_event(event), context)
+
+        return compact_event(result) if is_compact(result) else result
+
+    return wrapper
+
+def expand_event(event):
+    '''
+    expand_event Adds the execution's config back to a compacted event.
+    Values in the event win, so a step can still override one.
+    :param event: The curation engine event
+    :type event: Python Dict
+    :return: The event with its config
+    :rtype: Python Dict
+    '''
+    config_ref = event.get('configRef')
+    if config_ref != None:
+        for key, value in load_config(event['settings']['curationStateTableName'], config_ref).items():
+            if key not in event:
+                # A copy, so a step changing it does not change the cache
+                event[key] = copy.deepcopy(value)
+
+    return event
+
+def compact_event(event):
+    '''
+    compact_event Replaces the execution's config in the event with a
+    reference to it, storing the config the first time.
+    :param event: The curation engine event
+    :type event: Python Dict
+    :return: The compacted event
+    :rtype: Python Dict
+    '''
+    config_ref = event.get('configRef')
+    if config_ref == None:
+        config = {key: event[key] for key in CONFIG_KEYS if key in event}
+        if not config:
+            return event
+        config_ref = f'config#{event["curationDetails"]["curationExecutionName"]}'
+        store_config(event['settings']['curationStateTableName'], config_ref, config)
+        event['configRef'] = config_ref
+        for key in config:
+            del event[key]
+        return event
+
+    config = load_config(event['settings']['curationStateTableName'], config_ref)
+    for key in CONFIG_KEYS:
+        if key in event and key in config and event[key] == config[key]:
+            del event[key]
+
+    return event
+
+def store_config(table_name, config_ref, config):
+    # Round tripped through json, so the steps see the same values as when
+    # the config was passed in the state
+    config = json.loads(json.dumps(config, default=to_json_number))
+    table = get_resource('dynamodb').Table(table_name)
+    table.put_item(Item={
+        'stateKey': config_ref,
+        'config': json.dumps(config),
+        'expiresAt': int(time.time()) + CONFIG_RETENTION_SECONDS
+    })
+    cache_config(config_ref, config)
+
+def load_config(table_name, config_ref):
+    if config_ref in configs:
+        return configs[config_ref]
+
+    table = get_resource('dynamodb').Table(table_name)
+    item = table.get_item(Key={'stateKey': config_ref}, ConsistentRead=True).get('Item')
+    if item == None:
+        raise Exception(f'The config of the execution ({config_ref}) no longer exists')
+
+    return cache_config(config_ref, json.loads(item['config']))
+
+def cache_config(config_ref, config):
+    if len(configs) >= MAX_CACHED_CONFIGS:
+        del configs[next(iter(configs))]
+    configs[config_ref] = config
+
+    return config
+
+def to_json_number(value):
+    # DynamoDB numbers are serialised as the lambda runtime does
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
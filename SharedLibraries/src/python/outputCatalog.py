@@ -0,0 +1,214 @@
+import re
+
+from awsClients import get_client
+from outputPlanning import STRATEGY_CHUNKED
+from resultTables import ensure_database, get_csv_storage_descriptor
+
+# The partition of each run, for timestamped chunked outputs
+TIMESTAMP_PARTITION_KEY = 'curation_timestamp'
+# Athena result types the csv serde reads as they are, every other type
+# (e.g. dates and timestamps) is registered as a string
+CSV_COLUMN_TYPES = {
+    'tinyint': 'tinyint',
+    'smallint': 'smallint',
+    'integer': 'int',
+    'bigint': 'bigint',
+    'real': 'float',
+    'float': 'float',
+    'double': 'double',
+    'boolean': 'boolean'
+}
+# Glue and athena table names
+TABLE_NAME_PATTERN = re.compile(r'[^a-z0-9_]')
+# Hive's partition for null and empty values, and the characters it escapes
+# in partition folder names
+HIVE_DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+HIVE_ESCAPED_CHARACTERS = set('"#%\'*/:=?\\{[]^\x7f') | set(chr(code) for code in range(1, 32))
+
+def is_catalog_enabled(event):
+    return event['outputDetails'].get('catalogDatabase') != None
+
+def get_table_name(event):
+    table_name = event['outputDetails'].get('catalogTable') or event['curationDetails']['curationType']
+
+    return TABLE_NAME_PATTERN.sub('_', table_name.lower())
+
+def get_partition_key(partition_column):
+    # The partition column is also a column of the chunks, and a table may
+    # not have a partition key with the name of one of its columns
+    return f'{partition_column.lower()}_partition'
+
+def get_partition_value(value):
+    # Athena writes nulls as empty fields, neither can name a folder
+    return HIVE_DEFAULT_PARTITION if value == None or value == '' else value
+
+def escape_partition_value(value):
+    '''
+    escape_partition_value Escapes a partition value for its folder name the
+    way hive does, so values containing e.g. / or = stay one partition.
+    :param value: The partition value, from get_partition_value
+    :type value: Python String
+    :return: The value as it appears in the partition folder
+    :rtype: Python String
+    '''
+    return ''.join(f'%{ord(char):02X}' if char in HIVE_ESCAPED_CHARACTERS else char for char in value)
+
+def plan_output_table(event, plan):
+    '''
+    plan_output_table Works out the table location and partition layout of
+    the curation output from its output plan:
+    - a single file, timestamped or not, is read from its folder, which
+      plan_output dedicates to the curation
+    - chunks are read from their folder, partitioned by the partition column
+    - timestamped chunks are also partitioned by curation_timestamp, each
+      run being written to its own folder
+    :param event: The curation engine event
+    :type event: Python Dict
+    :param plan: The output plan
+    :type plan: Python Dict
+    :return: The table location, partition keys and location template
+    :rtype: Python Dict
+    '''
+    outputDetails = event['outputDetails']
+    bucket = plan['outputBucket']
+    output_key = plan['outputKey']
+    folder = output_key[:output_key.rfind('/') + 1]
+
+    if plan['strategy'] != STRATEGY_CHUNKED:
+        return {'location': f's3://{bucket}/{folder}', 'partitionKeys': [], 'locationTemplate': None}
+
+    chunk_prefix = f'{output_key[:-len(".csv")]}/'
+    location = f's3://{bucket}/{chunk_prefix}'
+    partition_keys = []
+    location_template = location
+    timestamp = event['curationDetails']['curationTimestamp']
+    if outputDetails['outputFilename'] != None and outputDetails['includeTimestampInFilenameBool'] == True:
+        location = f's3://{bucket}/{folder}'
+        partition_keys.append(TIMESTAMP_PARTITION_KEY)
+        run_prefix = chunk_prefix[:-len(f'{timestamp}/')]
+        location_template = f's3://{bucket}/{run_prefix}${{{TIMESTAMP_PARTITION_KEY}}}/'
+
+    partition_column = outputDetails.get('partitionColumn')
+    if partition_column != None:
+        partition_key = get_partition_key(partition_column)
+        partition_keys.append(partition_key)
+        location_template = f'{location_template}{partition_column}=${{{partition_key}}}/'
+
+    return {
+        'location': location,
+        'partitionKeys': partition_keys,
+        'locationTemplate': location_template if partition_keys else None
+    }
+
+def register_output_table(event, plan, columns, partition_values=()):
+    '''
+    register_output_table Creates or updates the glue table of the curation
+    output, with the schema of the athena result, and adds the partitions
+    this run wrote, or configures partition projection so none are added.
+    :param event: The curation engine event
+    :type event: Python Dict
+    :param plan: The output plan
+    :type plan: Python Dict
+    :param columns: The result columns, from get_result_columns
+    :type columns: Python List - Dict
+    :param partition_values: The partition column values written, for chunked outputs
+    :type partition_values: Python List
+    :return: The table name, database.table
+    :rtype: Python String
+    '''
+    account_details = event.get('accountDetails')
+    database = event['outputDetails']['catalogDatabase']
+    table_name = get_table_name(event)
+    layout = plan_output_table(event, plan)
+    projection = event['outputDetails'].get('partitionProjection') == True
+
+    table_input = get_table_input(table_name, columns, layout, projection)
+    ensure_database(database, account_details)
+    put_table(database, table_input, account_details)
+
+    if layout['partitionKeys'] and not projection:
+        add_partitions(database, table_input, get_partitions(event, layout, partition_values), account_details)
+
+    return f'{database}.{table_name}'
+
+def get_table_input(table_name, columns, layout, projection=False):
+    parameters = {
+        'classification': 'csv',
+        # Also skips the single line manifest of unpartitioned chunked outputs
+        'skip.header.line.count': '1'
+    }
+    if projection and layout['partitionKeys']:
+        # Injected values are taken from the query, which must filter on them
+        parameters['projection.enabled'] = 'true'
+        parameters['storage.location.template'] = layout['locationTemplate']
+        for partition_key in layout['partitionKeys']:
+            parameters[f'projection.{partition_key}.type'] = 'injected'
+
+    return {
+        'Name': table_name,
+        'TableType': 'EXTERNAL_TABLE',
+        'Parameters': parameters,
+        'PartitionKeys': [{'Name': partition_key, 'Type': 'string'} for partition_key in layout['partitionKeys']],
+        'StorageDescriptor': get_csv_storage_descriptor(
+            layout['location'],
+            [{'name': column['name'], 'type': CSV_COLUMN_TYPES.get(column['type'].lower(), 'string')}
+                for column in columns])
+    }
+
+def get_partitions(event, layout, partition_values):
+    # Each partition is the location template with its values filled in
+    timestamp = event['curationDetails']['curationTimestamp']
+    partitions = []
+    for value in (partition_values or [None]):
+        values = {TIMESTAMP_PARTITION_KEY: timestamp}
+        if value != None:
+            values[layout['partitionKeys'][-1]] = value
+        if not all(partition_key in values for partition_key in layout['partitionKeys']):
+            continue
+
+        location = layout['locationTemplate']
+        for partition_key in layout['partitionKeys']:
+            location = location.replace(f'${{{partition_key}}}', escape_partition_value(values[partition_key]))
+        partitions.append(([values[partition_key] for partition_key in layout['partitionKeys']], location))
+
+    return partitions
+
+def put_table(database, table_input, account_details=None):
+    client = get_client('glue', account_details)
+
+    try:
+        table = client.get_table(DatabaseName=database, Name=table_input['Name'])['Table']
+    except client.exceptions.EntityNotFoundException:
+        try:
+            client.create_table(DatabaseName=database, TableInput=table_input)
+            return
+        except client.exceptions.AlreadyExistsException:
+            table = client.get_table(DatabaseName=database, Name=table_input['Name'])['Table']
+
+    # Only schema and layout changes are written, most runs change nothing
+    if table.get('StorageDescriptor', {}).get('Columns') != table_input['StorageDescriptor']['Columns'] or \
+            table.get('StorageDescriptor', {}).get('Location') != table_input['StorageDescriptor']['Location'] or \
+            table.get('PartitionKeys', []) != table_input['PartitionKeys'] or \
+            table.get('Parameters', {}) != table_input['Parameters']:
+        client.update_table(DatabaseName=database, TableInput=table_input)
+
+def add_partitions(database, table_input, partitions, account_details=None):
+    client = get_client('glue', account_details)
+
+    partition_inputs = []
+    for values, location in partitions:
+        storage_descriptor = dict(table_input['StorageDescriptor'])
+        storage_descriptor['Location'] = location
+        partition_inputs.append({'Values': values, 'StorageDescriptor': storage_descriptor})
+
+    # A batch takes at most 100 partitions
+    for i in range(0, len(partition_inputs), 100):
+        response = client.batch_create_partition(
+            DatabaseName=database,
+            TableName=table_input['Name'],
+            PartitionInputList=partition_inputs[i:i + 100]
+        )
+        errors = [error for error in response.get('Errors', [])
+            if error['ErrorDetail']['ErrorCode'] != 'AlreadyExistsException']
+        if errors:
+            raise Exception(f'Partitions could not be added: {errors[0]["ErrorDetail"]["ErrorMessage"]}')
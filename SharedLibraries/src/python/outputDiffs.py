@@ -0,0 +1,165 @@
+import csv
+import json
+
+from boto3.dynamodb.conditions import Attr, Key
+
+from awsClients import get_client, get_resource
+from outputPlanning import get_bucket, get_existing_path
+from qualityRules import quote_identifier
+
+# How a curation publishes its output
+OUTPUT_SNAPSHOT = 'snapshot' # The full result, every run
+OUTPUT_DIFF = 'diff'         # The full result and a delta of the rows changed since the previous run
+OUTPUT_MODES = [OUTPUT_SNAPSHOT, OUTPUT_DIFF]
+
+# The first column of a delta, the change each row is
+CHANGE_TYPE_COLUMN = 'change_type'
+CHANGE_INSERT = 'insert'
+CHANGE_UPDATE = 'update'
+CHANGE_DELETE = 'delete'
+# Deltas are written to a folder athena skips, so tables over the
+# output folder do not read them
+DELTA_FOLDER = '_delta/'
+# History items read looking for the previous successful run
+MAX_HISTORY_ITEMS = 50
+# Enough of a csv output to read its header
+HEADER_BYTES = 65536
+
+class OutputDiffException(Exception):
+    pass
+
+def is_diff_enabled(event):
+    return event['outputDetails'].get('outputMode') == OUTPUT_DIFF
+
+def get_delta_key(output_key):
+    folder = output_key[:output_key.rfind('/') + 1]
+
+    return f'{folder}{DELTA_FOLDER}{output_key[len(folder):]}'
+
+def get_previous_output(history_table, curation_type, account_details=None):
+    '''
+    get_previous_output Finds the output of the curation's previous
+    successful run in the curation history, and how to read it: a single
+    csv file, or the chunks listed in a manifest.
+    :param history_table: The curation history table name
+    :type history_table: Python String
+    :param curation_type: The unique Id of the curation
+    :type curation_type: Python String
+    :param account_details: The curation's region and roleArn (optional)
+    :type account_details: Python Dict / None
+    :return: The previous output, or None if there is no run or its output no longer exists
+    :rtype: Python Dict / None
+    '''
+    table = get_resource('dynamodb').Table(history_table)
+
+    query_args = {
+        'KeyConditionExpression': Key('curationType').eq(curation_type),
+        # Unsuccessful runs are recorded with their error
+        'FilterExpression': Attr('error').not_exists() & Attr('curationOutputLocation').exists(),
+        'ProjectionExpression': 'curationExecutionName, curationOutputLocation',
+        'ScanIndexForward': False,
+        'Limit': 10
+    }
+    items_read = 0
+    item = None
+    while item == None and items_read < MAX_HISTORY_ITEMS:
+        response = table.query(**query_args)
+        items_read += response['ScannedCount']
+        if response['Items']:
+            item = response['Items'][0]
+        elif 'LastEvaluatedKey' in response:
+            query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        else:
+            break
+    if item == None:
+        return None
+
+    location = item['curationOutputLocation']
+    bucket = get_bucket(location)
+    key = get_existing_path(location)
+    client = get_client('s3', account_details)
+    try:
+        if key.endswith('/manifest.json'):
+            manifest = json.loads(client.get_object(Bucket=bucket, Key=key)['Body'].read())
+            columns = manifest['columns']
+        else:
+            header = client.get_object(Bucket=bucket, Key=key, Range=f'bytes=0-{HEADER_BYTES - 1}')['Body'].read()
+            columns = next(csv.reader([header.decode('utf-8').split('\n')[0]]), [])
+    except client.exceptions.NoSuchKey:
+        return None
+
+    return {
+        'curationExecutionName': item['curationExecutionName'],
+        'location': location,
+        'folder': f's3://{bucket}/{key[:key.rfind("/") + 1]}',
+        'chunked': key.endswith('/manifest.json'),
+        'columns': [column.lower() for column in columns]
+    }
+
+def compile_diff_query(new_table, new_path, columns, key_columns=None, old_table=None, previous=None):
+    '''
+    compile_diff_query Compiles the set based query comparing the new
+    query result with the previous output. With key columns rows with the
+    same keys are compared, so changed rows are updates; without them whole
+    rows are compared and a changed row is a delete and an insert. Without
+    a previous output every row is an insert.
+    :param new_table: The table over the new query result folder
+    :type new_table: Python String
+    :param new_path: The s3 path of the new query result within the folder
+    :type new_path: Python String
+    :param columns: The column names of the query result
+    :type columns: Python List
+    :param key_columns: The columns identifying a row (optional)
+    :type key_columns: Python List / None
+    :param old_table: The table over the previous output folder (optional)
+    :type old_table: Python String / None
+    :param previous: The previous output, from get_previous_output (optional)
+    :type previous: Python Dict / None
+    :return: The diff query, the change type followed by the columns
+    :rtype: Python String
+    :raises OutputDiffException: If a key column is not in the query result
+    '''
+    key_columns = [column.lower() for column in (key_columns or [])]
+    for column in key_columns:
+        if column not in columns:
+            raise OutputDiffException(f'Diff key column {column} is not in the query result')
+
+    quoted = ', '.join(quote_identifier(column) for column in columns)
+    new_rows = f'SELECT {quoted} FROM {quote_identifier(new_table)} WHERE "$path" = {to_literal(new_path)}'
+    if previous == None:
+        return f"SELECT '{CHANGE_INSERT}' AS {CHANGE_TYPE_COLUMN}, {quoted} FROM ({new_rows})"
+
+    if previous['chunked']:
+        # Every chunk under the manifest's folder, and not the manifest
+        manifest = previous['location']
+        old_filter = f'substr("$path", 1, {len(previous["folder"])}) = {to_literal(previous["folder"])} ' \
+            f'AND "$path" <> {to_literal(manifest)}'
+    else:
+        old_filter = f'"$path" = {to_literal(previous["location"])}'
+    old_rows = f'SELECT {quoted} FROM {quote_identifier(old_table)} WHERE {old_filter}'
+
+    if not key_columns:
+        return f'WITH n AS ({new_rows}), o AS ({old_rows}) ' \
+            f"SELECT '{CHANGE_INSERT}' AS {CHANGE_TYPE_COLUMN}, * FROM (SELECT * FROM n EXCEPT SELECT * FROM o) " \
+            f'UNION ALL ' \
+            f"SELECT '{CHANGE_DELETE}' AS {CHANGE_TYPE_COLUMN}, * FROM (SELECT * FROM o EXCEPT SELECT * FROM n)"
+
+    join = ' AND '.join(f'n.{quote_identifier(column)} = o.{quote_identifier(column)}' for column in key_columns)
+    first_key = quote_identifier(key_columns[0])
+    queries = [
+        f"SELECT '{CHANGE_INSERT}' AS {CHANGE_TYPE_COLUMN}, n.* FROM n LEFT JOIN o ON {join} WHERE o.{first_key} IS NULL"]
+    value_columns = [column for column in columns if column not in key_columns]
+    if value_columns:
+        unchanged = ' AND '.join(
+            f'n.{quote_identifier(column)} IS NOT DISTINCT FROM o.{quote_identifier(column)}'
+            for column in value_columns)
+        queries.append(
+            f"SELECT '{CHANGE_UPDATE}' AS {CHANGE_TYPE_COLUMN}, n.* FROM n JOIN o ON {join} WHERE NOT ({unchanged})")
+    queries.append(
+        f"SELECT '{CHANGE_DELETE}' AS {CHANGE_TYPE_COLUMN}, o.* FROM o LEFT JOIN n ON {join} WHERE n.{first_key} IS NULL")
+
+    return f'WITH n AS ({new_rows}), o AS ({old_rows}) ' + ' UNION ALL '.join(queries)
+
+def to_literal(value):
+    escaped = value.replace("'", "''")
+    return f"'{escaped}'"
@@ -0,0 +1,104 @@
+# Finalization strategies, from cheapest to most expensive
+STRATEGY_IN_PLACE = 'inPlace'      # Athena wrote the final object, at most tags are applied
+STRATEGY_SELF_COPY = 'selfCopy'    # Final key is the athena key, copied onto itself for metadata
+STRATEGY_COPY = 'copy'             # Copied to the final key with metadata and tags inline
+STRATEGY_INLINE = 'inline'         # Small results, read from athena and written with a single put
+STRATEGY_CHUNKED = 'chunked'       # Streamed and rewritten as chunk files
+
+def get_query_output_location(event):
+    '''
+    get_query_output_location Works out the folder athena should write the
+    query result to, the athenaDetails override the outputDetails.
+    :param event: The curation engine event
+    :type event: Python Dict
+    :return: The s3 location, always ending with a /
+    :rtype: Python String
+    '''
+    curation_bucket = event['outputDetails']['outputBucket']
+    output_location = f's3://{curation_bucket}/'
+    if 'outputFolderPath' in event['outputDetails'] and event['outputDetails']['outputFolderPath'] != None:
+        curation_path = event['outputDetails']['outputFolderPath']
+        output_location = f's3://{curation_bucket}/{curation_path}'
+
+    # Overwrite default bucket and path if athena details are set
+    if event['athenaDetails']['athenaOutputBucket'] != None:
+        curation_bucket = event['athenaDetails']['athenaOutputBucket']
+        output_location = f's3://{curation_bucket}/'
+    if event['athenaDetails']['athenaOutputFolderPath'] != None:
+        curation_path = event['athenaDetails']['athenaOutputFolderPath']
+        output_location = f's3://{curation_bucket}/{curation_path}'
+
+    if not output_location.endswith('/'):
+        output_location = f'{output_location}/'
+    return output_location
+
+def plan_output(event, query_output_location):
+    '''
+    plan_output Works out the final key of the curation output and the
+    cheapest way to get the athena result there.
+    :param event: The curation engine event
+    :type event: Python Dict
+    :param query_output_location: The s3 location of the athena result
+    :type query_output_location: Python String
+    :return: The source, output and strategy of the finalization
+    :rtype: Python Dict
+    '''
+    outputDetails = event['outputDetails']
+    source_bucket = get_bucket(query_output_location)
+    source_key = get_existing_path(query_output_location)
+
+    output_bucket = outputDetails['outputBucket']
+    filename = source_key.split('/')[-1].split('.')[0]
+    # If there is a filename specified, use this
+    if outputDetails['outputFilename'] != None:
+        filename = outputDetails['outputFilename']
+
+        # If the filename should include a timestamp update the filename to include
+        if outputDetails['includeTimestampInFilenameBool'] == True:
+            timestamp = event['curationDetails']['curationTimestamp']
+            filename = f'{filename}{timestamp}'
+
+    # If there is a defined path, use this, and update the key
+    if outputDetails['outputFolderPath'] != None:
+        output_key = f'{outputDetails["outputFolderPath"]}{filename}.csv'
+    elif len(source_key.split('/')) > 1:
+        path = '/'.join(source_key.split('/')[:-1]) # if theres a path in the query location, use this, it wont finish with a /
+        output_key = f'{path}/{filename}.csv'
+    else:
+        output_key = f'{filename}.csv'
+
+    chunked = outputDetails.get('chunkSizeMB') != None or outputDetails.get('partitionColumn') != None
+    # A catalog table reads every object in its folder, which for single
+    # file outputs is a folder of the curation's own
+    if not chunked and outputDetails.get('catalogDatabase') != None:
+        folder = output_key[:output_key.rfind('/') + 1]
+        output_key = f'{folder}{event["curationDetails"]["curationType"]}/{output_key[len(folder):]}'
+
+    if chunked:
+        strategy = STRATEGY_CHUNKED
+    elif (source_bucket, source_key) != (output_bucket, output_key):
+        strategy = STRATEGY_COPY
+    elif outputDetails['metadata'] != None:
+        # Metadata can only be changed by rewriting the object
+        strategy = STRATEGY_SELF_COPY
+    else:
+        strategy = STRATEGY_IN_PLACE
+
+    return {
+        'sourceBucket': source_bucket,
+        'sourceKey': source_key,
+        'outputBucket': output_bucket,
+        'outputKey': output_key,
+        'strategy': strategy
+    }
+
+def get_bucket(s3_path):
+    bucket = s3_path.split('/')[2]
+
+    return bucket
+
+def get_existing_path(s3_path):
+    folders = s3_path.split('/')[3:]
+    folders = "/".join(folders)
+
+    return folders
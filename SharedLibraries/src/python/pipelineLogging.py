@@ -0,0 +1,125 @@
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+
+# Log level for all pipeline loggers, DEBUG / INFO / WARNING / ERROR
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# Fraction of debug payload dumps that are actually written, 0.0 - 1.0
+DEBUG_PAYLOAD_SAMPLE_RATE = float(os.environ.get('DEBUG_PAYLOAD_SAMPLE_RATE', '1.0'))
+# Payload dumps longer than this many characters are truncated
+MAX_PAYLOAD_LOG_LENGTH = int(os.environ.get('MAX_PAYLOAD_LOG_LENGTH', '2048'))
+
+configured = False
+
+class JsonFormatter(logging.Formatter):
+    '''
+    JsonFormatter Formats each log record as a single JSON line, including
+    any structured fields passed through extra={'fields': {...}}.
+    '''
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if hasattr(record, 'aws_request_id'):
+            entry['requestId'] = record.aws_request_id
+        if hasattr(record, 'fields'):
+            entry.update(record.fields)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+def configure_logging():
+    '''
+    configure_logging Sets the level from the LOG_LEVEL environment variable
+    and switches the root handlers (the lambda runtime installs one) to
+    JSON lines. Only runs once per container.
+    '''
+    global configured
+    if configured:
+        return
+
+    root_logger = logging.getLogger()
+    if not root_logger.handlers:
+        root_logger.addHandler(logging.StreamHandler(sys.stdout))
+    for handler in root_logger.handlers:
+        handler.setFormatter(JsonFormatter())
+    root_logger.setLevel(LOG_LEVEL)
+
+    configured = True
+
+def get_logger(name):
+    '''
+    get_logger Returns a logger that writes structured JSON lines.
+    :param name: The logger name, usually the module __name__
+    :type name: Python String
+    :return: The configured logger
+    :rtype: logging.Logger
+    '''
+    configure_logging()
+    return logging.getLogger(name)
+
+def log_event(logger, level, message, **fields):
+    '''
+    log_event Logs a message with structured fields, the fields are only
+    built into a record if the level is enabled.
+    :param logger: The logger to write to
+    :type logger: logging.Logger
+    :param level: The logging level, e.g. logging.INFO
+    :type level: Python Integer
+    :param message: The log message
+    :type message: Python String
+    :param fields: Additional fields added to the JSON line
+    :type fields: Python Dict
+    '''
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={'fields': fields})
+
+def log_payload(logger, message, payload, **fields):
+    '''
+    log_payload Debug logs a sampled, size capped dump of a payload. Costs
+    a single level check when debug logging is disabled.
+    :param logger: The logger to write to
+    :type logger: logging.Logger
+    :param message: The log message
+    :type message: Python String
+    :param payload: The payload to dump, non strings are JSON encoded
+    :type payload: Python type - Dict / list / int / string / float / None
+    :param fields: Additional fields added to the JSON line
+    :type fields: Python Dict
+    '''
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if DEBUG_PAYLOAD_SAMPLE_RATE < 1.0 and random.random() >= DEBUG_PAYLOAD_SAMPLE_RATE:
+        return
+
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8', 'replace')
+    elif not isinstance(payload, str):
+        payload = json.dumps(payload, default=str)
+
+    fields['payloadLength'] = len(payload)
+    fields['payload'] = truncate(payload)
+    logger.debug(message, extra={'fields': fields})
+
+def truncate(value, max_length=None):
+    '''
+    truncate Caps the length of a string for logging.
+    :param value: The string to truncate
+    :type value: Python String
+    :param max_length: The maximum length, defaults to MAX_PAYLOAD_LOG_LENGTH
+    :type max_length: Python Integer
+    :return: The truncated string
+    :rtype: Python String
+    '''
+    max_length = MAX_PAYLOAD_LOG_LENGTH if max_length == None else max_length
+    if len(value) <= max_length:
+        return value
+
+    return f'{value[:max_length]}...[{len(value) - max_length} more]'
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import logging
+import math
+import re
+import time
+from urllib.parse import urlparse
+
+from awsClients import get_client, get_resource
+from outputPlanning import get_query_output_location
+from pipelineLogging import get_logger, log_event
+from queryTemplates import render_template
+from taskGraph import TaskGraph
+
+# What a curation does when its query plan has findings
+PREFLIGHT_WARN = 'warn'   # The findings are logged and recorded, the curation runs
+PREFLIGHT_BLOCK = 'block' # The curation fails before its query is started
+PREFLIGHT_MODES = [PREFLIGHT_WARN, PREFLIGHT_BLOCK]
+
+# How long an EXPLAIN may take, and how often it is polled, in seconds
+EXPLAIN_TIMEOUT_SECONDS = 60
+EXPLAIN_POLL_SECONDS = 1
+# Plans are kept in the curation state table this long after they are made
+PLAN_RETENTION_SECONDS = 30 * 86400
+# Glue table parameters crawlers and writers record the table size in
+TABLE_SIZE_PARAMETERS = ['sizeKey', 'totalSize', 'rawDataSize']
+# Blocked curations fail with this message followed by the findings as a
+# JSON list, the failure is all the unsuccessful curation receives
+BLOCKED_MESSAGE = 'Pre-flight check failed: '
+# Trino prints cross joins as CrossJoin, or as a join without criteria
+CROSS_JOIN_PATTERN = re.compile(r'\bCrossJoin\b|\bJoin\[\s*type\s*=\s*CROSS\b', re.IGNORECASE)
+
+logger = get_logger(__name__)
+
+# Analysed plans by plan key, for the life of the container
+plans = {}
+
+class PreflightCheckException(Exception):
+    def __init__(self, message, findings=None):
+        super().__init__(message)
+        self.findings = findings
+
+def run_preflight_check(event, sql_template):
+    '''
+    run_preflight_check Plans the curation's query with EXPLAIN, without
+    running it, and checks the plan for full scans of partitioned tables,
+    cross joins and an estimated scan over the curation's maxBytesScanned.
+    A plan is only made once per script commit and query parameters.
+    :param event: The curation engine event
+    :type event: Python Dict
+    :param sql_template: The sql script at the curation's commit
+    :type sql_template: Python String
+    :return: The estimated bytes scanned and the findings
+    :rtype: Python Dict
+    :raises PreflightCheckException: If there are findings and the preflightCheck is block
+    '''
+    mode = event['athenaDetails']['preflightCheck']
+    try:
+        plan = get_plan(event, sql_template)
+    except Exception as e:
+        # Planning is advisory, a query that cannot be planned fails when it runs
+        log_event(
+            logger, logging.WARNING, 'Query could not be planned',
+            curationType=event['curationDetails']['curationType'], error=str(e))
+        return {'planned': False, 'findings': []}
+
+    estimated_bytes = sum(table['estimatedBytes'] for table in plan['tables'] if table['estimatedBytes'] != None)
+    findings = get_findings(plan, estimated_bytes, event['athenaDetails'].get('maxBytesScanned'))
+    if findings and mode == PREFLIGHT_BLOCK:
+        raise PreflightCheckException(f'{BLOCKED_MESSAGE}{json.dumps(findings)}', findings)
+    if findings:
+        log_event(
+            logger, logging.WARNING, 'Pre-flight check findings',
+            curationType=event['curationDetails']['curationType'], findings=findings)
+
+    return {
+        'planned': True,
+        'estimatedBytes': estimated_bytes,
+        'estimateComplete': all(table['estimatedBytes'] != None for table in plan['tables']),
+        'findings': findings
+    }
+
+def get_blocked_findings(error_cause):
+    '''
+    get_blocked_findings Reads the findings back from the failure of a
+    curation blocked by its pre-flight check.
+    :param error_cause: The error cause the state machine caught
+    :type error_cause: Python Dict
+    :return: The findings, or None if the curation was not blocked
+    :rtype: Python List / None
+    '''
+    message = error_cause.get('errorMessage', '')
+    if error_cause.get('errorType') != PreflightCheckException.__name__ or not message.startswith(BLOCKED_MESSAGE):
+        return None
+
+    try:
+        return json.loads(message[len(BLOCKED_MESSAGE):])
+    except ValueError:
+        return None
+
+def get_findings(plan, estimated_bytes, max_bytes_scanned=None):
+    findings = [
+        f'{table["table"]} is partitioned but no partition column is filtered, so every partition is scanned'
+        for table in plan['tables'] if table['partitioned'] and not table['partitionFiltered']]
+    if plan['crossJoin']:
+        findings.append('The query plan contains a cross join')
+    if max_bytes_scanned != None and estimated_bytes > int(max_bytes_scanned):
+        findings.append(
+            f'An estimated {estimated_bytes} bytes would be scanned, more than the {max_bytes_scanned} bytes allowed')
+
+    return findings
+
+def get_plan_key(event):
+    # A plan depends on the script and everything bound into or around it,
+    # except the runtime parameters that change on every run
+    plan_source = json.dumps({
+        'scriptFileCommitId': event['scriptFileCommitId'],
+        'scriptFilePath': event['scriptFilePath'],
+        'database': event['glueDetails']['database'],
+        'workgroup': event['athenaDetails'].get('workgroup'),
+        'accountDetails': event.get('accountDetails'),
+        'queryParameters': event.get('queryParameters')
+    }, sort_keys=True, default=str)
+
+    return hashlib.sha256(plan_source.encode('utf-8')).hexdigest()
+
+def get_plan(event, sql_template):
+    '''
+    get_plan Returns the analysed plan of the curation's query, from the
+    container, then the curation state table, before planning it.
+    :param event: The curation engine event
+    :type event: Python Dict
+    :param sql_template: The sql script at the curation's commit
+    :type sql_template: Python String
+    :return: The tables the query reads and whether it cross joins
+    :rtype: Python Dict
+    '''
+    plan_key = get_plan_key(event)
+    if plan_key in plans:
+        return plans[plan_key]
+
+    state_table_name = event['settings'].get('curationStateTableName')
+    if state_table_name != None:
+        table = get_resource('dynamodb').Table(state_table_name)
+        item = table.get_item(Key={'stateKey': f'plan#{plan_key}'}).get('Item')
+        if item != None:
+            plans[plan_key] = json.loads(item['plan'])
+            return plans[plan_key]
+
+    plan = analyse_plan(
+        render_template(sql_template, event), event['glueDetails']['database'],
+        event['athenaDetails'].get('workgroup'), get_query_output_location(event), event.get('accountDetails'))
+
+    if state_table_name != None:
+        table.put_item(Item={
+            'stateKey': f'plan#{plan_key}',
+            'plan': json.dumps(plan),
+            'expiresAt': int(time.time()) + PLAN_RETENTION_SECONDS
+        })
+    plans[plan_key] = plan
+    return plan
+
+def analyse_plan(sql, database, workgroup, output_location, account_details=None):
+    '''
+    analyse_plan Runs EXPLAIN for the tables and filters the query reads
+    and for its distributed plan, then looks up whether each table is
+    partitioned and how many bytes reading it is estimated to scan.
+    :param sql: The sql with its parameters inlined
+    :type sql: Python String
+    :param database: The glue database the query runs in
+    :type database: Python String
+    :param workgroup: The athena workgroup, or None
+    :type workgroup: Python String / None
+    :param output_location: The s3 location EXPLAIN results are written to
+    :type output_location: Python String
+    :param account_details: The curation's region and roleArn (optional)
+    :type account_details: Python Dict / None
+    :return: The tables the query reads and whether it cross joins
+    :rtype: Python Dict
+    '''
+    graph = TaskGraph()
+    graph.add('io', explain, sql, '(TYPE IO, FORMAT JSON)', database, workgroup, output_location, account_details)
+    graph.add('distributed', explain, sql, '(TYPE DISTRIBUTED)', database, workgroup, output_location, account_details)
+    explained = graph.run()
+
+    tables = []
+    # NaN is how athena reports an estimate it does not have
+    for info in json.loads(explained['io']).get('inputTableColumnInfos', []):
+        table_database = info['table']['schemaTable']['schema']
+        table_name = info['table']['schemaTable']['table']
+        glue_table = get_glue_table(table_database, table_name, account_details)
+        partition_keys = set(key['Name'] for key in glue_table.get('PartitionKeys', []))
+        filtered_columns = set(constraint['columnName'] for constraint in info.get('columnConstraints', []))
+        partition_filtered = len(partition_keys & filtered_columns) > 0
+
+        tables.append({
+            'table': f'{table_database}.{table_name}',
+            'partitioned': len(partition_keys) > 0,
+            'partitionFiltered': partition_filtered,
+            'estimatedBytes': get_estimated_bytes(info.get('estimate', {}), glue_table, partition_filtered)
+        })
+
+    return {'tables': tables, 'crossJoin': CROSS_JOIN_PATTERN.search(explained['distributed']) != None}
+
+def get_estimated_bytes(estimate, glue_table, partition_filtered):
+    '''
+    get_estimated_bytes Estimates the bytes reading a table scans; from
+    athena's estimate if it has table statistics, otherwise the table size
+    recorded in glue when the whole table is read.
+    :return: The estimated bytes, or None if it cannot be estimated
+    :rtype: Python Integer / None
+    '''
+    size = estimate.get('outputSizeInBytes')
+    if isinstance(size, (int, float)) and not math.isnan(size) and not math.isinf(size):
+        return int(size)
+
+    if partition_filtered:
+        return None
+    parameters = glue_table.get('Parameters', {})
+    for name in TABLE_SIZE_PARAMETERS:
+        if parameters.get(name, '').isdigit():
+            return int(parameters[name])
+
+    return None
+
+def explain(sql, options, database, workgroup, output_location, account_details=None):
+    '''
+    explain Runs an EXPLAIN of the sql and waits for its plan, EXPLAIN
+    plans the query without reading any data.
+    :return: The plan
+    :rtype: Python String
+    :raises PreflightCheckException: If the EXPLAIN fails or times out
+    '''
+    client = get_client('athena', account_details)
+
+    query_args = {
+        'QueryString': f'EXPLAIN {options} {sql}',
+        'QueryExecutionContext': {'Database': database},
+        'ResultConfiguration': {'OutputLocation': output_location}
+    }
+    if workgroup != None:
+        query_args['WorkGroup'] = workgroup
+    query_execution_id = client.start_query_execution(**query_args)['QueryExecutionId']
+
+    deadline = time.time() + EXPLAIN_TIMEOUT_SECONDS
+    while True:
+        execution = client.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+        state = execution['Status']['State']
+        if state == 'SUCCEEDED':
+            break
+        if state in ('FAILED', 'CANCELLED'):
+            raise PreflightCheckException(
+                f'EXPLAIN {state.lower()}: {execution["Status"].get("StateChangeReason", "")}')
+        if time.time() > deadline:
+            client.stop_query_execution(QueryExecutionId=query_execution_id)
+            raise PreflightCheckException(f'EXPLAIN did not finish within {EXPLAIN_TIMEOUT_SECONDS} seconds')
+        time.sleep(EXPLAIN_POLL_SECONDS)
+
+    lines = []
+    paginator = client.get_paginator('get_query_results')
+    for page in paginator.paginate(QueryExecutionId=query_execution_id):
+        for row in page['ResultSet']['Rows']:
+            lines.extend(value.get('VarCharValue', '') for value in row['Data'])
+
+    delete_explain_result(execution['ResultConfiguration']['OutputLocation'], account_details)
+    # The first row is the Query Plan header
+    return '\n'.join(lines[1:] if lines and lines[0] == 'Query Plan' else lines)
+
+def delete_explain_result(result_location, account_details=None):
+    client = get_client('s3', account_details)
+
+    location = urlparse(result_location)
+    for key in (location.path.lstrip('/'), location.path.lstrip('/') + '.metadata'):
+        client.delete_object(Bucket=location.netloc, Key=key)
+
+def get_glue_table(database, table, account_details=None):
+    client = get_client('glue', account_details)
+
+    return client.get_table(DatabaseName=database, Name=table)['Table']
@@ -0,0 +1,131 @@
+import cProfile
+import functools
+import gzip
+import io
+import logging
+import marshal
+import os
+import pstats
+import random
+import tracemalloc
+from datetime import datetime
+
+from awsClients import get_client
+from pipelineLogging import get_logger, log_event
+
+# The fraction (0.0 - 1.0) of invocations profiled, events can also
+# ask for a profile with "profile": true (or in their settings)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0') or 0)
+# s3://bucket/prefix/ the profiles are written to, only logged if not set
+PROFILE_S3_LOCATION = os.environ.get('PROFILE_S3_LOCATION', '')
+# Frames kept for each allocation, more frames cost more memory and time
+TRACEMALLOC_FRAMES = 10
+# Number of functions and allocations included in the summary
+SUMMARY_LIMIT = 30
+
+logger = get_logger(__name__)
+
+def profiled(handler):
+    '''
+    profiled Decorates a lambda handler so that sampled or requested
+    invocations capture cProfile stats and the top tracemalloc allocations.
+    Profiling never changes the result or exception of the handler.
+    :param handler: The lambda handler
+    :type handler: Python Function
+    :return: The decorated handler
+    :rtype: Python Function
+    '''
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if not should_profile(event):
+            return handler(event, context)
+
+        profiler = cProfile.Profile()
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        started = datetime.utcnow()
+        profiler.enable()
+        try:
+            return handler(event, context)
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            try:
+                save_profile(event, context, profiler, snapshot, peak_memory, started)
+            except Exception as e:
+                log_event(logger, logging.WARNING, 'Profile could not be saved', error=str(e))
+
+    return wrapper
+
+def should_profile(event):
+    if isinstance(event, dict):
+        settings = event.get('settings')
+        if event.get('profile') == True or \
+                (isinstance(settings, dict) and settings.get('profile') == True):
+            return True
+
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def save_profile(event, context, profiler, snapshot, peak_memory, started):
+    '''
+    save_profile Writes the gzipped pstats dump, readable with pstats or
+    snakeviz once unzipped, and a gzipped text summary of the slowest
+    functions and largest allocations under the curation execution name.
+    :param event: The lambda event
+    :type event: Python Dict
+    :param context: The lambda context
+    :type context: LambdaContext
+    :param profiler: The disabled profiler
+    :type profiler: cProfile.Profile
+    :param snapshot: The tracemalloc snapshot taken after the handler
+    :type snapshot: tracemalloc.Snapshot
+    :param peak_memory: The peak traced memory in bytes
+    :type peak_memory: Python Integer
+    :param started: When the invocation started
+    :type started: datetime
+    '''
+    function_name = getattr(context, 'function_name', 'local')
+    request_id = getattr(context, 'aws_request_id', started.strftime('%H%M%S%f'))
+    execution_name = get_execution_name(event) or started.strftime('%Y%m%d')
+
+    summary = io.StringIO()
+    summary.write(f'{function_name} {request_id} peak traced memory {peak_memory} bytes\n\n')
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats('cumulative').print_stats(SUMMARY_LIMIT)
+    summary.write('Top allocations\n')
+    for statistic in snapshot.statistics('lineno')[:SUMMARY_LIMIT]:
+        summary.write(f'{statistic}\n')
+
+    if PROFILE_S3_LOCATION == '':
+        logger.info(summary.getvalue())
+        return
+
+    bucket, _, prefix = PROFILE_S3_LOCATION[len('s3://'):].partition('/')
+    if prefix != '' and not prefix.endswith('/'):
+        prefix = f'{prefix}/'
+    key = f'{prefix}{execution_name}/{function_name}/{request_id}'
+
+    profiler.create_stats()
+    client = get_client('s3')
+    client.put_object(
+        Bucket=bucket,
+        Key=f'{key}.prof.gz',
+        Body=gzip.compress(marshal.dumps(profiler.stats)),
+        ContentType='application/octet-stream')
+    client.put_object(
+        Bucket=bucket,
+        Key=f'{key}.txt.gz',
+        Body=gzip.compress(summary.getvalue().encode('utf-8')),
+        ContentType='text/plain',
+        ContentEncoding='gzip')
+
+    log_event(
+        logger, logging.INFO, 'Profile saved',
+        location=f's3://{bucket}/{key}', peakMemory=peak_memory)
+
+def get_execution_name(event):
+    if isinstance(event, dict) and isinstance(event.get('curationDetails'), dict):
+        return event['curationDetails'].get('curationExecutionName')
+
+    return None
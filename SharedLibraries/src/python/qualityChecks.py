@@ -0,0 +1,80 @@
+import time
+
+from awsClients import get_client, get_resource
+from outputPlanning import get_bucket, get_existing_path
+from resultSharing import release_query_result
+from resultTables import delete_table
+from taskGraph import TaskGraph
+
+# The quality query is recorded for failed runs, whose state machine
+# loses the quality details when the finalization fails
+STATE_RETENTION_SECONDS = 86400
+
+def get_quality_table_name(query_execution_id):
+    return 'result_' + query_execution_id.replace('-', '_')
+
+def get_quality_key(query_execution_id):
+    return f'quality#{query_execution_id}'
+
+def record_quality_query(table_name, query_execution_id, quality_query_execution_id):
+    get_resource('dynamodb').Table(table_name).put_item(Item={
+        'stateKey': get_quality_key(query_execution_id),
+        'qualityQueryExecutionId': quality_query_execution_id,
+        'expiresAt': int(time.time()) + STATE_RETENTION_SECONDS
+    })
+
+def get_quality_query(table_name, query_execution_id):
+    item = get_resource('dynamodb').Table(table_name).get_item(
+        Key={'stateKey': get_quality_key(query_execution_id)}).get('Item')
+
+    return item['qualityQueryExecutionId'] if item != None else None
+
+def clean_up_quality_checks(event, database, quality_query_execution_id=None):
+    '''
+    clean_up_quality_checks Drops the quality check table and result,
+    stopping the quality query if it is still running, and releases the
+    athena result the finalization left for the quality query to read.
+    :param event: The curation engine event
+    :type event: Python Dict
+    :param database: The database of the quality check table
+    :type database: Python String
+    :param quality_query_execution_id: The quality query, if it was started
+    :type quality_query_execution_id: Python String / None
+    '''
+    account_details = event.get('accountDetails')
+
+    graph = TaskGraph()
+    graph.add(
+        'deleteQualityTable', delete_table,
+        database, get_quality_table_name(event['queryDetails']['queryExecutionId']), account_details)
+    if quality_query_execution_id != None:
+        graph.add('deleteQualityResult', delete_quality_result, quality_query_execution_id, account_details)
+
+    # Matches the release update output details defers while quality checks run
+    release_query_result(event, graph)
+
+    graph.run()
+
+def delete_quality_result(query_execution_id, account_details=None):
+    client = get_client('athena', account_details)
+
+    execution = client.get_query_execution(
+        QueryExecutionId=query_execution_id
+    )['QueryExecution']
+    if execution['Status']['State'] in ('QUEUED', 'RUNNING'):
+        client.stop_query_execution(
+            QueryExecutionId=query_execution_id
+        )
+
+    quality_output_location = execution.get('ResultConfiguration', {}).get('OutputLocation')
+    if quality_output_location != None:
+        delete_object(get_existing_path(quality_output_location), get_bucket(quality_output_location), account_details)
+        delete_object(f'{get_existing_path(quality_output_location)}.metadata', get_bucket(quality_output_location), account_details)
+
+def delete_object(key, bucket, account_details=None):
+    client = get_client('s3', account_details)
+
+    client.delete_object(
+        Bucket=bucket,
+        Key=key
+    )
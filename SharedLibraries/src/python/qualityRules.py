@@ -0,0 +1,142 @@
+import time
+
+# Rules a curation can define in its qualityRules, e.g.
+# {
+#     "rowCount": {"min": 1, "max": 1000000},
+#     "nullRatio": {"customer_id": 0, "email": 0.05},
+#     "unique": ["booking_id", ["customer_id", "booking_date"]],
+#     "freshness": {"column": "booking_time", "maxAgeHours": 24}
+# }
+RULE_NAMES = ['rowCount', 'nullRatio', 'unique', 'freshness']
+
+class QualityRuleException(Exception):
+    pass
+
+def validate_quality_rules(rules):
+    '''
+    validate_quality_rules Checks the structure of the quality rules, so a
+    badly defined rule fails before the curation query runs.
+    :param rules: The qualityRules of the curation details item
+    :type rules: Python Dict
+    :raises QualityRuleException: If a rule is not understood
+    '''
+    if not isinstance(rules, dict):
+        raise QualityRuleException('qualityRules must be a map of rules')
+    unknown = [name for name in rules if name not in RULE_NAMES]
+    if unknown:
+        raise QualityRuleException(f'Unknown quality rules: {", ".join(unknown)}')
+
+    if 'rowCount' in rules and not set(rules['rowCount']) <= {'min', 'max'}:
+        raise QualityRuleException('rowCount accepts min and / or max')
+    if 'nullRatio' in rules and not isinstance(rules['nullRatio'], dict):
+        raise QualityRuleException('nullRatio must map column names to the highest allowed ratio')
+    if 'unique' in rules and not isinstance(rules['unique'], list):
+        raise QualityRuleException('unique must be a list of columns, or lists of columns')
+    if 'freshness' in rules and not {'column', 'maxAgeHours'} <= set(rules['freshness']):
+        raise QualityRuleException('freshness requires a column and maxAgeHours')
+
+def get_checks(rules):
+    '''
+    get_checks Expands the quality rules into individual checks, each
+    with the alias of the aggregate that measures it. The order is
+    deterministic so the query and the evaluation agree.
+    :param rules: The qualityRules of the curation details item
+    :type rules: Python Dict
+    :return: The checks
+    :rtype: Python List - Dict
+    '''
+    checks = []
+    if 'rowCount' in rules:
+        checks.append({'rule': 'rowCount', 'columns': [], 'alias': 'row_count'})
+    for i, column in enumerate(sorted(rules.get('nullRatio', {}))):
+        checks.append({'rule': 'nullRatio', 'columns': [column], 'alias': f'null_count_{i}'})
+    for i, unique in enumerate(rules.get('unique', [])):
+        columns = unique if isinstance(unique, list) else [unique]
+        checks.append({'rule': 'unique', 'columns': columns, 'alias': f'distinct_count_{i}'})
+    if 'freshness' in rules:
+        checks.append({'rule': 'freshness', 'columns': [rules['freshness']['column']], 'alias': 'max_timestamp'})
+
+    return checks
+
+def compile_quality_query(rules, table, source_path, columns):
+    '''
+    compile_quality_query Compiles every quality rule into a single
+    aggregate query, so the result is scanned once whatever the rules.
+    :param rules: The qualityRules of the curation details item
+    :type rules: Python Dict
+    :param table: The table over the query result folder
+    :type table: Python String
+    :param source_path: The s3 path of the query result within the folder
+    :type source_path: Python String
+    :param columns: The column names of the query result
+    :type columns: Python List
+    :return: The aggregate query
+    :rtype: Python String
+    :raises QualityRuleException: If a rule references an unknown column
+    '''
+    expressions = ['count(*) AS row_count']
+    for check in get_checks(rules):
+        for column in check['columns']:
+            if column.lower() not in columns:
+                raise QualityRuleException(
+                    f'Quality rule {check["rule"]} references {column}, which is not in the query result')
+
+        quoted = [quote_identifier(column) for column in check['columns']]
+        if check['rule'] == 'nullRatio':
+            # Athena writes nulls as empty csv fields
+            expressions.append(
+                f"sum(CASE WHEN {quoted[0]} IS NULL OR {quoted[0]} = '' THEN 1 ELSE 0 END) AS {check['alias']}")
+        elif check['rule'] == 'unique':
+            distinct = quoted[0] if len(quoted) == 1 else f'ROW({", ".join(quoted)})'
+            expressions.append(f'count(DISTINCT {distinct}) AS {check["alias"]}')
+        elif check['rule'] == 'freshness':
+            expressions.append(
+                f'to_unixtime(max(try_cast({quoted[0]} AS timestamp))) AS {check["alias"]}')
+
+    escaped_path = source_path.replace("'", "''")
+    return f'SELECT {", ".join(expressions)} FROM {quote_identifier(table)} WHERE "$path" = \'{escaped_path}\''
+
+def evaluate_quality_rules(rules, values, now=None):
+    '''
+    evaluate_quality_rules Compares the aggregates of the quality query
+    with the thresholds of each rule.
+    :param rules: The qualityRules of the curation details item
+    :type rules: Python Dict
+    :param values: The quality query row, keyed by alias
+    :type values: Python Dict
+    :param now: Epoch seconds freshness is measured from (default now)
+    :type now: Python Float, optional
+    :return: The result of each check
+    :rtype: Python List - Dict
+    '''
+    now = time.time() if now == None else now
+    row_count = int(values['row_count'] or 0)
+
+    results = []
+    for check in get_checks(rules):
+        value = values.get(check['alias'])
+        result = {'rule': check['rule'], 'columns': check['columns']}
+        if check['rule'] == 'rowCount':
+            bounds = rules['rowCount']
+            result['actual'] = row_count
+            result['passed'] = ('min' not in bounds or row_count >= int(bounds['min'])) and \
+                ('max' not in bounds or row_count <= int(bounds['max']))
+        elif check['rule'] == 'nullRatio':
+            ratio = int(value or 0) / row_count if row_count > 0 else 0.0
+            result['actual'] = round(ratio, 6)
+            result['passed'] = ratio <= float(rules['nullRatio'][check['columns'][0]])
+        elif check['rule'] == 'unique':
+            duplicates = row_count - int(value or 0)
+            result['actual'] = duplicates
+            result['passed'] = duplicates == 0
+        elif check['rule'] == 'freshness':
+            age_hours = (now - float(value)) / 3600 if value != None else None
+            result['actual'] = round(age_hours, 3) if age_hours != None else None
+            result['passed'] = age_hours != None and age_hours <= float(rules['freshness']['maxAgeHours'])
+        results.append(result)
+
+    return results
+
+def quote_identifier(identifier):
+    escaped = identifier.lower().replace('"', '""')
+    return f'"{escaped}"'
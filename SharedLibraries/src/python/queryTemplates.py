@@ -0,0 +1,58 @@
+import numbers
+import re
+
+# Template placeholders look like {{ name }} and are bound as parameters
+PARAMETER_PATTERN = re.compile(r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}')
+# Runtime values from the curation details that every template can use
+RUNTIME_PARAMETERS = ['curationType', 'curationExecutionName', 'curationTimestamp']
+
+def get_parameter_values(event):
+    '''
+    get_parameter_values Collects the values template parameters can take,
+    the runtime curation details and the curation's queryParameters.
+    :param event: The curation engine event
+    :type event: Python Dict
+    :return: The value of each parameter name
+    :rtype: Python Dict
+    '''
+    values = {name: event['curationDetails'][name]
+        for name in RUNTIME_PARAMETERS if name in event['curationDetails']}
+    if 'queryParameters' in event and event['queryParameters'] != None:
+        values.update(event['queryParameters'])
+
+    return values
+
+def render_template(sql_template, event):
+    '''
+    render_template Replaces each {{ name }} placeholder with its value as a
+    sql literal, for statements such as EXPLAIN that are not run with
+    execution parameters. Placeholders without a value are left as they are.
+    :param sql_template: The sql script
+    :type sql_template: Python String
+    :param event: The curation engine event
+    :type event: Python Dict
+    :return: The sql with the parameter values inlined
+    :rtype: Python String
+    '''
+    values = get_parameter_values(event)
+
+    return PARAMETER_PATTERN.sub(
+        lambda match: to_sql_literal(values[match.group(1)]) if match.group(1) in values else match.group(0),
+        sql_template)
+
+def to_sql_literal(value):
+    '''
+    to_sql_literal Formats a parameter value as a sql literal; strings are
+    quoted, numbers and booleans are passed as they are.
+    :param value: The parameter value
+    :type value: Python String / Integer / Float / Decimal / Boolean
+    :return: The sql literal
+    :rtype: Python String
+    '''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, numbers.Number):
+        return str(value)
+
+    escaped = str(value).replace("'", "''")
+    return f"'{escaped}'"
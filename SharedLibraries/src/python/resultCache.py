@@ -0,0 +1,72 @@
+import gzip
+import json
+import time
+
+from awsClients import get_resource
+
+# DynamoDB items are at most 400KB, the compressed rows must leave room
+# for the rest of the item
+MAX_CACHED_BYTES = 350 * 1024
+
+def get_cache_key(curation_type):
+    return f'rows#{curation_type}'
+
+def cache_rows(table_name, curation_type, columns, rows, curation_details):
+    '''
+    cache_rows Stores the latest rows of a small curation output, gzipped,
+    in the curation state table, replacing the rows of the previous run,
+    which are removed if the latest rows do not fit.
+    :param table_name: The curation state table name
+    :type table_name: Python String
+    :param curation_type: The unique Id of the curation
+    :type curation_type: Python String
+    :param columns: The column names
+    :type columns: Python List
+    :param rows: The rows, each a list of values (None for nulls)
+    :type rows: Python List
+    :param curation_details: The curation details of the run
+    :type curation_details: Python Dict
+    :return: Whether the rows were small enough to be cached
+    :rtype: Python Boolean
+    '''
+    table = get_resource('dynamodb').Table(table_name)
+
+    body = gzip.compress(json.dumps({'columns': columns, 'rows': rows}).encode('utf-8'))
+    if len(body) > MAX_CACHED_BYTES:
+        # The previous run's rows would otherwise be read as the latest
+        table.delete_item(Key={'stateKey': get_cache_key(curation_type)})
+        return False
+
+    table.put_item(Item={
+        'stateKey': get_cache_key(curation_type),
+        'rows': body,
+        'rowCount': len(rows),
+        'curationExecutionName': curation_details['curationExecutionName'],
+        'curationLocation': curation_details['curationLocation'],
+        'cachedAt': int(time.time())
+    })
+    return True
+
+def get_cached_rows(table_name, curation_type):
+    '''
+    get_cached_rows Reads the latest cached rows of a curation, for readers
+    that need them with lower latency than reading the output from S3.
+    :param table_name: The curation state table name
+    :type table_name: Python String
+    :param curation_type: The unique Id of the curation
+    :type curation_type: Python String
+    :return: The columns, rows and the run they came from, or None if not cached
+    :rtype: Python Dict / None
+    '''
+    table = get_resource('dynamodb').Table(table_name)
+    item = table.get_item(Key={'stateKey': get_cache_key(curation_type)}).get('Item')
+    if item == None:
+        return None
+
+    cached = json.loads(gzip.decompress(item['rows'].value).decode('utf-8'))
+    cached.update({
+        'curationExecutionName': item['curationExecutionName'],
+        'curationLocation': item['curationLocation'],
+        'cachedAt': int(item['cachedAt'])
+    })
+    return cached
@@ -0,0 +1,301 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+from awsClients import get_client, get_resource
+from outputPlanning import get_bucket, get_existing_path, plan_output
+from pipelineLogging import get_logger, log_event
+from taskGraph import TaskGraph
+
+# Identical queries started within this many seconds share one athena query,
+# 0 turns result sharing off
+SHARING_WINDOW_SECONDS = int(os.environ.get('RESULT_SHARING_WINDOW_SECONDS', '0'))
+# How long the sharing state is kept after the window, for late finalizations
+STATE_RETENTION_SECONDS = 86400
+
+logger = get_logger(__name__)
+
+def is_sharing_enabled(event):
+    # Outputs without a filename are named after the query, which would be
+    # the same object for every curation sharing it
+    return SHARING_WINDOW_SECONDS > 0 and \
+        event['settings'].get('curationStateTableName') != None and \
+        event['athenaDetails'].get('shareResults', True) != False and \
+        event['outputDetails'].get('outputFilename') != None
+
+def normalize_sql(sql):
+    '''
+    normalize_sql Removes comments, a trailing semicolon and repeated
+    whitespace outside of quoted literals and identifiers, so formatting
+    differences do not stop identical queries sharing a result.
+    :param sql: The compiled sql
+    :type sql: Python String
+    :return: The normalized sql
+    :rtype: Python String
+    '''
+    normalized = []
+    i = 0
+    quote = None
+    while i < len(sql):
+        char = sql[i]
+        if quote != None:
+            normalized.append(char)
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+            normalized.append(char)
+        elif sql.startswith('--', i):
+            end = sql.find('\n', i)
+            i = len(sql) if end == -1 else end
+            normalized.append(' ')
+            continue
+        elif sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = len(sql) if end == -1 else end + 2
+            normalized.append(' ')
+            continue
+        elif char.isspace():
+            normalized.append(' ')
+        else:
+            normalized.append(char)
+        i += 1
+
+    return ' '.join(''.join(normalized).split()).rstrip('; ')
+
+def get_share_key(sql, execution_parameters, database, workgroup, account_details, output_location, max_bytes_scanned=None):
+    '''
+    get_share_key Identifies the result of a query, the same normalized sql
+    bound to the same parameters against the same database, workgroup,
+    region and account always has the same result. Outputs are planned from
+    the athena result's key, and over budget queries are stopped, so only
+    queries with the same output location and scan budget are shared.
+    :return: The share key
+    :rtype: Python String
+    '''
+    identity = json.dumps({
+        'sql': normalize_sql(sql),
+        'parameters': execution_parameters,
+        'database': database,
+        'workgroup': workgroup,
+        'accountDetails': account_details,
+        'outputLocation': output_location,
+        'maxBytesScanned': max_bytes_scanned
+    }, sort_keys=True, default=str)
+
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+def join_shared_query(table_name, share_key):
+    '''
+    join_shared_query Joins an identical query started within the sharing
+    window, unless its result has already been released.
+    :param table_name: The curation state table name
+    :type table_name: Python String
+    :param share_key: The share key of the query
+    :type share_key: Python String
+    :return: The shared queryExecutionId and outputLocation, or None
+    :rtype: Python Dict / None
+    '''
+    table = get_resource('dynamodb').Table(table_name)
+    shared = table.get_item(Key={'stateKey': f'query#{share_key}'}).get('Item')
+    if shared == None or int(shared['startedAt']) <= time.time() - SHARING_WINDOW_SECONDS:
+        return None
+
+    try:
+        table.update_item(
+            Key={'stateKey': f'result#{shared["queryExecutionId"]}'},
+            UpdateExpression='ADD consumers :one',
+            ConditionExpression='attribute_exists(consumers) AND attribute_not_exists(closed)',
+            ExpressionAttributeValues={':one': 1}
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+
+    log_event(
+        logger, logging.INFO, 'Joined shared query',
+        queryExecutionId=shared['queryExecutionId'], shareKey=share_key)
+    return {'queryExecutionId': shared['queryExecutionId'], 'outputLocation': shared['outputLocation']}
+
+def share_query(table_name, share_key, query_execution_id, output_location):
+    '''
+    share_query Tracks the consumers of a newly started query's result and
+    offers it to identical queries. If another execution shared an
+    identical query first, that query is joined instead.
+    :param table_name: The curation state table name
+    :type table_name: Python String
+    :param share_key: The share key of the query
+    :type share_key: Python String
+    :param query_execution_id: The query that was started
+    :type query_execution_id: Python String
+    :param output_location: The s3 location of the query result
+    :type output_location: Python String
+    :return: The query this execution should use, if not its own
+    :rtype: Python Dict / None
+    '''
+    table = get_resource('dynamodb').Table(table_name)
+    now = int(time.time())
+    table.put_item(Item={
+        'stateKey': f'result#{query_execution_id}',
+        'consumers': 1,
+        'expiresAt': now + SHARING_WINDOW_SECONDS + STATE_RETENTION_SECONDS
+    })
+
+    try:
+        table.put_item(
+            Item={
+                'stateKey': f'query#{share_key}',
+                'queryExecutionId': query_execution_id,
+                'outputLocation': output_location,
+                'startedAt': now,
+                'expiresAt': now + SHARING_WINDOW_SECONDS + STATE_RETENTION_SECONDS
+            },
+            ConditionExpression='attribute_not_exists(stateKey) OR startedAt <= :windowFloor',
+            ExpressionAttributeValues={':windowFloor': now - SHARING_WINDOW_SECONDS}
+        )
+        return None
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return join_shared_query(table_name, share_key)
+
+def has_other_consumers(table_name, query_execution_id):
+    table = get_resource('dynamodb').Table(table_name)
+    result = table.get_item(Key={'stateKey': f'result#{query_execution_id}'}).get('Item')
+
+    return result != None and int(result.get('consumers', 0)) > 1
+
+def release_shared_result(table_name, query_execution_id, consumer, keep_source, keep_metadata):
+    '''
+    release_shared_result Marks one consumer of a query result as finalized.
+    The last consumer to finish closes the result, so it can no longer be
+    joined, and is told whether the result and metadata files may be deleted.
+    Releasing the same consumer twice only counts once.
+    :param table_name: The curation state table name
+    :type table_name: Python String
+    :param query_execution_id: The shared query
+    :type query_execution_id: Python String
+    :param consumer: The curation execution name
+    :type consumer: Python String
+    :param keep_source: Whether this consumer needs the result file kept
+    :type keep_source: Python Boolean
+    :param keep_metadata: Whether this consumer needs the metadata file kept
+    :type keep_metadata: Python Boolean
+    :return: Whether the result and the metadata file may be deleted
+    :rtype: Python Tuple - (Boolean, Boolean)
+    '''
+    table = get_resource('dynamodb').Table(table_name)
+    key = {'stateKey': f'result#{query_execution_id}'}
+
+    update_expression = 'ADD finalizedBy :consumer'
+    if keep_source:
+        update_expression += ', keepSource :one'
+    if keep_metadata:
+        update_expression += ', keepMetadata :one'
+    result = table.update_item(
+        Key=key,
+        UpdateExpression=update_expression,
+        ExpressionAttributeValues={':consumer': set([consumer]), ':one': 1},
+        ReturnValues='ALL_NEW'
+    )['Attributes']
+    if len(result['finalizedBy']) < result.get('consumers', 0):
+        return False, False
+
+    try:
+        # Anyone joining now increases consumers, and closes the result instead
+        table.update_item(
+            Key=key,
+            UpdateExpression='SET closed = :true',
+            ConditionExpression='size(finalizedBy) = consumers AND attribute_not_exists(closed)',
+            ExpressionAttributeValues={':true': True}
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False, False
+
+    return 'keepSource' not in result, 'keepMetadata' not in result
+
+def release_query_result(event, graph=None, depends_on=()):
+    '''
+    release_query_result Deletes the athena result and its metadata file
+    once this curation has finished with them, as configured in its
+    athenaDetails. A shared result is only deleted by the last curation
+    using it, and only if none of them keep it.
+    :param event: The curation engine event
+    :type event: Python Dict
+    :param graph: Adds the deletes to this graph instead of running them (optional)
+    :type graph: TaskGraph / None
+    :param depends_on: The graph tasks still reading the athena result
+    :type depends_on: Python List / Tuple
+    '''
+    athenaDetails = event['athenaDetails']
+    curationDetails = event['curationDetails']
+    if curationDetails.get('resultReleased') == True:
+        return
+    curationDetails['resultReleased'] = True
+
+    queryDetails = event['queryDetails']
+    if 'queryOutputLocation' in queryDetails:
+        query_output_location = queryDetails['queryOutputLocation']
+    else:
+        query_output_location = f's3://{event["outputPlan"]["sourceBucket"]}/{event["outputPlan"]["sourceKey"]}'
+
+    keep_source = athenaDetails['deleteAthenaQueryFile'] != True or is_query_output(event, query_output_location)
+    keep_metadata = athenaDetails['deleteMetadataFileBool'] != True
+    bucket = get_bucket(query_output_location)
+    key = get_existing_path(query_output_location)
+    account_details = event.get('accountDetails')
+
+    run_now = graph == None
+    if run_now:
+        graph = TaskGraph()
+
+    if 'shareKey' in queryDetails:
+        # The other curations may delete a shared result as soon as it is
+        # released, so it is only released once this curation has read it
+        graph.add(
+            'releaseSharedResult', delete_shared_result,
+            event['settings']['curationStateTableName'], queryDetails['queryExecutionId'],
+            curationDetails['curationExecutionName'], keep_source, keep_metadata,
+            key, bucket, account_details, depends_on=depends_on)
+    else:
+        if not keep_metadata:
+            graph.add('deleteQueryMetadata', delete_object, f'{key}.metadata', bucket, account_details)
+        if not keep_source:
+            graph.add('deleteQueryResult', delete_object, key, bucket, account_details, depends_on=depends_on)
+
+    if run_now:
+        graph.run()
+
+def is_query_output(event, query_output_location):
+    '''
+    is_query_output Whether the athena result is the curation output itself,
+    which is kept whichever strategy finalized it, e.g. a self copy of a
+    small result rewritten inline.
+    :param event: The curation engine event
+    :type event: Python Dict
+    :param query_output_location: The s3 location of the athena result
+    :type query_output_location: Python String
+    :return: Whether the result is written to the output key
+    :rtype: Python Boolean
+    '''
+    plan = event.get('outputPlan')
+    if plan == None or f's3://{plan["sourceBucket"]}/{plan["sourceKey"]}' != query_output_location:
+        plan = plan_output(event, query_output_location)
+
+    return (plan['sourceBucket'], plan['sourceKey']) == (plan['outputBucket'], plan['outputKey'])
+
+def delete_shared_result(table_name, query_execution_id, consumer, keep_source, keep_metadata, key, bucket, account_details=None):
+    delete_source, delete_metadata = release_shared_result(
+        table_name, query_execution_id, consumer, keep_source, keep_metadata)
+
+    if delete_metadata:
+        delete_object(f'{key}.metadata', bucket, account_details)
+    if delete_source:
+        delete_object(key, bucket, account_details)
+
+def delete_object(key, bucket, account_details=None):
+    client = get_client('s3', account_details)
+
+    client.delete_object(
+        Bucket=bucket,
+        Key=key
+    )
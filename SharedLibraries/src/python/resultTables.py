@@ -0,0 +1,117 @@
+from awsClients import get_client
+
+# Athena writes its results as csv with every field quoted
+CSV_SERDE = 'org.apache.hadoop.hive.serde2.OpenCSVSerde'
+TEXT_INPUT_FORMAT = 'org.apache.hadoop.mapred.TextInputFormat'
+TEXT_OUTPUT_FORMAT = 'org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat'
+
+def get_result_columns(query_execution_id, account_details=None):
+    '''
+    get_result_columns Reads the column names and types of an athena query
+    result from its result set metadata, without reading the rows.
+    :param query_execution_id: The athena query execution id
+    :type query_execution_id: Python String
+    :param account_details: The curation's region and roleArn (optional)
+    :type account_details: Python Dict / None
+    :return: The columns, each with a name and type
+    :rtype: Python List - Dict
+    '''
+    client = get_client('athena', account_details)
+
+    response = client.get_query_results(
+        QueryExecutionId=query_execution_id,
+        MaxResults=1
+    )
+    column_info = response['ResultSet']['ResultSetMetadata']['ColumnInfo']
+
+    return [{'name': column['Name'].lower(), 'type': column['Type']} for column in column_info]
+
+def get_query_row(query_execution_id, account_details=None):
+    '''
+    get_query_row Reads the single row of an aggregate athena query.
+    :param query_execution_id: The athena query execution id
+    :type query_execution_id: Python String
+    :param account_details: The curation's region and roleArn (optional)
+    :type account_details: Python Dict / None
+    :return: The values keyed by column name, None for nulls
+    :rtype: Python Dict
+    '''
+    client = get_client('athena', account_details)
+
+    response = client.get_query_results(
+        QueryExecutionId=query_execution_id,
+        MaxResults=2
+    )
+    column_info = response['ResultSet']['ResultSetMetadata']['ColumnInfo']
+    rows = response['ResultSet']['Rows']
+    # The first row of a select is the header
+    values = rows[1]['Data'] if len(rows) > 1 else [{} for column in column_info]
+
+    return {column['Name']: value.get('VarCharValue') for column, value in zip(column_info, values)}
+
+def ensure_database(database, account_details=None):
+    client = get_client('glue', account_details)
+
+    try:
+        client.create_database(DatabaseInput={'Name': database})
+    except client.exceptions.AlreadyExistsException:
+        pass
+
+def create_csv_table(database, table_name, location, columns, account_details=None):
+    '''
+    create_csv_table Registers a glue table over a folder of athena csv
+    results, every column is read as a string. A retry replaces the table
+    its failed attempt created.
+    :param database: The glue database
+    :type database: Python String
+    :param table_name: The glue table name
+    :type table_name: Python String
+    :param location: The s3 folder of the results, ending with a /
+    :type location: Python String
+    :param columns: The result columns, from get_result_columns
+    :type columns: Python List - Dict
+    :param account_details: The curation's region and roleArn (optional)
+    :type account_details: Python Dict / None
+    '''
+    client = get_client('glue', account_details)
+
+    table_input = {
+        'Name': table_name,
+        'TableType': 'EXTERNAL_TABLE',
+        'Parameters': {
+            'classification': 'csv',
+            'skip.header.line.count': '1'
+        },
+        'StorageDescriptor': get_csv_storage_descriptor(
+            location, [{'name': column['name'], 'type': 'string'} for column in columns])
+    }
+    try:
+        client.create_table(DatabaseName=database, TableInput=table_input)
+    except client.exceptions.AlreadyExistsException:
+        # Created by an attempt that failed before its query started, the
+        # names are unique per query so it is the same table
+        client.update_table(DatabaseName=database, TableInput=table_input)
+
+def get_csv_storage_descriptor(location, columns):
+    return {
+        'Columns': [{'Name': column['name'], 'Type': column['type']} for column in columns],
+        'Location': location,
+        'InputFormat': TEXT_INPUT_FORMAT,
+        'OutputFormat': TEXT_OUTPUT_FORMAT,
+        'SerdeInfo': {
+            'SerializationLibrary': CSV_SERDE,
+            'Parameters': {
+                'separatorChar': ',',
+                'quoteChar': '"',
+                'escapeChar': '\\'
+            }
+        }
+    }
+
+def delete_table(database, table_name, account_details=None):
+    client = get_client('glue', account_details)
+
+    try:
+        client.delete_table(DatabaseName=database, Name=table_name)
+    except client.exceptions.EntityNotFoundException:
+        pass
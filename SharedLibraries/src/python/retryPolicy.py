@@ -0,0 +1,91 @@
+import random
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+# Error codes AWS services use when a request is throttled
+THROTTLING_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded',
+    'BandwidthLimitExceeded',
+    'LimitExceededException',
+    'SlowDown',
+    'PriorRequestNotComplete'
+}
+# Error codes of failures that may succeed if the request is made again
+TRANSIENT_CODES = {
+    'InternalError',
+    'InternalFailure',
+    'InternalServerError',
+    'InternalServerException',
+    'ServiceUnavailable',
+    'ServiceUnavailableException',
+    'RequestTimeout',
+    'RequestTimeoutException',
+    'TransactionInProgressException',
+    'Unavailable'
+}
+
+# The state machine retries these by name, every other error is terminal
+class RetryableException(Exception):
+    pass
+
+class ThrottledException(Exception):
+    pass
+
+def classify_exception(e, terminal_exception):
+    '''
+    classify_exception Wraps an exception raised by a handler in the
+    exception the state machine retries for it: ThrottledException with a
+    long jittered backoff, RetryableException with a short one, or the
+    handler's own (terminal) exception which is never retried.
+    :param e: The exception raised by the handler
+    :type e: Exception
+    :param terminal_exception: The handler's exception class
+    :type terminal_exception: Python Class
+    :return: The exception to raise
+    :rtype: Exception
+    '''
+    if isinstance(e, (RetryableException, ThrottledException, terminal_exception)):
+        return e
+    if is_throttling_error(e):
+        return ThrottledException(e)
+    if is_transient_error(e):
+        return RetryableException(e)
+
+    return terminal_exception(e)
+
+def is_throttling_error(e):
+    return isinstance(e, ClientError) and get_error_code(e) in THROTTLING_CODES
+
+def is_transient_error(e):
+    if isinstance(e, (ConnectionError, HTTPClientError)):
+        return True
+    if not isinstance(e, ClientError):
+        return False
+
+    status_code = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+    return get_error_code(e) in TRANSIENT_CODES or status_code >= 500
+
+def get_error_code(e):
+    return e.response.get('Error', {}).get('Code')
+
+def backoff_delay(attempt, base=0.5, cap=20.0):
+    '''
+    backoff_delay The "full jitter" delay before retrying, a random time up to
+    the exponential backoff, so throttled callers do not retry in step.
+    :param attempt: The number of attempts made so far, from 1
+    :type attempt: Python Integer
+    :param base: The backoff of the first retry, in seconds
+    :type base: Python Float
+    :param cap: The longest backoff, in seconds
+    :type cap: Python Float
+    :return: The delay in seconds
+    :rtype: Python Float
+    '''
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
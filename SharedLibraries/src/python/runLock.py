@@ -0,0 +1,164 @@
+import logging
+import os
+import time
+
+from awsClients import get_resource
+from pipelineLogging import get_logger, log_event
+
+# What a run does while another run of the same curation holds the lock
+OVERLAP_SKIP = 'skip'           # The run ends without running the curation
+OVERLAP_QUEUE = 'queue'         # The run waits for the lock
+OVERLAP_SUPERSEDE = 'supersede' # The running execution is stopped and the run takes over
+OVERLAP_POLICIES = [OVERLAP_SKIP, OVERLAP_QUEUE, OVERLAP_SUPERSEDE]
+
+# The lock expires after this long if a run never releases it,
+# e.g. an execution that timed out or was stopped
+LEASE_SECONDS = int(os.environ.get('RUN_LEASE_SECONDS', '7200'))
+
+logger = get_logger(__name__)
+
+def get_lock_key(curation_type):
+    return f'lock#{curation_type}'
+
+def acquire_run_lock(table_name, curation_type, execution_name, execution_arn=None):
+    '''
+    acquire_run_lock Takes the run lock of the curation type, unless
+    another execution holds an unexpired lease on it.
+    :param table_name: The curation state table name
+    :type table_name: Python String
+    :param curation_type: The curation type
+    :type curation_type: Python String
+    :param execution_name: The curation execution name
+    :type execution_name: Python String
+    :param execution_arn: The execution ARN, used to stop it if superseded
+    :type execution_arn: Python String / None
+    :return: None if the lock was taken, otherwise the lock held by the other run
+    :rtype: Python Dict / None
+    '''
+    table = get_resource('dynamodb').Table(table_name)
+    now = int(time.time())
+    try:
+        table.put_item(
+            Item=get_lock_item(curation_type, execution_name, execution_arn, now),
+            # The same execution taking the lock again, e.g. on a retry, keeps it
+            ConditionExpression='attribute_not_exists(stateKey) OR expiresAt < :now OR executionName = :executionName',
+            ExpressionAttributeValues={':now': now, ':executionName': execution_name}
+        )
+        return None
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        lock = table.get_item(Key={'stateKey': get_lock_key(curation_type)}, ConsistentRead=True).get('Item')
+        # Released in between, try once more
+        if lock == None:
+            return acquire_run_lock(table_name, curation_type, execution_name, execution_arn)
+        return lock
+
+def take_over_run_lock(table_name, curation_type, execution_name, execution_arn, holder_execution_name):
+    '''
+    take_over_run_lock Takes the run lock from the execution holding it.
+    :param holder_execution_name: The execution the lock is taken from
+    :type holder_execution_name: Python String
+    :return: Whether the lock was taken, False if it changed hands meanwhile
+    :rtype: Python Boolean
+    '''
+    table = get_resource('dynamodb').Table(table_name)
+    try:
+        table.put_item(
+            Item=get_lock_item(curation_type, execution_name, execution_arn, int(time.time())),
+            ConditionExpression='executionName = :holder',
+            ExpressionAttributeValues={':holder': holder_execution_name}
+        )
+        return True
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+def release_run_lock(table_name, curation_type, execution_name):
+    '''
+    release_run_lock Releases the run lock of the curation type, if it is
+    still held by the execution.
+    :param table_name: The curation state table name
+    :type table_name: Python String
+    :param curation_type: The curation type
+    :type curation_type: Python String
+    :param execution_name: The curation execution name
+    :type execution_name: Python String
+    '''
+    table = get_resource('dynamodb').Table(table_name)
+    try:
+        table.delete_item(
+            Key={'stateKey': get_lock_key(curation_type)},
+            ConditionExpression='executionName = :executionName',
+            ExpressionAttributeValues={':executionName': execution_name}
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        log_event(
+            logger, logging.WARNING, 'Run lock was no longer held',
+            curationType=curation_type, curationExecutionName=execution_name)
+
+def record_lock_query(table_name, curation_type, execution_name, run_query):
+    '''
+    record_lock_query Records the athena query of the run on its lock, so
+    a run superseding it can stop the query and release a shared result.
+    :param table_name: The curation state table name
+    :type table_name: Python String
+    :param curation_type: The curation type
+    :type curation_type: Python String
+    :param execution_name: The curation execution name
+    :type execution_name: Python String
+    :param run_query: The queryExecutionId, queryOutputLocation, and shareKey and accountDetails if any
+    :type run_query: Python Dict
+    '''
+    table = get_resource('dynamodb').Table(table_name)
+    try:
+        table.update_item(
+            Key={'stateKey': get_lock_key(curation_type)},
+            UpdateExpression='SET runQuery = :runQuery',
+            ConditionExpression='executionName = :executionName',
+            ExpressionAttributeValues={':runQuery': run_query, ':executionName': execution_name}
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        log_event(
+            logger, logging.WARNING, 'Run lock was no longer held',
+            curationType=curation_type, curationExecutionName=execution_name)
+
+def get_lock_item(curation_type, execution_name, execution_arn, now):
+    item = {
+        'stateKey': get_lock_key(curation_type),
+        'executionName': execution_name,
+        'acquiredAt': now,
+        'expiresAt': now + LEASE_SECONDS
+    }
+    if execution_arn != None:
+        item['executionArn'] = execution_arn
+
+    return item
+
+def claim_trigger(table_name, execution_name):
+    '''
+    claim_trigger Records that an execution was started for the trigger.
+    Express executions are not unique by name, so repeated deliveries of
+    the same scheduled trigger are rejected here instead.
+    :param table_name: The curation state table name
+    :type table_name: Python String
+    :param execution_name: The curation execution name, unique per schedule slot
+    :type execution_name: Python String
+    :return: Whether the trigger was claimed, False if it already was
+    :rtype: Python Boolean
+    '''
+    table = get_resource('dynamodb').Table(table_name)
+    now = int(time.time())
+    try:
+        table.put_item(
+            Item={'stateKey': get_trigger_key(execution_name), 'claimedAt': now, 'expiresAt': now + LEASE_SECONDS},
+            ConditionExpression='attribute_not_exists(stateKey)'
+        )
+        return True
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+def release_trigger(table_name, execution_name):
+    # Lets a retried delivery start the execution that failed to start
+    get_resource('dynamodb').Table(table_name).delete_item(
+        Key={'stateKey': get_trigger_key(execution_name)})
+
+def get_trigger_key(execution_name):
+    return f'trigger#{execution_name}'
@@ -0,0 +1,244 @@
+import hashlib
+import re
+from calendar import monthrange
+
+MINUTES_PER_DAY = 24 * 60
+
+CRON_PATTERN = re.compile(r'^cron\((.*)\)$')
+RATE_PATTERN = re.compile(r'^rate\((\d+)\s+(minute|minutes|hour|hours|day|days)\)$')
+RATE_UNIT_MINUTES = {'minute': 1, 'hour': 60, 'day': MINUTES_PER_DAY}
+MONTH_NAMES = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+# EventBridge numbers the days of the week from 1 (Sunday)
+DAY_NAMES = ['SUN', 'MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT']
+# The values each cron field accepts, between commas
+CRON_FIELD_PATTERNS = [
+    ('minutes', re.compile(r'^(\*|\d{1,2}(-\d{1,2})?)(/\d+)?$')),
+    ('hours', re.compile(r'^(\*|\d{1,2}(-\d{1,2})?)(/\d+)?$')),
+    ('day of month', re.compile(r'^(\?|L|\d{1,2}W|(\*|\d{1,2}(-\d{1,2})?)(/\d+)?)$')),
+    ('month', re.compile(r'^(\*|(\d{1,2}|[A-Z]{3})(-(\d{1,2}|[A-Z]{3}))?)(/\d+)?$', re.IGNORECASE)),
+    ('day of week', re.compile(r'^(\?|L|\d#\d|\dL|(\*|([1-7]|[A-Z]{3})(-([1-7]|[A-Z]{3}))?)(/\d+)?)$', re.IGNORECASE)),
+    ('year', re.compile(r'^(\*|\d{4}(-\d{4})?)(/\d+)?$'))
+]
+
+def parse_cron(schedule_expression):
+    '''
+    parse_cron Splits an EventBridge cron expression into its minutes,
+    hours, day of month, month, day of week and year fields.
+    :param schedule_expression: The schedule expression, e.g. cron(0 * * * ? *)
+    :type schedule_expression: Python String
+    :return: The six fields, or None if it is not a cron expression
+    :rtype: Python List / None
+    '''
+    match = CRON_PATTERN.match(schedule_expression.strip())
+    if match == None:
+        return None
+
+    fields = match.group(1).split()
+    if len(fields) != 6:
+        raise ValueError(f'Cron expression {schedule_expression} does not have 6 fields')
+    return fields
+
+def validate_schedule_expression(schedule_expression):
+    '''
+    validate_schedule_expression Checks a cron or rate expression follows
+    the EventBridge syntax, so a bad schedule fails before its rule is put.
+    :param schedule_expression: The schedule expression
+    :type schedule_expression: Python String
+    :raises ValueError: If the expression is not valid
+    '''
+    rate = RATE_PATTERN.match(schedule_expression.strip())
+    if rate != None:
+        value, unit = int(rate.group(1)), rate.group(2)
+        if value < 1 or (value == 1) != (not unit.endswith('s')):
+            raise ValueError(f'Rate expression {schedule_expression} must be rate(1 unit) or rate(n units)')
+        return
+
+    fields = parse_cron(schedule_expression)
+    if fields == None:
+        raise ValueError(f'Schedule expression {schedule_expression} must be cron(...) or rate(...)')
+
+    for field, (name, pattern) in zip(fields, CRON_FIELD_PATTERNS):
+        if not all(pattern.match(part) for part in field.split(',')):
+            raise ValueError(f'Cron expression {schedule_expression} has an invalid {name} field {field}')
+    # One of the day fields must be ?, EventBridge does not combine them
+    if (fields[2] == '?') == (fields[4] == '?'):
+        raise ValueError(f'Cron expression {schedule_expression} must use ? in one of day of month or day of week')
+
+def get_schedule_offset(curation_type, window_minutes):
+    '''
+    get_schedule_offset Returns the minute offset of a curation within the
+    window; the same curation type is always given the same offset, so
+    its schedule does not move when the rule is recreated.
+    :param curation_type: The curation type
+    :type curation_type: Python String
+    :param window_minutes: The number of minutes runs may be spread over
+    :type window_minutes: Python Integer
+    :return: The offset in minutes, from 0 to window_minutes - 1
+    :rtype: Python Integer
+    '''
+    if window_minutes <= 1:
+        return 0
+
+    digest = hashlib.sha256(curation_type.encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) % window_minutes
+
+def spread_schedule(schedule_expression, curation_type, window_minutes):
+    '''
+    spread_schedule Moves the minutes a cron expression fires on by the
+    curation's offset, so curations scheduled for the same minute start
+    across the window instead. Runs are only moved later, and never into
+    the next run or hour. Rate expressions, every minute schedules and
+    minute ranges are returned as they are.
+    :param schedule_expression: The schedule expression
+    :type schedule_expression: Python String
+    :param curation_type: The curation type
+    :type curation_type: Python String
+    :param window_minutes: The number of minutes runs may be spread over
+    :type window_minutes: Python Integer
+    :return: The spread schedule expression
+    :rtype: Python String
+    '''
+    fields = parse_cron(schedule_expression)
+    if fields == None or window_minutes <= 1:
+        return schedule_expression
+
+    minutes = fields[0]
+    if re.match(r'^\d+$', minutes):
+        start = int(minutes)
+        offset = get_schedule_offset(curation_type, min(window_minutes, 60 - start))
+        fields[0] = str(start + offset)
+    elif re.match(r'^(\*|\d+)/\d+$', minutes):
+        start, step = minutes.split('/')
+        start = 0 if start == '*' else int(start)
+        step = int(step)
+        if start >= step:
+            return schedule_expression
+        offset = get_schedule_offset(curation_type, min(window_minutes, step - start))
+        fields[0] = f'{start + offset}/{step}'
+    elif re.match(r'^\d+(,\d+)+$', minutes):
+        values = sorted(int(value) for value in minutes.split(','))
+        gap = min(later - earlier for earlier, later in zip(values, values[1:]))
+        offset = get_schedule_offset(curation_type, min(window_minutes, gap, 60 - values[-1]))
+        fields[0] = ','.join(str(value + offset) for value in values)
+    else:
+        return schedule_expression
+
+    return f'cron({" ".join(fields)})'
+
+def get_planned_expression(item, window_minutes):
+    # The schedule the curation's event rule is created with
+    if item.get('spreadSchedule') == False:
+        return item['cronExpression']
+
+    return spread_schedule(item['cronExpression'], item['curationType'], window_minutes)
+
+def get_start_minutes(schedule_expression, day):
+    '''
+    get_start_minutes Lists the minutes of the day (UTC) a schedule starts
+    a curation on. Rate expressions are assumed to start at midnight.
+    :param schedule_expression: The schedule expression
+    :type schedule_expression: Python String
+    :param day: The day
+    :type day: datetime.date
+    :return: The minutes since midnight
+    :rtype: Python List
+    :raises ValueError: If the expression uses L, W or # or is not valid
+    '''
+    rate = RATE_PATTERN.match(schedule_expression.strip())
+    if rate != None:
+        interval = int(rate.group(1)) * RATE_UNIT_MINUTES[rate.group(2).rstrip('s')]
+        return list(range(0, MINUTES_PER_DAY, interval))
+
+    fields = parse_cron(schedule_expression)
+    if fields == None:
+        raise ValueError(f'Unsupported schedule expression {schedule_expression}')
+    minutes, hours, days_of_month, months, days_of_week, years = fields
+
+    last_day = monthrange(day.year, day.month)[1]
+    runs_today = match_field(days_of_month, day.day, 1, last_day) and \
+        match_field(months, day.month, 1, 12, MONTH_NAMES) and \
+        match_field(days_of_week, (day.weekday() + 1) % 7 + 1, 1, 7, DAY_NAMES) and \
+        match_field(years, day.year, 1970, 2199)
+    if not runs_today:
+        return []
+
+    return [hour * 60 + minute
+        for hour in range(24) if match_field(hours, hour, 0, 23)
+        for minute in range(60) if match_field(minutes, minute, 0, 59)]
+
+def match_field(field, value, low, high, names=None):
+    '''
+    match_field Checks a value against a cron field of values, ranges,
+    steps and lists, e.g. 0/15, MON-FRI or 1,15.
+    :return: Whether the field includes the value
+    :rtype: Python Boolean
+    '''
+    if field in ('*', '?'):
+        return True
+
+    for part in field.split(','):
+        part_range, _, step = part.partition('/')
+        if part_range == '*':
+            start, end = low, high
+        elif '-' in part_range:
+            start, end = (to_field_value(bound, names) for bound in part_range.split('-'))
+        else:
+            start = to_field_value(part_range, names)
+            end = high if step else start
+
+        step = int(step) if step else 1
+        if start <= value <= end and (value - start) % step == 0:
+            return True
+
+    return False
+
+def to_field_value(value, names=None):
+    if names != None and value.upper() in names:
+        return names.index(value.upper()) + 1
+    if not value.isdigit():
+        raise ValueError(f'Unsupported cron field value {value}')
+    return int(value)
+
+def project_concurrency(schedules, day, duration_minutes=1):
+    '''
+    project_concurrency Projects how many curations are running in each
+    minute of the day, assuming each runs for the given duration.
+    :param schedules: The schedule expression of each curation
+    :type schedules: Python List
+    :param day: The day
+    :type day: datetime.date
+    :param duration_minutes: How long each curation runs for
+    :type duration_minutes: Python Integer
+    :return: The number of curations running in each minute of the day
+    :rtype: Python List
+    '''
+    running = [0] * MINUTES_PER_DAY
+    for schedule_expression in schedules:
+        for start in get_start_minutes(schedule_expression, day):
+            for minute in range(start, min(start + duration_minutes, MINUTES_PER_DAY)):
+                running[minute] += 1
+
+    return running
+
+def summarize_concurrency(running, busiest=10):
+    '''
+    summarize_concurrency Summarizes a projected concurrency profile with
+    its peak and busiest minutes.
+    :param running: The number of curations running in each minute
+    :type running: Python List
+    :param busiest: The number of busiest minutes to list
+    :type busiest: Python Integer
+    :return: The peak, the mean over the busy minutes and the busiest minutes (HH:MM)
+    :rtype: Python Dict
+    '''
+    busy_minutes = [minute for minute in range(len(running)) if running[minute] > 0]
+    busiest_minutes = sorted(busy_minutes, key=lambda minute: (-running[minute], minute))[:busiest]
+
+    return {
+        'peak': max(running) if running else 0,
+        'meanBusy': round(sum(running) / len(busy_minutes), 2) if busy_minutes else 0,
+        'busyMinutes': len(busy_minutes),
+        'busiestMinutes': [
+            {'minute': f'{minute // 60:02d}:{minute % 60:02d}', 'curations': running[minute]}
+            for minute in busiest_minutes]
+    }
@@ -0,0 +1,166 @@
+import json
+import logging
+import traceback
+from collections import OrderedDict
+
+from boto3.dynamodb.types import TypeDeserializer
+
+from pipelineLogging import get_logger, log_event
+
+logger = get_logger(__name__)
+
+# Subclass of boto's TypeDeserializer for DynamoDB to adjust
+# for DynamoDB Stream format.
+class StreamTypeDeserializer(TypeDeserializer):
+    def _deserialize_n(self, value):
+        return float(value)
+
+    def _deserialize_b(self, value):
+        return value  # Already in Base64
+
+deserializer = StreamTypeDeserializer()
+
+class StreamRecord:
+    '''
+    StreamRecord Wraps a DynamoDB stream record, deserializing the keys and
+    image attributes only when they are first asked for.
+    '''
+    def __init__(self, record):
+        self.record = record
+        self.dynamodb = record['dynamodb']
+        self.event_name = record['eventName'].upper()  # INSERT, MODIFY, REMOVE
+        self.sequence_number = self.dynamodb['SequenceNumber']
+        # The earliest sequence number in the batch for this key, used
+        # as the checkpoint when the record is deduplicated
+        self.first_sequence_number = self.sequence_number
+        self.deserialized = {}
+
+    @property
+    def key_id(self):
+        # Raw key attributes are compared, so no deserialization is needed
+        return json.dumps(self.dynamodb['Keys'], sort_keys=True)
+
+    @property
+    def keys(self):
+        if 'Keys' not in self.deserialized:
+            self.deserialized['Keys'] = deserializer.deserialize({'M': self.dynamodb['Keys']})
+        return self.deserialized['Keys']
+
+    @property
+    def table_name(self):
+        # arn:aws:dynamodb:region:account:table/name/stream/label
+        return self.record['eventSourceARN'].split(':')[5].split('/')[1]
+
+    @property
+    def user_identity(self):
+        return self.record.get('userIdentity', {})
+
+    @property
+    def has_new_image(self):
+        return 'NewImage' in self.dynamodb
+
+    @property
+    def has_old_image(self):
+        return 'OldImage' in self.dynamodb
+
+    def get_new(self, name, default=None):
+        return self.get_attribute('NewImage', name, default)
+
+    def get_old(self, name, default=None):
+        return self.get_attribute('OldImage', name, default)
+
+    def new_image(self, fields=None):
+        return self.get_image('NewImage', fields)
+
+    def old_image(self, fields=None):
+        return self.get_image('OldImage', fields)
+
+    def get_attribute(self, image_name, name, default):
+        image = self.dynamodb.get(image_name, {})
+        if name not in image:
+            return default
+
+        cache_key = (image_name, name)
+        if cache_key not in self.deserialized:
+            self.deserialized[cache_key] = deserializer.deserialize(image[name])
+        return self.deserialized[cache_key]
+
+    def get_image(self, image_name, fields):
+        image = self.dynamodb[image_name]
+        if fields == None:
+            return deserializer.deserialize({'M': image})
+
+        return {name: self.get_attribute(image_name, name, None)
+            for name in fields if name in image}
+
+def get_records(event, event_names=None, deduplicate=False):
+    '''
+    get_records Wraps the stream records of a lambda event.
+    :param event: The DynamoDB stream lambda event
+    :type event: Python Dict
+    :param event_names: Only return these event types, e.g. ('INSERT', 'MODIFY')
+    :type event_names: Python Tuple / List, optional
+    :param deduplicate: Only return the last record for each key
+    :type deduplicate: Python Boolean, optional
+    :return: The stream records, in order of each key's last record
+    :rtype: Python List - StreamRecord
+    '''
+    records = [StreamRecord(record) for record in event['Records']]
+    if event_names != None:
+        records = [record for record in records if record.event_name in event_names]
+    if not deduplicate:
+        return records
+
+    latest = OrderedDict()
+    for record in records:
+        key_id = record.key_id
+        if key_id in latest:
+            record.first_sequence_number = latest[key_id].first_sequence_number
+            del latest[key_id]  # Re-inserted so the order follows the last record
+        latest[key_id] = record
+
+    if len(latest) < len(records):
+        log_event(
+            logger, logging.DEBUG, 'Deduplicated stream records',
+            records=len(records), uniqueKeys=len(latest))
+    return list(latest.values())
+
+def process_records(event, handler, event_names=None, deduplicate=True):
+    '''
+    process_records Calls the handler for each (deduplicated) stream record,
+    stopping at the first failure and reporting it as the checkpoint so
+    lambda only retries from that record. Requires the event source mapping
+    to use the ReportBatchItemFailures function response type.
+    :param event: The DynamoDB stream lambda event
+    :type event: Python Dict
+    :param handler: Called with each StreamRecord
+    :type handler: Python Function
+    :param event_names: Only process these event types
+    :type event_names: Python Tuple / List, optional
+    :param deduplicate: Only process the last record for each key
+    :type deduplicate: Python Boolean, optional
+    :return: The partial batch response
+    :rtype: Python Dict
+    '''
+    for record in get_records(event, event_names, deduplicate):
+        try:
+            handler(record)
+        except Exception:
+            logger.error(traceback.format_exc())
+            return batch_item_failures(record)
+
+    return batch_item_failures()
+
+def batch_item_failures(record=None):
+    '''
+    batch_item_failures Builds the partial batch response, lambda retries
+    the batch from the earliest reported sequence number.
+    :param record: The failed record, or None if the batch succeeded
+    :type record: StreamRecord, optional
+    :return: The partial batch response
+    :rtype: Python Dict
+    '''
+    if record == None:
+        return {'batchItemFailures': []}
+
+    return {'batchItemFailures': [{'itemIdentifier': record.first_sequence_number}]}
@@ -0,0 +1,70 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# Finalization calls are short S3, DynamoDB and SNS round trips
+MAX_TASK_WORKERS = 8
+
+class TaskGraph:
+    '''
+    TaskGraph Runs independent AWS calls concurrently, each task starting
+    as soon as the tasks it depends on have succeeded. A failed task stops
+    its dependents from starting, e.g. no delete runs before its copy.
+    '''
+    def __init__(self):
+        self.tasks = {}
+
+    def add(self, name, function, *args, depends_on=(), **kwargs):
+        '''
+        add Adds a task to the graph, dependencies must be added first.
+        :param name: The unique name of the task
+        :type name: Python String
+        :param function: Called with the remaining args and kwargs
+        :type function: Python Callable
+        :param depends_on: The names of the tasks that must succeed first
+        :type depends_on: Python List / Tuple
+        :return: The name of the task
+        :rtype: Python String
+        '''
+        missing = [dependency for dependency in depends_on if dependency not in self.tasks]
+        if name in self.tasks or missing:
+            raise ValueError(f'Task {name} is already added or depends on unknown tasks {missing}')
+
+        self.tasks[name] = (function, args, kwargs, tuple(depends_on))
+        return name
+
+    def run(self, max_workers=MAX_TASK_WORKERS):
+        '''
+        run Runs every task, waiting for the running tasks to finish before
+        raising the first exception, so no call is left in flight.
+        :param max_workers: The number of tasks running at the same time
+        :type max_workers: Python Integer
+        :return: The result of each task by name
+        :rtype: Python Dict
+        '''
+        results = {}
+        errors = []
+        pending = dict(self.tasks)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                if not errors:
+                    ready = [name for name, (_, _, _, depends_on) in pending.items()
+                        if all(dependency in results for dependency in depends_on)]
+                    for name in ready:
+                        function, args, kwargs, _ = pending.pop(name)
+                        running[executor.submit(function, *args, **kwargs)] = name
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() != None:
+                        errors.append(future.exception())
+                    else:
+                        results[name] = future.result()
+
+        if errors:
+            raise errors[0]
+
+        return results
@@ -0,0 +1,61 @@
+import functools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from awsClients import get_client
+
+# Each ping holds its container this long, so concurrent pings are spread
+# over that many containers rather than all served by the first one
+PING_MILLISECONDS = 100
+# The most pings sent to one function at a time
+MAX_PING_WORKERS = 50
+
+def is_warm_up(event):
+    return isinstance(event, dict) and event.get('warmUp') == True
+
+def warmable(handler):
+    '''
+    warmable Decorates a lambda handler so that warm-up pings, events of
+    {"warmUp": true}, return straight away without running the handler.
+    :param handler: The lambda handler
+    :type handler: Python Function
+    :return: The decorated handler
+    :rtype: Python Function
+    '''
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if is_warm_up(event):
+            time.sleep(PING_MILLISECONDS / 1000)
+            return {'warmUp': True}
+
+        return handler(event, context)
+
+    return wrapper
+
+def warm_up_function(function_name, concurrency):
+    '''
+    warm_up_function Sends concurrent warm-up pings to a function, so at
+    least that many of its containers are initialised.
+    :param function_name: The lambda function name
+    :type function_name: Python String
+    :param concurrency: The number of containers to warm
+    :type concurrency: Python Integer
+    :return: The number of pings answered
+    :rtype: Python Integer
+    '''
+    with ThreadPoolExecutor(max_workers=min(concurrency, MAX_PING_WORKERS)) as executor:
+        return sum(executor.map(lambda _: ping(function_name), range(concurrency)))
+
+def ping(function_name):
+    client = get_client('lambda')
+
+    try:
+        response = client.invoke(
+            FunctionName=function_name,
+            Payload=json.dumps({'warmUp': True}).encode('utf-8')
+        )
+        return 1 if 'FunctionError' not in response else 0
+    except Exception:
+        # Throttled or failed pings only leave a container cold
+        return 0
@@ -0,0 +1,124 @@
+import math
+import os
+import time
+
+from boto3.dynamodb.conditions import Attr, Key
+
+from awsClients import get_resource
+from runLock import OVERLAP_QUEUE
+
+WORKFLOW_STANDARD = 'standard'
+WORKFLOW_EXPRESS = 'express'
+
+# Curations whose recent runs took at most this long (95th percentile) run on
+# the express state machine, 0 runs every curation on the standard one
+EXPRESS_MAX_DURATION_SECONDS = int(os.environ.get('EXPRESS_MAX_DURATION_SECONDS', '0'))
+# The number of recent runs a curation needs before it is routed on its history
+EXPRESS_MIN_RUNS = int(os.environ.get('EXPRESS_MIN_RUNS', '10'))
+# The most recent runs the percentile is taken over
+HISTORY_SAMPLE_SIZE = 20
+# History items read per page while looking for them, and the most pages
+# read, so a long history without durations is not read in full
+HISTORY_PAGE_SIZE = 100
+MAX_HISTORY_PAGES = 5
+# Express executions are stopped after 5 minutes without running their catch,
+# so queries still running after this long fail the curation instead and it
+# is recorded as unsuccessful
+EXPRESS_DEADLINE_SECONDS = 240
+
+def choose_workflow(curation_history_table, curation_type, overlap_policy=None):
+    '''
+    choose_workflow Chooses the state machine a curation runs on from the
+    duration of its recent runs in the curation history. Curations that
+    have run often enough and finished within EXPRESS_MAX_DURATION_SECONDS
+    95% of the time run on the express state machine, all others on the
+    standard one.
+    :param curation_history_table: The curation history table name
+    :type curation_history_table: Python String
+    :param curation_type: The curation type
+    :type curation_type: Python String
+    :param overlap_policy: The curation's overlap policy
+    :type overlap_policy: Python String / None
+    :return: The workflow type and the 95th percentile duration in milliseconds, if known
+    :rtype: Python Tuple - (String, Integer / None)
+    '''
+    # A queued run can wait longer than an express execution may run
+    if EXPRESS_MAX_DURATION_SECONDS <= 0 or overlap_policy == OVERLAP_QUEUE:
+        return WORKFLOW_STANDARD, None
+
+    durations = get_recent_durations(curation_history_table, curation_type)
+    if len(durations) < EXPRESS_MIN_RUNS:
+        return WORKFLOW_STANDARD, None
+
+    p95 = get_percentile(durations, 95)
+    if p95 > EXPRESS_MAX_DURATION_SECONDS * 1000:
+        return WORKFLOW_STANDARD, p95
+
+    return WORKFLOW_EXPRESS, p95
+
+def get_recent_durations(curation_history_table, curation_type):
+    '''
+    get_recent_durations Reads the durations of the most recent runs of the
+    curation, skipping runs recorded before durations were, or that failed
+    to start, which have none.
+    :param curation_history_table: The curation history table name
+    :type curation_history_table: Python String
+    :param curation_type: The curation type
+    :type curation_type: Python String
+    :return: Up to HISTORY_SAMPLE_SIZE durations in milliseconds, most recent first
+    :rtype: Python List
+    '''
+    table = get_resource('dynamodb').Table(curation_history_table)
+
+    # The limit applies before the filter, so pages are read until enough
+    # runs with a duration have been found
+    query_args = {
+        'KeyConditionExpression': Key('curationType').eq(curation_type),
+        'FilterExpression': Attr('durationMs').exists(),
+        'ProjectionExpression': 'durationMs',
+        'ScanIndexForward': False,
+        'Limit': HISTORY_PAGE_SIZE
+    }
+    durations = []
+    for _ in range(MAX_HISTORY_PAGES):
+        response = table.query(**query_args)
+        durations += [int(item['durationMs']) for item in response['Items']]
+        if len(durations) >= HISTORY_SAMPLE_SIZE or 'LastEvaluatedKey' not in response:
+            break
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    return durations[:HISTORY_SAMPLE_SIZE]
+
+def get_percentile(values, percentile):
+    '''
+    get_percentile Returns the nearest-rank percentile of the values.
+    :param values: The values, in any order
+    :type values: Python List
+    :param percentile: The percentile, 0 - 100
+    :type percentile: Python Integer
+    :return: The smallest value at least percentile percent of the values are less than or equal to
+    :rtype: Python Integer
+    '''
+    ordered = sorted(values)
+    rank = max(int(math.ceil(percentile / 100 * len(ordered))), 1)
+
+    return ordered[rank - 1]
+
+def get_deadline(start_time, workflow_type):
+    if workflow_type != WORKFLOW_EXPRESS:
+        return None
+
+    return start_time + EXPRESS_DEADLINE_SECONDS * 1000
+
+def is_past_deadline(event):
+    '''
+    is_past_deadline Whether an express execution has run for so long it
+    would be stopped before it could record the curation.
+    :param event: AWS Lambda uses this to pass in event data.
+    :type event: Python type - Dict / list / int / string / float / None
+    :return: Whether the execution is past its deadline
+    :rtype: Python Boolean
+    '''
+    deadline = event['curationDetails'].get('curationDeadline')
+
+    return deadline != None and int(time.time() * 1000) > deadline
@@ -0,0 +1,150 @@
+import argparse
+import datetime
+import logging
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+from pipelineLogging import get_logger, log_event
+from profiling import profiled
+from sendCurationHistoryUpdateToElasticsearch import (
+    DOC_ALIAS_FORMAT, build_index_actions, compute_doc_index, post_to_es,
+    put_index_template)
+from streamProcessing import StreamTypeDeserializer
+
+# Number of parallel scan segments (and threads) used by default
+DEFAULT_TOTAL_SEGMENTS = 8
+# Number of documents sent to ES in each bulk request
+BULK_CHUNK_SIZE = 500
+# Attributes that make up the key of the curation history table
+HISTORY_KEY_ATTRIBUTES = ['curationType', 'timestamp']
+
+logger = get_logger(__name__)
+
+
+class BackfillCurationHistoryToElasticsearch(Exception):
+    pass
+
+
+# Lambda handler, expects an event such as:
+# {"startTime": "2020-06-01T00:00:00", "endTime": "2020-07-01T00:00:00"}
+# Unlike the stream handler, errors are raised so the caller sees them
+@profiled
+def lambda_handler(event, context):
+    try:
+        return backfill(
+            event.get('tableName', os.environ.get('CURATION_HISTORY_TABLE_NAME')),
+            parse_time(event['startTime']),
+            parse_time(event['endTime']),
+            int(event.get('totalSegments', DEFAULT_TOTAL_SEGMENTS)))
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        raise BackfillCurationHistoryToElasticsearch(e)
+
+
+# Scan the curation history table in parallel segments and bulk load every
+# item with a timestamp within [start_time, end_time) into ES
+def backfill(table_name, start_time, end_time, total_segments):
+    doc_alias = DOC_ALIAS_FORMAT.format(table_name.lower())
+    put_index_template(doc_alias)
+
+    start_millis = to_epoch_millis(start_time)
+    end_millis = to_epoch_millis(end_time)
+    log_event(
+        logger, logging.INFO, 'Backfill started', tableName=table_name,
+        startTime=start_time.isoformat(), endTime=end_time.isoformat(),
+        totalSegments=total_segments)
+
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        futures = [
+            executor.submit(
+                backfill_segment, table_name, doc_alias, start_millis,
+                end_millis, segment, total_segments)
+            for segment in range(total_segments)]
+        documents = sum(future.result() for future in futures)
+
+    log_event(
+        logger, logging.INFO, 'Backfill complete', alias=doc_alias,
+        documents=documents)
+    return {'alias': doc_alias, 'documents': documents}
+
+
+# Scan a single segment, posting to ES every BULK_CHUNK_SIZE documents
+def backfill_segment(
+        table_name, doc_alias, start_millis, end_millis, segment,
+        total_segments):
+    # Clients are not shared between threads
+    client = boto3.session.Session().client('dynamodb')
+    paginator = client.get_paginator('scan')
+    ddb_deserializer = StreamTypeDeserializer()
+    now = datetime.datetime.utcnow()
+
+    documents = 0
+    es_actions = []
+    pages = paginator.paginate(
+        TableName=table_name,
+        Segment=segment,
+        TotalSegments=total_segments,
+        FilterExpression='#ts >= :start AND #ts < :end',
+        ExpressionAttributeNames={'#ts': 'timestamp'},
+        ExpressionAttributeValues={
+            ':start': {'N': str(start_millis)},
+            ':end': {'N': str(end_millis)}})
+    for page in pages:
+        for item in page['Items']:
+            doc_fields = ddb_deserializer.deserialize({'M': item})
+            doc_id = compute_doc_index(
+                {key: doc_fields[key] for key in HISTORY_KEY_ATTRIBUTES})
+            es_actions.extend(build_index_actions(
+                doc_alias, doc_id, doc_fields, now, 'backfill'))
+            documents += 1
+
+            if len(es_actions) >= BULK_CHUNK_SIZE * 2:
+                post_bulk(es_actions)
+                es_actions = []
+
+    if es_actions:
+        post_bulk(es_actions)
+
+    log_event(
+        logger, logging.INFO, 'Segment backfilled', segment=segment,
+        documents=documents)
+    return documents
+
+
+def post_bulk(es_actions):
+    es_actions.append('')  # Add one empty line to force final \n
+    post_to_es('\n'.join(es_actions))
+
+
+def parse_time(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S') \
+        if 'T' in value else datetime.datetime.strptime(value, '%Y-%m-%d')
+
+
+def to_epoch_millis(value):
+    epoch = datetime.datetime(1970, 1, 1)
+    return int((value - epoch).total_seconds() * 1000)
+
+
+# Command line entry point, ELASTICSEARCH_ENDPOINT and AWS_REGION must be set
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Backfill the curation history into elasticsearch.')
+    parser.add_argument(
+        '--table', required=True,
+        help='The curation history DynamoDB table name')
+    parser.add_argument(
+        '--start', required=True, type=parse_time,
+        help='Inclusive start, YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS (UTC)')
+    parser.add_argument(
+        '--end', required=True, type=parse_time,
+        help='Exclusive end, YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS (UTC)')
+    parser.add_argument(
+        '--segments', type=int, default=DEFAULT_TOTAL_SEGMENTS,
+        help='The number of parallel scan segments')
+    args = parser.parse_args()
+
+    backfill(args.table, args.start, args.end, args.segments)
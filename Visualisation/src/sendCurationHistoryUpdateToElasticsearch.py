@@ -10,22 +10,52 @@ from botocore.awsrequest import AWSRequest
 from botocore.credentials import get_credentials
 from botocore.endpoint import BotocoreHTTPSession
 from botocore.session import Session
-from boto3.dynamodb.types import TypeDeserializer
+
+from pipelineLogging import get_logger, log_event, log_payload
+from profiling import profiled
+from streamProcessing import batch_item_failures, get_records
 
 elasticsearch_endpoint = os.environ['ELASTICSEARCH_ENDPOINT']
-# Python formatter to generate index name from the DynamoDB
-# table name
-DOC_TABLE_FORMAT = '{}'
-# Python formatter to generate type name from the DynamoDB
-# tablename, default is to add '_type' suffix
-DOC_TYPE_FORMAT = '{}_type'
+# Python formatter to generate the alias name from the DynamoDB
+# table name, the alias spans all of the rolled indices. It cannot be
+# the table name, the index of deployments from before the rollover
+DOC_ALIAS_FORMAT = '{}-all'
+# Python formatter to generate the rolled index name from the alias
+# and the period of the document timestamp
+DOC_INDEX_FORMAT = '{}-{}'
+# How often a new index is rolled, either daily or monthly
+INDEX_ROLLOVER_PERIOD = os.environ.get('INDEX_ROLLOVER_PERIOD', 'monthly')
+INDEX_DATE_FORMATS = {
+    'daily': '%Y.%m.%d',
+    'monthly': '%Y.%m'
+}
+# Explicit mappings for the fields used to filter and aggregate in kibana,
+# everything else is left to dynamic mapping
+INDEX_MAPPINGS = {
+    'properties': {
+        '@timestamp': {'type': 'date'},
+        'timestamp': {'type': 'date', 'format': 'epoch_millis'},
+        'curationType': {'type': 'keyword'},
+        'curationExecutionName': {'type': 'keyword'},
+        'error': {'type': 'keyword'},
+        'errorCause': {
+            'properties': {
+                'errorType': {'type': 'keyword'},
+                'errorMessage': {'type': 'text'}
+            }
+        }
+    }
+}
 # Max number of retries for exponential backoff
 ES_MAX_RETRIES = 3
-# Set verbose debugging information
-DEBUG = True
 
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG if DEBUG else logging.INFO)
+# Level is set by the LOG_LEVEL environment variable, payloads are
+# only dumped (sampled and truncated) at DEBUG
+logger = get_logger(__name__)
+
+
+# Index templates already put by this container
+index_templates_created = set()
 
 
 class SendCurationHistoryUpdateToElasticsearch(Exception):
@@ -45,75 +75,107 @@ class ES_Exception(Exception):
                 status_code, payload))
 
 
-# Subclass of boto's TypeDeserializer for DynamoDB to adjust
-# for DynamoDB Stream format.
-class StreamTypeDeserializer(TypeDeserializer):
-    def _deserialize_n(self, value):
-        return float(value)
-
-    def _deserialize_b(self, value):
-        return value  # Already in Base64
-
-
-# Global lambda handler - catches all exceptions to avoid
-# dead letter in the DynamoDB Stream
+# Global lambda handler - catches all exceptions so the stream never
+# dead letters, a failed post is reported as a batch item failure so
+# the batch is retried (up to the event source mapping's retry limit)
+@profiled
 def lambda_handler(event, context):
     try:
         return _lambda_handler(event, context)
     except Exception:
         logger.error(traceback.format_exc())
+        records = get_records(event)
+        return batch_item_failures(records[0] if records else None)
 
 
 def _lambda_handler(event, context):
-    records = event['Records']
     now = datetime.datetime.utcnow()
 
-    ddb_deserializer = StreamTypeDeserializer()
+    # Only INSERT and MODIFY are sent to ES, and only the latest image of
+    # each item in the batch is needed
+    records = get_records(
+        event, event_names=('INSERT', 'MODIFY'), deduplicate=True)
+
     es_actions = []  # Items to be added/updated/removed from ES - for bulk API
     for record in records:
-        ddb = record['dynamodb']
-        ddb_table_name = get_table_name_from_arn(record['eventSourceARN'])
-        doc_seq = ddb['SequenceNumber']
-
-        # Compute DynamoDB table, type and index for item
-        doc_table = DOC_TABLE_FORMAT.format(ddb_table_name.lower())
-        doc_type = DOC_TYPE_FORMAT.format(ddb_table_name.lower())
-        doc_index = compute_doc_index(ddb['Keys'], ddb_deserializer)
-
-        # Get the event type
-        event_name = record['eventName'].upper()  # INSERT, MODIFY, REMOVE
-
-        # If DynamoDB INSERT or MODIFY, send 'index' to ES
-        if (event_name == 'INSERT') or (event_name == 'MODIFY'):
-            if 'NewImage' not in ddb:
-                logger.warning(
-                    'Cannot process stream if it does not contain NewImage')
-                continue
-
-            # Deserialize DynamoDB type to Python types
-            doc_fields = ddb_deserializer.deserialize({'M': ddb['NewImage']})
-            # Add metadata
-            doc_fields['@timestamp'] = now.isoformat()
-            doc_fields['@SequenceNumber'] = doc_seq
-
-            # Generate JSON payload
-            doc_json = json.dumps(doc_fields)
-
-            # Generate ES payload for item
-            action = {
-                'index': {
-                    '_index': doc_table,
-                    '_type': doc_type,
-                    '_id': doc_index}}
-            es_actions.append(json.dumps(action))
-            es_actions.append(doc_json)
+        if not record.has_new_image:
+            logger.warning(
+                'Cannot process stream if it does not contain NewImage')
+            continue
+
+        # Compute the alias and doc id for item
+        doc_alias = DOC_ALIAS_FORMAT.format(record.table_name.lower())
+        doc_id = compute_doc_index(record.keys)
+        put_index_template(doc_alias)
+
+        es_actions.extend(build_index_actions(
+            doc_alias, doc_id, record.new_image(), now,
+            record.sequence_number))
+
+    # Removals (such as expired history) are not sent, nothing to post
+    if not es_actions:
+        return batch_item_failures()
 
     # Prepare bulk payload
     es_actions.append('')  # Add one empty line to force final \n
     es_payload = '\n'.join(es_actions)
-    print("PAYLOAD:{}".format(es_payload))
+    log_payload(logger, 'Bulk payload', es_payload, records=len(records))
 
     post_to_es(es_payload)  # Post to ES with exponential backoff
+    return batch_item_failures()
+
+
+# Build the bulk API action and document lines for an item, the
+# document goes into the index rolled for its own timestamp
+def build_index_actions(doc_alias, doc_id, doc_fields, now, doc_seq):
+    if 'timestamp' in doc_fields:
+        doc_fields['timestamp'] = int(doc_fields['timestamp'])
+        doc_time = datetime.datetime.utcfromtimestamp(
+            doc_fields['timestamp'] / 1000)
+    else:
+        doc_time = now
+
+    # Add metadata
+    doc_fields['@timestamp'] = now.isoformat()
+    doc_fields['@SequenceNumber'] = doc_seq
+
+    action = {
+        'index': {
+            '_index': compute_index_name(doc_alias, doc_time),
+            '_id': doc_id}}
+    return [json.dumps(action), json.dumps(doc_fields)]
+
+
+# Compute the rolled index name for the alias and document time
+def compute_index_name(doc_alias, doc_time):
+    date_format = INDEX_DATE_FORMATS[INDEX_ROLLOVER_PERIOD]
+    return DOC_INDEX_FORMAT.format(doc_alias, doc_time.strftime(date_format))
+
+
+# Put the index template so every rolled index gets the mappings and
+# joins the alias, only done once per alias per container
+def put_index_template(doc_alias):
+    if doc_alias in index_templates_created:
+        return
+
+    template = {
+        'index_patterns': [DOC_INDEX_FORMAT.format(doc_alias, '*')],
+        'aliases': {doc_alias: {}},
+        'mappings': INDEX_MAPPINGS
+    }
+
+    es_region = os.environ['AWS_REGION']
+    session = Session({'region': es_region})
+    creds = get_credentials(session)
+    post_data_to_es(
+        json.dumps(template),
+        es_region,
+        creds,
+        elasticsearch_endpoint,
+        '/_template/{}'.format(doc_alias),
+        method='PUT')
+
+    index_templates_created.add(doc_alias)
 
 
 # High-level POST data to Amazon Elasticsearch Service with exponential backoff
@@ -141,31 +203,33 @@ def post_to_es(payload):
             es_ret = json.loads(es_ret_str)
 
             if es_ret['errors']:
-                logger.error(
-                    'ES post unsuccessful, errors present, took=%sms',
-                    es_ret['took'])
                 # Filter errors
                 es_errors = \
                     [item for item in es_ret['items'] if
                         item.get('index').get('error')]
-                logger.error(
-                    'List of items with errors: %s',
-                    json.dumps(es_errors))
+                log_event(
+                    logger, logging.ERROR,
+                    'ES post unsuccessful, errors present',
+                    took=es_ret['took'], errorCount=len(es_errors),
+                    errors=es_errors[:10])
             else:
-                logger.info('ES post successful, took=%sms', es_ret['took'])
+                log_event(
+                    logger, logging.INFO, 'ES post successful',
+                    took=es_ret['took'], items=len(es_ret['items']))
             break  # Sending to ES was ok, break retry loop
         except ES_Exception as e:
-            if (e.status_code >= 500) and (e.status_code <= 599):
-                retries += 1  # Candidate for retry
-        else:
-            raise  # Stop retrying, re-raise exception
+            retries += 1
+            # Only 5xx are candidates for retry, re-raise anything else
+            # or once the retries are used up
+            if (e.status_code < 500) or (e.status_code > 599) \
+                    or retries >= ES_MAX_RETRIES:
+                raise
 
 
 def post_data_to_es(
         payload, region, creds, host,
         path, method='POST', proto='https://'):
 
-    print("URL:{}".format(proto+host+path))
     req = AWSRequest(
         method=method,
         url=proto+host+path,
@@ -174,9 +238,10 @@ def post_data_to_es(
     SigV4Auth(creds, 'es', region).add_auth(req)
     http_session = BotocoreHTTPSession()
     res = http_session.send(req.prepare())
-    print("STATUS_CODE:{}".format(res.status_code))
-    print("CONTENT:{}".format(res._content))
-    print("ALL:{}".format(res))
+    log_event(
+        logger, logging.DEBUG, 'ES request complete',
+        url=proto+host+path, method=method, statusCode=res.status_code)
+    log_payload(logger, 'ES response', res._content)
 
     if res.status_code >= 200 and res.status_code <= 299:
         return res._content
@@ -184,17 +249,10 @@ def post_data_to_es(
         raise ES_Exception(res.status_code, res._content)
 
 
-# Extracts the DynamoDB table from an ARN
-def get_table_name_from_arn(arn):
-    return arn.split(':')[5].split('/')[1]
-
-
-# Compute a compound doc index from the key(s) of the object in
-# lexicographic order: "k1=key_val1|k2=key_val2"
-def compute_doc_index(keys_raw, deserializer):
+# Compute a compound doc index from the deserialized key(s) of the
+# object in lexicographic order: "k1=key_val1|k2=key_val2"
+def compute_doc_index(keys):
     index = []
-    for key in sorted(keys_raw):
-        index.append('{}={}'.format(
-            key,
-            deserializer.deserialize(keys_raw[key])))
+    for key in sorted(keys):
+        index.append('{}={}'.format(key, keys[key]))
     return '|'.join(index)
\ No newline at end of file